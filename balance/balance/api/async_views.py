@@ -0,0 +1,100 @@
+"""
+Async versions of the read views, routed by balance/asgi_urls.py
+when the app is served by an ASGI server.
+
+The DB work of a request runs in the thread of sync_to_async and the rates
+are fetched with an async HTTP client, so a request waiting for a slow
+rate provider holds only its coroutine, not a worker. The responses are
+the same as of the sync views.
+"""
+from asgiref.sync import sync_to_async
+
+from django.http import HttpResponse
+
+from rest_framework import status
+from rest_framework.request import Request
+
+from balance.profiling import profiled
+
+from .exceptions import RatesUnavailable, InvalidDateTime, NotModified
+from .models import Balance
+from .renderers import FastJSONRenderer
+from .views import GetBalance, GetTransactions, parse_moment
+from . import etags, rates
+
+
+def render(payload: dict, http_status: int, etag: str = None) -> HttpResponse:
+    response = HttpResponse(FastJSONRenderer().render(payload), status=http_status,
+                            content_type="application/json")
+    if etag is not None:
+        response["ETag"] = etag
+    return response
+
+
+def not_modified(etag: str) -> HttpResponse:
+    response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    del response["Content-Type"]
+    response["ETag"] = etag
+    return response
+
+
+async def get_balance(request, user_id: int, currency: str = "RUB") -> HttpResponse:
+    """
+    Async GetBalance
+    """
+    request = Request(request)
+    payload = {}
+    http_status = status.HTTP_200_OK
+    etag = None
+
+    try:
+        as_of = parse_moment(request, "as_of")
+        current = await sync_to_async(profiled(GetBalance.current_balance))(user_id)
+        rates_state = None
+        if currency != "RUB":
+            try:
+                rates_state = await rates.aget_rates()
+            except RatesUnavailable:
+                pass
+        version = GetBalance.balance_etag(current, as_of, currency, rates_state)
+        etags.check(request, version)
+        if as_of is None:
+            payload["data"] = GetBalance.balance_data(user_id, current, as_of, currency,
+                                                      rates_state)
+        else:
+            # Only the balance as of a moment is read from the DB
+            payload["data"] = await sync_to_async(profiled(GetBalance.balance_data))(
+                user_id, current, as_of, currency, rates_state
+            )
+        etag = version
+
+    except NotModified as e:
+        return not_modified(e.etag)
+    except InvalidDateTime as e:
+        http_status = status.HTTP_400_BAD_REQUEST
+        payload = {"errors": {e.field_name: [e.message]}}
+    except Balance.DoesNotExist:
+        http_status = status.HTTP_404_NOT_FOUND
+        payload = {"errors": {"user_id": ["No user with such ID found"]}}
+
+    return render(payload, http_status, etag)
+
+
+async def get_transactions(request, user_id: int, sort_by: str = "date") -> HttpResponse:
+    """
+    Async GetTransactions
+    """
+    view = GetTransactions()
+    view.request = Request(request)
+    try:
+        payload, http_status, etag = await sync_to_async(profiled(view.transactions_payload))(
+            view.request, user_id, sort_by
+        )
+    except NotModified as e:
+        return not_modified(e.etag)
+    return render(payload, http_status, etag)
+
+
+# Labels of the requests in the metrics, as of the sync views
+get_balance.resource_name = GetBalance.resource_name
+get_transactions.resource_name = GetTransactions.resource_name
@@ -0,0 +1,140 @@
+"""
+Cache of the serialized balances returned by get-balance.
+
+An entry keeps the payload of a balance together with the tokens of its user
+and of the whole cache, read before the balance was read from the DB.
+The write paths replace the tokens after the commit, so an entry can match
+the tokens only if it was read after the last committed write of the user,
+even if the read raced with the write. Entries that don't match are misses.
+The misses read the balance from the primary, as a replica lagging behind
+could put a balance older than the last write into the cache.
+Inside an atomic block on the primary the cache is bypassed, as the block
+could have changed the balance without a commit yet.
+"""
+import threading
+from typing import Callable, Iterable, Optional, Tuple
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, router, transaction
+
+from .models import Balance
+
+GLOBAL_TOKEN_KEY = "balance:token"
+
+
+def payload_key(user_id: int) -> str:
+    return f"balance:{user_id}"
+
+
+def token_key(user_id: int) -> str:
+    return f"balance:{user_id}:token"
+
+
+class CacheStats:
+    """
+    Thread-safe counters of the cache lookups
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, hits: int = 0, misses: int = 0):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def reset(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+cache_stats = CacheStats()
+
+
+def get_cache():
+    return caches[settings.BALANCE_CACHE]
+
+
+def token_ttl() -> int:
+    # A token has to outlive the entries stored with it,
+    # a new token only causes misses
+    return 2 * settings.BALANCE_CACHE_TTL
+
+
+def current_tokens(user_id: int) -> Tuple[str, str]:
+    """
+    Returns the tokens of the user and of the whole cache,
+    creating the missing ones
+    """
+    cache = get_cache()
+    keys = [token_key(user_id), GLOBAL_TOKEN_KEY]
+    tokens = cache.get_many(keys)
+    missing = [key for key in keys if key not in tokens]
+    if missing:
+        for key in missing:
+            cache.add(key, uuid4().hex, token_ttl())
+        tokens.update(cache.get_many(missing))
+    return tokens.get(keys[0]), tokens.get(keys[1])
+
+
+def lookup(user_id: int) -> Optional[dict]:
+    """
+    Returns the cached payload if it was read after the last write of the user
+    """
+    keys = [payload_key(user_id), token_key(user_id), GLOBAL_TOKEN_KEY]
+    found = get_cache().get_many(keys)
+    entry = found.get(keys[0])
+    if entry is None or entry["tokens"] != (found.get(keys[1]), found.get(keys[2])):
+        return None
+    return entry["data"]
+
+
+def cached_balance(user_id: int, load: Callable[[str], dict]) -> dict:
+    """
+    Returns the payload of the user's balance from the cache,
+    or loads and caches it on a miss
+    :param load: function reading the payload from the DB by the alias
+    """
+    using = router.db_for_write(Balance)
+    if connections[using].in_atomic_block:
+        return load(using)
+    data = lookup(user_id)
+    if data is not None:
+        cache_stats.add(hits=1)
+        return data
+    cache_stats.add(misses=1)
+    # The tokens have to be read before the DB
+    tokens = current_tokens(user_id)
+    data = dict(load(using))
+    get_cache().set(payload_key(user_id), {"tokens": tokens, "data": data},
+                    settings.BALANCE_CACHE_TTL)
+    return data
+
+
+def invalidate(user_ids: Iterable[int]):
+    """
+    Replaces the tokens of the users once the current transaction commits
+    """
+    tokens = {token_key(user_id): uuid4().hex for user_id in set(user_ids)}
+    if tokens:
+        transaction.on_commit(lambda: get_cache().set_many(tokens, token_ttl()))
+
+
+def invalidate_all():
+    """
+    Replaces the token of the whole cache once the current transaction commits
+    """
+    token = uuid4().hex
+    transaction.on_commit(lambda: get_cache().set(GLOBAL_TOKEN_KEY, token, token_ttl()))
@@ -0,0 +1,176 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from typing import Awaitable, Callable, Optional
+
+from .exceptions import CircuitOpen, CallTimeout
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker with a latency budget for calls to an unreliable upstream.
+
+    Every call runs in a background thread and the caller waits for it
+    no longer than `budget` seconds. Concurrent callers share the call
+    in flight, and a call that outlives the budget still completes
+    in the background. After `failure_threshold` consecutive failed
+    or timed out calls the breaker opens: calls fail at once with
+    CircuitOpen, and after `reset_timeout` seconds the next call starts
+    a probe of the upstream in the background, which closes the breaker
+    on success.
+
+    Coroutine functions are called with `acall` the same way, as tasks
+    of the running event loop instead of background threads.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30,
+                 budget: float = 0.5):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.budget = budget
+
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._in_flight: Optional[Future] = None
+        self._in_flight_task: Optional[asyncio.Task] = None
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.counters = dict.fromkeys(
+            ("calls", "successes", "failures", "timeouts", "short_circuits",
+             "probes", "opened"), 0
+        )
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # Created lazily - the threads must not exist before the workers fork
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=2,
+                                                thread_name_prefix="breaker")
+        return self._executor
+
+    def call(self, func: Callable):
+        """
+        Calls func within the budget.
+        Raises CircuitOpen if the breaker is open, CallTimeout if func
+        didn't return within the budget, or the exception raised by func
+        """
+        with self._lock:
+            self.counters["calls"] += 1
+            closed = self.state == self.CLOSED
+            if not closed:
+                self.counters["short_circuits"] += 1
+                probe = self._maybe_probe(lambda: self.executor.submit(func))
+            else:
+                if self._in_flight is None or self._in_flight.done():
+                    self._in_flight = self.executor.submit(func)
+                future = self._in_flight
+        if not closed:
+            self._watch_probe(probe)
+            raise CircuitOpen
+
+        try:
+            result = future.result(timeout=self.budget)
+        except TimeoutError:
+            self._record_failure(timeout=True)
+            raise CallTimeout
+        except Exception:
+            self._record_failure()
+            raise
+        self._record_success()
+        return result
+
+    async def acall(self, func: Callable[[], Awaitable]):
+        """
+        Awaits the coroutine function within the budget.
+        Raises CircuitOpen if the breaker is open, CallTimeout if func
+        didn't return within the budget, or the exception raised by func
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self.counters["calls"] += 1
+            closed = self.state == self.CLOSED
+            if not closed:
+                self.counters["short_circuits"] += 1
+                probe = self._maybe_probe(lambda: loop.create_task(func()))
+            else:
+                task = self._in_flight_task
+                if task is None or task.done() or task.get_loop() is not loop:
+                    task = self._in_flight_task = loop.create_task(func())
+                    # The result of a task that outlived the budget is never awaited
+                    task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        if not closed:
+            self._watch_probe(probe)
+            raise CircuitOpen
+
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), self.budget)
+        except asyncio.TimeoutError:
+            self._record_failure(timeout=True)
+            raise CallTimeout
+        except Exception:
+            self._record_failure()
+            raise
+        self._record_success()
+        return result
+
+    def _maybe_probe(self, start: Callable[[], Future]) -> Optional[Future]:
+        """
+        Starts the probe if the breaker has been open for `reset_timeout`.
+        Called with the lock held
+        :return: the future of the probe, None if none started
+        """
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self.counters["probes"] += 1
+            return start()
+        return None
+
+    def _watch_probe(self, probe: Optional[Future]):
+        """
+        Closes or reopens the breaker when the probe is done. Called without
+        the lock: the callback of a finished probe runs at once and takes it
+        """
+        if probe is not None:
+            probe.add_done_callback(self._probe_done)
+
+    def _probe_done(self, future: Future):
+        if future.exception() is None:
+            self._record_success()
+        else:
+            with self._lock:
+                self._open()
+
+    def _open(self):
+        if self.state == self.CLOSED:
+            self.counters["opened"] += 1
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+
+    def _record_failure(self, timeout: bool = False):
+        with self._lock:
+            self.counters["timeouts" if timeout else "failures"] += 1
+            self.failures += 1
+            if self.state == self.CLOSED and self.failures >= self.failure_threshold:
+                self._open()
+
+    def _record_success(self):
+        with self._lock:
+            self.counters["successes"] += 1
+            self.failures = 0
+            self.state = self.CLOSED
+            self.opened_at = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "open_for": round(time.monotonic() - self.opened_at, 3)
+                if self.opened_at is not None else None,
+                **self.counters,
+            }
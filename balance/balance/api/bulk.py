@@ -0,0 +1,214 @@
+"""
+Bulk deposits and withdrawals.
+
+Rows of (user_id, amount) are streamed into a temporary staging table
+with Postgres COPY and applied with set-based statements: one
+INSERT ... ON CONFLICT DO UPDATE into Balance and one INSERT ... SELECT
+into Transaction, whatever the number of rows.
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from typing import Iterable, Iterator, Optional, Tuple
+
+from django.conf import settings
+from django.core.validators import MaxValueValidator
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from balance.routers import pin_to_primary
+
+from .exceptions import BulkRowInvalid
+from .models import Balance, Transaction
+from . import balance_cache
+
+CENT = Decimal("0.01")
+
+STAGING_TABLE = "balance_change_staging"
+USERS_TABLE = "balance_change_users"
+
+
+def max_balance() -> Decimal:
+    """
+    The largest value fitting into Balance.balance
+    """
+    field = Balance._meta.get_field("balance")
+    return Decimal(10) ** (field.max_digits - field.decimal_places) - CENT
+
+
+def max_user_id() -> int:
+    """
+    The largest value fitting into Balance.user_id
+    """
+    field = Balance._meta.get_field("user_id")
+    return min(validator.limit_value for validator in field.validators
+               if isinstance(validator, MaxValueValidator))
+
+
+def clean_row(line: int, user_id, amount) -> Tuple[int, Decimal]:
+    """
+    Validates one row of a bulk change.
+    Raises BulkRowInvalid if the row is malformed
+    :param line: int - number of the row in the input
+    :return: tuple of user_id and amount
+    """
+    try:
+        user_id = int(user_id)
+        amount = Decimal(str(amount))
+    except (TypeError, ValueError, InvalidOperation):
+        raise BulkRowInvalid(line, "Has to contain integer user_id and decimal amount")
+    if user_id < 0:
+        raise BulkRowInvalid(line, "user_id can't be negative")
+    if user_id > max_user_id():
+        raise BulkRowInvalid(line, f"user_id can't be greater than {max_user_id()}")
+    if not amount.is_finite() or amount != amount.quantize(CENT) \
+            or abs(amount) > max_balance():
+        raise BulkRowInvalid(line, "amount has to fit into 9 digits with 2 decimal places")
+    return user_id, amount
+
+
+def parse_csv(lines: Iterable[str]) -> Iterator[Tuple[int, Decimal]]:
+    """
+    Yields (user_id, amount) from CSV lines, the header row is optional
+    """
+    for line, row in enumerate(csv.reader(lines), start=1):
+        if not row:
+            continue
+        if line == 1 and row[0].strip() == "user_id":
+            continue
+        if len(row) != 2:
+            raise BulkRowInvalid(line, "Has to contain user_id and amount")
+        yield clean_row(line, row[0].strip(), row[1].strip())
+
+
+def parse_ndjson(lines: Iterable[str]) -> Iterator[Tuple[int, Decimal]]:
+    """
+    Yields (user_id, amount) from lines of newline-delimited JSON objects
+    """
+    for line, text in enumerate(lines, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text, parse_float=Decimal)
+            user_id, amount = row["user_id"], row["amount"]
+        except (ValueError, TypeError, KeyError):
+            raise BulkRowInvalid(line, "Has to be a JSON object with user_id and amount")
+        yield clean_row(line, user_id, amount)
+
+
+class RowsStream:
+    """
+    File-like object feeding rows to COPY ... FROM STDIN in CSV format.
+    Remembers the exception raised by the rows iterator, since psycopg2
+    replaces it with a generic error
+    """
+    def __init__(self, rows: Iterable[Tuple[int, Decimal]]):
+        self.rows = iter(rows)
+        self.buffer = ""
+        self.count = 0
+        self.error: Optional[Exception] = None
+
+    def read(self, size: int = 8192) -> str:
+        try:
+            while len(self.buffer) < size:
+                user_id, amount = next(self.rows)
+                self.count += 1
+                self.buffer += f"{self.count},{user_id},{amount}\n"
+        except StopIteration:
+            pass
+        except Exception as e:
+            self.error = e
+            raise
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+
+def apply_balance_changes(rows: Iterable[Tuple[int, Decimal]]) -> dict:
+    """
+    Applies deposits and withdrawals in one DB transaction.
+    Rows of one user are applied in order, all or none of them:
+    the user is rejected if the balance would become negative at any row,
+    or would not fit into the Balance field at the end.
+    Balances are created on the first deposit.
+    Raises BulkRowInvalid if a row is malformed, nothing is applied then.
+    :param rows: iterable of (user_id, amount)
+    :return: dict with the number of rows, applied rows, and rejected users
+    """
+    balance_table = Balance._meta.db_table
+    transaction_table = Transaction._meta.db_table
+    using = router.db_for_write(Balance)
+    stream = RowsStream(rows)
+    now = timezone.now()
+
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(
+            f"CREATE TEMP TABLE {STAGING_TABLE} "
+            f"(line bigint, user_id bigint, amount numeric(9, 2)) ON COMMIT DROP"
+        )
+        try:
+            cursor.copy_expert(
+                f"COPY {STAGING_TABLE} (line, user_id, amount) FROM STDIN WITH (FORMAT csv)",
+                stream
+            )
+        except Exception:
+            if stream.error is not None:
+                raise stream.error
+            raise
+
+        cursor.execute(
+            f"SELECT 1 FROM {balance_table} "
+            f"WHERE user_id IN (SELECT user_id FROM {STAGING_TABLE}) "
+            f"ORDER BY user_id FOR UPDATE"
+        )
+        cursor.execute(
+            f"CREATE TEMP TABLE {USERS_TABLE} ON COMMIT DROP AS "
+            f"SELECT s.user_id, coalesce(b.balance, 0) AS balance, "
+            f"sum(s.amount) AS total, count(*) AS row_count, "
+            f"coalesce(b.balance, 0) + min(s.running) >= 0 "
+            f"AND coalesce(b.balance, 0) + sum(s.amount) <= %s AS accepted "
+            f"FROM (SELECT user_id, amount, sum(amount) OVER "
+            f"(PARTITION BY user_id ORDER BY line) AS running "
+            f"FROM {STAGING_TABLE}) s "
+            f"LEFT JOIN {balance_table} b ON b.user_id = s.user_id "
+            f"GROUP BY s.user_id, b.balance",
+            [max_balance()]
+        )
+        cursor.execute(
+            f"INSERT INTO {balance_table} (user_id, balance, last_update) "
+            f"SELECT user_id, total, %s FROM {USERS_TABLE} WHERE accepted "
+            f"ON CONFLICT (user_id) DO UPDATE "
+            f"SET balance = {balance_table}.balance + EXCLUDED.balance, "
+            f"last_update = EXCLUDED.last_update",
+            [now]
+        )
+        cursor.execute(
+            f"INSERT INTO {transaction_table} "
+            f"(amount, source_id, target_id, comment, timestamp) "
+            f"SELECT abs(s.amount), s.user_id, s.user_id, "
+            f"CASE WHEN s.amount > 0 THEN 'Deposit' ELSE 'Withdrawal' END, %s "
+            f"FROM {STAGING_TABLE} s JOIN {USERS_TABLE} u ON u.user_id = s.user_id "
+            f"WHERE u.accepted ORDER BY s.line",
+            [now]
+        )
+        applied = cursor.rowcount
+        if applied:
+            # Cheaper than replacing the tokens of every accepted user
+            balance_cache.invalidate_all()
+        if applied and settings.DATABASE_REPLICAS:
+            cursor.execute(f"SELECT user_id FROM {USERS_TABLE} WHERE accepted")
+            pin_to_primary(user_id for user_id, in cursor.fetchall())
+        cursor.execute(
+            f"SELECT user_id, balance, total, row_count FROM {USERS_TABLE} "
+            f"WHERE NOT accepted ORDER BY user_id"
+        )
+        rejected = [
+            {"user_id": user_id, "balance": balance, "amount": total, "rows": count}
+            for user_id, balance, total, count in cursor.fetchall()
+        ]
+        cursor.execute(f"DROP TABLE {STAGING_TABLE}, {USERS_TABLE}")
+
+    return {
+        "rows": stream.count,
+        "applied": applied,
+        "rejected": rejected,
+    }
@@ -0,0 +1,40 @@
+"""
+Strong ETags of the read responses.
+
+The ETag of a response is the hash of the values its body is built from,
+known before the body is: Balance.last_update of the user, changed in the
+same DB transaction as the balance and the transactions of the user, and
+the parameters of the request. So a matching If-None-Match is answered with
+304 before the transactions are read, converted or serialized.
+"""
+import hashlib
+
+from django.utils.http import parse_etags
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from .exceptions import NotModified
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha256("|".join(map(str, parts)).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def check(request, etag: str):
+    """
+    Raises NotModified if the ETag matches the If-None-Match header
+    of the request
+    """
+    header = request.META.get("HTTP_IF_NONE_MATCH")
+    if not header:
+        return
+    # If-None-Match is compared weakly
+    tags = {tag[2:] if tag.startswith("W/") else tag for tag in parse_etags(header)}
+    if "*" in tags or etag in tags:
+        raise NotModified(etag)
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
@@ -10,6 +10,27 @@ class BalanceDoesNotExist(Balance.DoesNotExist):
         self.field_name = field_name
 
 
+class TransferInvalid(Exception):
+    """
+    An exception raised when a balance would be out of range
+    after a transfer.
+    Stores the input JSON field's name of the balance and the message
+    """
+    def __init__(self, field_name, message):
+        self.field_name = field_name
+        self.message = message
+
+
+class BulkRowInvalid(Exception):
+    """
+    An exception raised when a row of a bulk balance change is malformed.
+    Stores the number of the row and the message
+    """
+    def __init__(self, line, message):
+        self.line = line
+        self.message = message
+
+
 class InvalidSortField(Exception):
     """
     An exception raised when `sort_by` field in get-transactions request
@@ -17,9 +38,70 @@ class InvalidSortField(Exception):
     """
     pass
 
+class InvalidCursor(Exception):
+    """
+    An exception raised when the pagination cursor in get-transactions
+    request is malformed
+    """
+    pass
+
+
+class InvalidDateTime(Exception):
+    """
+    An exception raised when a date and time query parameter
+    is not in ISO 8601 format or out of the allowed range.
+    Stores the name of the parameter and the message
+    """
+    def __init__(self, field_name, message="Has to be an ISO 8601 datetime or date"):
+        self.field_name = field_name
+        self.message = message
+
+
+class InvalidGranularity(Exception):
+    """
+    An exception raised when `granularity` in get-statement request
+    is not `day`, `week` or `month`
+    """
+    pass
+
+
 class ConvertResultNone(Exception):
     """
     An exception raised when the result of currency conversion
     is None
     """
     pass
+
+
+class RatesUnavailable(Exception):
+    """
+    An exception raised when the exchange rates can't be fetched
+    from the rate provider
+    """
+    pass
+
+
+class CircuitOpen(Exception):
+    """
+    An exception raised when a call is not made because
+    the circuit breaker is open
+    """
+    pass
+
+
+class CallTimeout(Exception):
+    """
+    An exception raised when a call through the circuit breaker
+    didn't finish within the latency budget
+    """
+    pass
+
+
+class NotModified(Exception):
+    """
+    An exception raised when the ETag of the response matches
+    the If-None-Match header of the request.
+    Stores the ETag
+    """
+    def __init__(self, etag):
+        self.etag = etag
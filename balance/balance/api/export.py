@@ -0,0 +1,91 @@
+"""
+Streaming export of account statements.
+
+Rows are read with server-side cursors and written out chunk by chunk,
+so the memory used doesn't depend on the number of rows.
+"""
+import csv
+import io
+from typing import Iterable, Iterator
+
+from django.db import transaction
+
+from rest_framework.utils.encoders import JSONEncoder
+
+from balance.routers import replica_for
+
+from .serializers import StatementTransactionSerializer, ValuesSerializer
+from .statement import AccountStatement
+
+FIELDS = ("id", "timestamp", "direction", "amount", "source_id", "target_id", "comment")
+# Rows fetched from the DB and written out at once
+CHUNK_SIZE = 2000
+
+
+def ndjson_chunks(rows: Iterable[tuple]) -> Iterator[str]:
+    """
+    Yields the rows as newline-delimited JSON objects, CHUNK_SIZE rows a chunk
+    """
+    encoder = JSONEncoder(ensure_ascii=False)
+    lines = []
+    for row in rows:
+        lines.append(encoder.encode(dict(zip(FIELDS, row))))
+        if len(lines) == CHUNK_SIZE:
+            lines.append("")
+            yield "\n".join(lines)
+            lines = []
+    if lines:
+        lines.append("")
+        yield "\n".join(lines)
+
+
+def csv_chunks(rows: Iterable[tuple]) -> Iterator[str]:
+    """
+    Yields the rows as CSV with the header row, CHUNK_SIZE rows a chunk
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def represented(rows: Iterable[tuple]) -> Iterator[tuple]:
+    """
+    Yields the rows with the values in the representation of
+    StatementTransactionSerializer, the same as in get-transactions:
+    the timestamps in ISO 8601 in the current time zone
+    """
+    fast = ValuesSerializer(StatementTransactionSerializer)
+    known = dict(zip(fast.fields, fast.converters))
+    converters = [known.get(name) for name in FIELDS]
+    for row in rows:
+        yield tuple(value if convert is None or value is None else convert(value)
+                    for convert, value in zip(converters, row))
+
+
+FORMATS = {
+    "ndjson": (ndjson_chunks, "application/x-ndjson"),
+    "csv": (csv_chunks, "text/csv"),
+}
+
+
+def export_statement(user_id: int, export_format: str) -> Iterator[str]:
+    """
+    Yields chunks of the user's statement in the format, oldest rows first.
+    The rows are read in one DB transaction, so the server-side cursors
+    are not materialized by the DB
+    """
+    write, _ = FORMATS[export_format]
+    statement = AccountStatement(user_id, ["timestamp", "id"])
+    with replica_for(user_id) as using, transaction.atomic(using=using):
+        yield from write(represented(
+            statement.values_iterator(*FIELDS, chunk_size=CHUNK_SIZE)
+        ))
@@ -0,0 +1,97 @@
+"""
+Idempotency keys of POST-requests.
+
+The first request with a key claims it by inserting the row of the key,
+runs the handler and stores the response in the same DB transaction,
+so the key is either stored with the response of the committed changes
+or not stored at all. A retry gets the stored response with one lookup
+of the unique index. A concurrent duplicate blocks in the INSERT on
+the unique index until the transaction of the first request ends, then
+reads its response.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db import connections, router
+
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field("key").max_length
+
+
+def request_hash(data) -> str:
+    """
+    Returns the SHA-256 of the parsed request data, not depending
+    on the order of the keys of JSON objects
+    """
+    encoded = json.dumps(data, cls=JSONEncoder, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def find(resource: str, key: str, now: datetime) -> Optional[IdempotencyKey]:
+    """
+    Returns the stored key of the resource if it hasn't expired
+    """
+    try:
+        # Never from a replica lagging behind
+        return IdempotencyKey.objects.using(router.db_for_write(IdempotencyKey)) \
+            .get(resource=resource, key=key, expires__gt=now)
+    except IdempotencyKey.DoesNotExist:
+        return None
+
+
+def claim(resource: str, key: str, digest: str, now: datetime) -> Optional[int]:
+    """
+    Inserts the row of the key, or takes over the row of an expired key,
+    with one INSERT ... ON CONFLICT DO UPDATE. Blocks while another
+    transaction holds an uncommitted row of the same key.
+    Has to be run inside the transaction of the request
+    :param digest: str - hash of the request data
+    :return: id of the claimed row or None if the key is already taken
+    """
+    table = IdempotencyKey._meta.db_table
+    ttl = timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    using = router.db_for_write(IdempotencyKey)
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (resource, key, request_hash, created, expires) "
+            f"VALUES (%s, %s, %s, %s, %s) "
+            f"ON CONFLICT (resource, key) DO UPDATE "
+            f"SET request_hash = EXCLUDED.request_hash, status = NULL, response = NULL, "
+            f"created = EXCLUDED.created, expires = EXCLUDED.expires "
+            f"WHERE {table}.expires <= EXCLUDED.created "
+            f"RETURNING id",
+            [resource, key, digest, now, now + ttl]
+        )
+        row = cursor.fetchone()
+    return row and row[0]
+
+
+def store(key_id: int, response: Response):
+    """
+    Stores the response to the claimed key
+    """
+    IdempotencyKey.objects.filter(pk=key_id) \
+        .update(status=response.status_code, response=response.data)
+
+
+def replay(stored: IdempotencyKey) -> Response:
+    return Response(stored.response, status=stored.status,
+                    headers={REPLAYED_HEADER: "true"})
+
+
+def purge(now: datetime) -> int:
+    """
+    Deletes the expired keys
+    :return: int - number of the deleted keys
+    """
+    deleted, _ = IdempotencyKey.objects.filter(expires__lte=now).delete()
+    return deleted
@@ -0,0 +1,31 @@
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...snapshots import compact
+
+
+class Command(BaseCommand):
+    help = "Builds balance snapshots of the transactions made since the last run. " \
+           "Meant to run periodically, e.g. from cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lag", type=int, default=settings.BALANCE_SNAPSHOT_LAG,
+                            help="Seconds to leave the newest transactions for the next run")
+        parser.add_argument("--step", type=int, default=settings.BALANCE_SNAPSHOT_STEP,
+                            help="Longest period between two snapshots of a user, in seconds")
+
+    def handle(self, *args, **options):
+        until = timezone.now() - timedelta(seconds=options["lag"])
+        start = time.perf_counter()
+        result = compact(until, timedelta(seconds=options["step"]))
+        seconds = time.perf_counter() - start
+
+        self.stdout.write(json.dumps({
+            **result,
+            "seconds": round(seconds, 3),
+        }, default=str))
@@ -0,0 +1,52 @@
+import io
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...bulk import apply_balance_changes, parse_csv, parse_ndjson
+from ...exceptions import BulkRowInvalid
+
+
+class Command(BaseCommand):
+    help = "Applies deposits and withdrawals from a CSV or NDJSON file " \
+           "of (user_id, amount) rows in one DB transaction"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Path to the file, '-' for stdin")
+        parser.add_argument("--format", choices=["csv", "ndjson"],
+                            help="Format of the file, guessed by the extension by default")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"]
+        if file_format is None:
+            file_format = "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+        parse = parse_ndjson if file_format == "ndjson" else parse_csv
+
+        if path == "-":
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", newline="")
+        else:
+            try:
+                stream = open(path, encoding="utf-8", newline="")
+            except OSError as e:
+                raise CommandError(e)
+
+        start = time.perf_counter()
+        try:
+            with stream:
+                result = apply_balance_changes(parse(stream))
+        except BulkRowInvalid as e:
+            raise CommandError(f"Row {e.line}: {e.message}")
+        seconds = time.perf_counter() - start
+
+        for rejected in result["rejected"]:
+            self.stderr.write(json.dumps(rejected, default=str))
+        self.stdout.write(json.dumps({
+            "rows": result["rows"],
+            "applied": result["applied"],
+            "rejected_users": len(result["rejected"]),
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(result["rows"] / seconds, 1) if seconds else None,
+        }))
@@ -0,0 +1,46 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from django.utils import timezone
+
+from ...models import BalanceSnapshot
+from ...partitions import add_months, create_partitions, detach_partitions, month_start
+
+
+class Command(BaseCommand):
+    help = "Creates monthly partitions of the transactions ahead of time " \
+           "and detaches the old ones. Meant to run periodically, e.g. from cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ahead", type=int, default=3,
+                            help="Number of months to create the partitions for "
+                                 "after the current one")
+        parser.add_argument("--detach-older-than", type=int, metavar="MONTHS",
+                            help="Detach the partitions of the months ended "
+                                 "more than MONTHS months ago")
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument("--archive-schema",
+                           help="Move the detached partitions to the schema")
+        group.add_argument("--drop", action="store_true",
+                           help="Drop the detached partitions")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        result = create_partitions(now, options["ahead"])
+
+        months = options["detach_older_than"]
+        if months is not None:
+            if months < 1:
+                raise CommandError("--detach-older-than has to be at least 1")
+            before = add_months(month_start(now), -months)
+            # Balances as of a moment in the detached months can only come
+            # from the snapshots, so only the months before the newest one go
+            watermark = BalanceSnapshot.objects.aggregate(watermark=Max("timestamp"))["watermark"]
+            if watermark is None or watermark < before:
+                raise CommandError("The months to detach have to be covered by balance "
+                                   "snapshots, run compact_balances first")
+            result["detached"] = detach_partitions(before, options["archive_schema"],
+                                                   options["drop"])
+
+        self.stdout.write(json.dumps(result))
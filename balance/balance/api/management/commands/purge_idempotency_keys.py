@@ -0,0 +1,13 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...idempotency import purge
+
+
+class Command(BaseCommand):
+    help = "Deletes the expired idempotency keys. Meant to run periodically, e.g. from cron"
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps({"deleted": purge(timezone.now())}))
@@ -0,0 +1,31 @@
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...rollups import rollup
+
+
+class Command(BaseCommand):
+    help = "Builds daily rollups of statement totals for the days closed " \
+           "since the last run. Meant to run periodically, e.g. from cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lag", type=int, default=settings.STATEMENT_ROLLUP_LAG,
+                            help="Seconds after the end of a day before it's rolled up")
+        parser.add_argument("--step", type=int, default=31,
+                            help="Most days rolled up in one DB transaction")
+
+    def handle(self, *args, **options):
+        until = timezone.now() - timedelta(seconds=options["lag"])
+        start = time.perf_counter()
+        result = rollup(until, options["step"])
+        seconds = time.perf_counter() - start
+
+        self.stdout.write(json.dumps({
+            **result,
+            "seconds": round(seconds, 3),
+        }, default=str))
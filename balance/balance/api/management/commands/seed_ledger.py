@@ -0,0 +1,78 @@
+import json
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+from django.utils import timezone
+
+from ...models import Balance, BalanceSnapshot, StatementRollup, Transaction
+from ...seeding import seed_ledger
+
+
+class Command(BaseCommand):
+    help = "Fills the empty ledger with synthetic users and transactions " \
+           "of power-law activity, loaded with COPY by parallel workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--transactions", type=int, default=1000000,
+                            help="Transactions between the opening deposits "
+                                 "and the closing withdrawals")
+        parser.add_argument("--skew", type=float, default=1.0,
+                            help="Exponent of the power law of the activity of users, "
+                                 "0 for uniform")
+        parser.add_argument("--days", type=int, default=365,
+                            help="Time span of the transactions up to now")
+        parser.add_argument("--transfer-share", type=float, default=0.8,
+                            help="Share of the transfers, the rest are deposits "
+                                 "and withdrawals")
+        parser.add_argument("--max-amount", type=float, default=1000,
+                            help="Largest amount of a transaction")
+        parser.add_argument("--workers", type=int,
+                            help="Worker processes, the number of CPUs by default")
+        parser.add_argument("--chunk-size", type=int, default=200000,
+                            help="Transactions copied in one DB transaction by a worker")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--keep-indexes", action="store_true",
+                            help="Don't drop the indexes of the transactions for the load")
+        parser.add_argument("--truncate", action="store_true",
+                            help="Empty the balances, transactions, snapshots "
+                                 "and rollups first")
+
+    def handle(self, *args, **options):
+        if options["users"] < 2 or options["transactions"] < 1 or options["chunk_size"] < 1:
+            raise CommandError("Has to be at least 2 users, 1 transaction and chunk size 1")
+        if not 0 <= options["transfer_share"] <= 1:
+            raise CommandError("--transfer-share has to be from 0 to 1")
+
+        models = [Balance, Transaction, BalanceSnapshot, StatementRollup]
+        if options["truncate"]:
+            using = router.db_for_write(Transaction)
+            with connections[using].cursor() as cursor:
+                cursor.execute(f"TRUNCATE {', '.join(model._meta.db_table for model in models)}")
+        elif any(model.objects.exists() for model in models):
+            raise CommandError("The ledger isn't empty, use --truncate to empty it")
+
+        end = timezone.now()
+        start = time.perf_counter()
+        result = seed_ledger(
+            users=options["users"],
+            transactions=options["transactions"],
+            start=end - timedelta(days=options["days"]),
+            end=end,
+            skew=options["skew"],
+            transfer_share=options["transfer_share"],
+            max_amount=round(options["max_amount"] * 100),
+            chunk_size=options["chunk_size"],
+            workers=options["workers"],
+            seed=options["seed"],
+            drop_indexes=not options["keep_indexes"],
+        )
+        seconds = time.perf_counter() - start
+
+        self.stdout.write(json.dumps({
+            **result,
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(result["transactions"] / seconds, 1),
+        }))
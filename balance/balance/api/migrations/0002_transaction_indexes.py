@@ -0,0 +1,23 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction,
+    # but doesn't block writes to the table while the index is built
+    atomic = False
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['source_id', 'timestamp', 'id'], name='api_trans_source_ts_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['source_id', 'amount', 'id'], name='api_trans_source_amount_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('api', '0002_transaction_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['target_id', 'timestamp', 'id'], name='api_trans_target_ts_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['target_id', 'amount', 'id'], name='api_trans_target_amount_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('api', '0003_transaction_target_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.PositiveIntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=9)),
+                ('timestamp', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='balancesnapshot',
+            index=models.Index(fields=['timestamp'], name='api_snapshot_ts_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='balancesnapshot',
+            constraint=models.UniqueConstraint(fields=('user_id', 'timestamp'), name='api_snapshot_user_ts_uniq'),
+        ),
+        AddIndexConcurrently(
+            model_name='transaction',
+            index=models.Index(fields=['timestamp'], name='api_trans_ts_idx'),
+        ),
+    ]
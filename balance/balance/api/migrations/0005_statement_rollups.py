@@ -0,0 +1,33 @@
+# Generated by Django 3.2.7 on 2026-10-18 10:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_balance_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatementRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.PositiveIntegerField()),
+                ('day', models.DateField()),
+                ('deposits', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('withdrawals', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('transfers_in', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('transfers_out', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='statementrollup',
+            index=models.Index(fields=['day'], name='api_rollup_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='statementrollup',
+            constraint=models.UniqueConstraint(fields=('user_id', 'day'), name='api_rollup_user_day_uniq'),
+        ),
+    ]
@@ -0,0 +1,213 @@
+import time
+
+from django.db import OperationalError, migrations, transaction
+
+# api_transaction becomes a table partitioned by month (in UTC) on timestamp.
+# The primary key of a partitioned table has to contain the partition key,
+# so it's (id, timestamp), the ids still come from the same sequence.
+# Rows out of the range of the monthly partitions go to the default one,
+# the manage_partitions command creates the partitions ahead of time.
+#
+# An empty table is simply recreated. The rows of a filled one are never
+# copied: the table is attached as the partition api_transaction_legacy
+# of everything before a month boundary, the monthly partitions follow it.
+# Its indexes are built beforehand with CREATE INDEX CONCURRENTLY, and a
+# validated CHECK on timestamp lets ATTACH PARTITION skip the scan, so the
+# table is locked only for the renames. The migration is non-atomic and
+# can be run again after a failure.
+
+INDEXES = """
+CREATE INDEX api_trans_source_ts_idx ON api_transaction (source_id, timestamp, id);
+CREATE INDEX api_trans_source_amount_idx ON api_transaction (source_id, amount, id);
+CREATE INDEX api_trans_target_ts_idx ON api_transaction (target_id, timestamp, id);
+CREATE INDEX api_trans_target_amount_idx ON api_transaction (target_id, amount, id);
+CREATE INDEX api_trans_ts_idx ON api_transaction (timestamp);
+"""
+
+CREATE_TABLE = """
+CREATE TABLE api_transaction (
+    id bigint NOT NULL DEFAULT nextval('api_transaction_id_seq'),
+    amount numeric(9, 2) NOT NULL,
+    source_id integer NOT NULL CONSTRAINT api_transaction_source_id_check CHECK (source_id >= 0),
+    target_id integer NOT NULL CONSTRAINT api_transaction_target_id_check CHECK (target_id >= 0),
+    comment text NOT NULL,
+    timestamp timestamp with time zone NOT NULL,
+    CONSTRAINT api_transaction_pkey PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+ALTER SEQUENCE api_transaction_id_seq OWNED BY api_transaction.id;
+
+CREATE TABLE api_transaction_default PARTITION OF api_transaction DEFAULT;
+"""
+
+# The monthly partitions from the month of {first} to 3 months after the current one
+CREATE_MONTHS = """
+DO $$
+DECLARE
+    month timestamp := date_trunc('month', {first} AT TIME ZONE 'UTC');
+    last timestamp := date_trunc('month', now() AT TIME ZONE 'UTC') + interval '3 months';
+BEGIN
+    WHILE month <= last LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF api_transaction FOR VALUES FROM (%L) TO (%L)',
+            'api_transaction_p' || to_char(month, 'YYYY_MM'),
+            month AT TIME ZONE 'UTC',
+            (month + interval '1 month') AT TIME ZONE 'UTC'
+        );
+        month := month + interval '1 month';
+    END LOOP;
+END $$;
+"""
+
+PARTITION_EMPTY = """
+ALTER SEQUENCE api_transaction_id_seq OWNED BY NONE;
+DROP TABLE api_transaction;
+""" + CREATE_TABLE + CREATE_MONTHS.format(first="now()") + INDEXES
+
+# The primary key of the legacy partition, the other indexes are there already
+LEGACY_PKEY = "CREATE UNIQUE INDEX CONCURRENTLY api_transaction_legacy_pkey " \
+              "ON api_transaction (id, timestamp)"
+
+# The end of the legacy partition: the month after the newest row, but not
+# earlier than the month after next, so that the rows written meanwhile fit
+LEGACY_END = """
+SELECT quote_literal(greatest(
+    date_trunc('month', now() AT TIME ZONE 'UTC') + interval '2 months',
+    date_trunc('month', max(timestamp) AT TIME ZONE 'UTC') + interval '1 month'
+) AT TIME ZONE 'UTC') FROM api_transaction
+"""
+
+ADD_LEGACY_BOUND = """
+ALTER TABLE api_transaction
+    DROP CONSTRAINT IF EXISTS api_transaction_legacy_bound,
+    ADD CONSTRAINT api_transaction_legacy_bound CHECK (timestamp < {end}) NOT VALID
+"""
+
+# Needless once the partition is attached
+DROP_LEGACY_BOUND = """
+ALTER TABLE IF EXISTS api_transaction_legacy DROP CONSTRAINT IF EXISTS api_transaction_legacy_bound
+"""
+
+ATTACH_LEGACY = """
+ALTER TABLE api_transaction RENAME TO api_transaction_legacy;
+ALTER TABLE api_transaction_legacy DROP CONSTRAINT api_transaction_pkey;
+ALTER TABLE api_transaction_legacy ADD CONSTRAINT api_transaction_legacy_pkey
+    PRIMARY KEY USING INDEX api_transaction_legacy_pkey;
+ALTER INDEX api_trans_source_ts_idx RENAME TO api_transaction_legacy_source_ts_idx;
+ALTER INDEX api_trans_source_amount_idx RENAME TO api_transaction_legacy_source_amount_idx;
+ALTER INDEX api_trans_target_ts_idx RENAME TO api_transaction_legacy_target_ts_idx;
+ALTER INDEX api_trans_target_amount_idx RENAME TO api_transaction_legacy_target_amount_idx;
+ALTER INDEX api_trans_ts_idx RENAME TO api_transaction_legacy_ts_idx;
+ALTER SEQUENCE api_transaction_id_seq OWNED BY NONE;
+""" + CREATE_TABLE + """
+ALTER TABLE api_transaction ATTACH PARTITION api_transaction_legacy
+    FOR VALUES FROM (MINVALUE) TO ({end});
+""" + CREATE_MONTHS.format(first="{end}") + INDEXES
+
+UNPARTITION = """
+ALTER TABLE api_transaction RENAME TO api_transaction_partitioned;
+ALTER TABLE api_transaction_partitioned
+    RENAME CONSTRAINT api_transaction_pkey TO api_transaction_partitioned_pkey;
+ALTER SEQUENCE api_transaction_id_seq OWNED BY NONE;
+
+CREATE TABLE api_transaction (
+    id bigint NOT NULL DEFAULT nextval('api_transaction_id_seq'),
+    amount numeric(9, 2) NOT NULL,
+    source_id integer NOT NULL CONSTRAINT api_transaction_source_id_check CHECK (source_id >= 0),
+    target_id integer NOT NULL CONSTRAINT api_transaction_target_id_check CHECK (target_id >= 0),
+    comment text NOT NULL,
+    timestamp timestamp with time zone NOT NULL,
+    CONSTRAINT api_transaction_pkey PRIMARY KEY (id)
+);
+ALTER SEQUENCE api_transaction_id_seq OWNED BY api_transaction.id;
+
+INSERT INTO api_transaction (id, amount, source_id, target_id, comment, timestamp)
+SELECT id, amount, source_id, target_id, comment, timestamp FROM api_transaction_partitioned;
+DROP TABLE api_transaction_partitioned;
+""" + INDEXES
+
+# The statements taking the exclusive lock give up after LOCK_TIMEOUT instead of
+# queueing the requests behind a long transaction, and are retried LOCK_ATTEMPTS
+# times, LOCK_PAUSE seconds apart
+LOCK_TIMEOUT = "1s"
+LOCK_ATTEMPTS = 60
+LOCK_PAUSE = 1
+
+LOCK_NOT_AVAILABLE = "55P03"
+
+
+def locked(connection, sql: str):
+    """
+    Runs the statements in a transaction, retried while the lock isn't available
+    """
+    for attempt in range(LOCK_ATTEMPTS):
+        try:
+            with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                cursor.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+                cursor.execute(sql)
+            return
+        except OperationalError as e:
+            if getattr(e.__cause__, "pgcode", None) != LOCK_NOT_AVAILABLE \
+                    or attempt == LOCK_ATTEMPTS - 1:
+                raise
+            time.sleep(LOCK_PAUSE)
+
+
+def build_index(cursor, name: str, sql: str):
+    """
+    Builds the index concurrently, again if a failed build left it invalid
+    """
+    cursor.execute("SELECT i.indisvalid FROM pg_index i WHERE i.indexrelid = to_regclass(%s)",
+                   [name])
+    row = cursor.fetchone()
+    if row is not None and row[0]:
+        return
+    if row is not None:
+        cursor.execute(f"DROP INDEX CONCURRENTLY {name}")
+    cursor.execute(sql)
+
+
+def partition(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = 'api_transaction'::regclass")
+        if cursor.fetchone()[0] == "p":
+            # Attached by the previous run
+            locked(connection, DROP_LEGACY_BOUND)
+            return
+
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM api_transaction)")
+        if not cursor.fetchone()[0]:
+            with transaction.atomic(using=connection.alias):
+                cursor.execute("LOCK TABLE api_transaction IN ACCESS EXCLUSIVE MODE")
+                cursor.execute("SELECT EXISTS (SELECT 1 FROM api_transaction)")
+                if not cursor.fetchone()[0]:
+                    cursor.execute(PARTITION_EMPTY)
+                    return
+
+        build_index(cursor, "api_transaction_legacy_pkey", LEGACY_PKEY)
+        cursor.execute(LEGACY_END)
+        end = cursor.fetchone()[0]
+        locked(connection, ADD_LEGACY_BOUND.format(end=end))
+        cursor.execute("ALTER TABLE api_transaction VALIDATE CONSTRAINT api_transaction_legacy_bound")
+        locked(connection, ATTACH_LEGACY.format(end=end))
+        locked(connection, DROP_LEGACY_BOUND)
+        cursor.execute("ANALYZE api_transaction")
+
+
+def unpartition(apps, schema_editor):
+    with transaction.atomic(using=schema_editor.connection.alias), \
+            schema_editor.connection.cursor() as cursor:
+        cursor.execute(UNPARTITION)
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('api', '0005_statement_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.7 on 2026-10-18 11:06
+
+from django.db import migrations, models
+import django.utils.timezone
+import rest_framework.utils.encoders
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_partition_transactions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource', models.CharField(max_length=64)),
+                ('key', models.CharField(max_length=255)),
+                ('request_hash', models.CharField(max_length=64)),
+                ('status', models.PositiveSmallIntegerField(null=True)),
+                ('response', models.JSONField(encoder=rest_framework.utils.encoders.JSONEncoder, null=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='idempotencykey',
+            index=models.Index(fields=['expires'], name='api_idempotency_expires_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='idempotencykey',
+            constraint=models.UniqueConstraint(fields=('resource', 'key'), name='api_idempotency_key_uniq'),
+        ),
+    ]
@@ -1,8 +1,61 @@
-from django.db import models
+from decimal import Decimal
+from typing import Optional
+
+from django.db import models, router
 from django.utils import timezone
 from django.core.validators import MinValueValidator
 from django.core.exceptions import ValidationError
 
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class BalanceManager(models.Manager):
+    """
+    Manager for Balance - changes balances with single SQL-statements,
+    so that concurrent operations on the same user don't lose updates
+    """
+    def change(self, user_id: int, amount: Decimal) -> Optional["Balance"]:
+        """
+        Adds amount to the balance of the user with one conditional UPDATE.
+        The row is not changed if the balance would become negative.
+        :param user_id: int - id of the User
+        :param amount: Decimal - amount to add, may be negative
+        :return: updated Balance instance or None if no row was changed
+        """
+        table = self.model._meta.db_table
+        query = self.raw(
+            f"UPDATE {table} "
+            f"SET balance = balance + %s, last_update = %s "
+            f"WHERE user_id = %s AND balance + %s >= 0 "
+            f"RETURNING *",
+            [amount, timezone.now(), user_id, amount],
+            using=router.db_for_write(self.model)
+        )
+        return next(iter(query), None)
+
+    def deposit(self, user_id: int, amount: Decimal) -> "Balance":
+        """
+        Adds non-negative amount to the balance of the user, creating
+        the Balance on the first deposit (INSERT ... ON CONFLICT DO UPDATE).
+        The returned instance has `created` attribute set to True if
+        the Balance was created.
+        :param user_id: int - id of the User
+        :param amount: Decimal - amount to add
+        :return: Balance instance
+        """
+        table = self.model._meta.db_table
+        query = self.raw(
+            f"INSERT INTO {table} (balance, user_id, last_update) "
+            f"VALUES (%s, %s, %s) "
+            f"ON CONFLICT (user_id) DO UPDATE "
+            f"SET balance = {table}.balance + EXCLUDED.balance, "
+            f"last_update = EXCLUDED.last_update "
+            f"RETURNING *, (xmax = 0) AS created",
+            [amount, user_id, timezone.now()],
+            using=router.db_for_write(self.model)
+        )
+        return next(iter(query))
+
 
 class Balance(models.Model):
     balance = models.DecimalField(max_digits=9, decimal_places=2, default=0, null=False,
@@ -10,6 +63,8 @@ class Balance(models.Model):
     user_id = models.PositiveIntegerField(unique=True)
     last_update = models.DateTimeField(auto_now_add=True)
 
+    objects = BalanceManager()
+
     def clean(self):
         if self.balance < 0:
             raise ValidationError("Balance can't be negative")
@@ -29,8 +84,108 @@ class Transaction(models.Model):
     comment = models.TextField(max_length=4096)
     timestamp = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        # Match the orderings of both branches of the account statement,
+        # with id as a tie-breaker
+        indexes = [
+            models.Index(fields=["source_id", "timestamp", "id"],
+                         name="api_trans_source_ts_idx"),
+            models.Index(fields=["source_id", "amount", "id"],
+                         name="api_trans_source_amount_idx"),
+            models.Index(fields=["target_id", "timestamp", "id"],
+                         name="api_trans_target_ts_idx"),
+            models.Index(fields=["target_id", "amount", "id"],
+                         name="api_trans_target_amount_idx"),
+            # Time windows read by the balance compaction
+            models.Index(fields=["timestamp"], name="api_trans_ts_idx"),
+        ]
+
     def __repr__(self):
         return f"<Transaction (ID: {self.id})>"
 
     def __str__(self):
         return f"<Transaction (ID: {self.id})>"
+
+
+class BalanceSnapshot(models.Model):
+    """
+    Checkpoint of a balance - the sum of the user's transactions
+    with timestamp up to and including `timestamp`.
+    Built by the compact_balances command
+    """
+    user_id = models.PositiveIntegerField()
+    balance = models.DecimalField(max_digits=9, decimal_places=2)
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user_id", "timestamp"],
+                                    name="api_snapshot_user_ts_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["timestamp"], name="api_snapshot_ts_idx"),
+        ]
+
+    def __repr__(self):
+        return f"<BalanceSnapshot (ID: {self.id})>"
+
+    def __str__(self):
+        return f"<BalanceSnapshot (ID: {self.id}, Balance: {self.balance})>"
+
+
+class StatementRollup(models.Model):
+    """
+    Totals of a user's transactions over a closed day in the default
+    time zone. Built by the rollup_statements command
+    """
+    user_id = models.PositiveIntegerField()
+    day = models.DateField()
+    deposits = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    withdrawals = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    transfers_in = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    transfers_out = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user_id", "day"],
+                                    name="api_rollup_user_day_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["day"], name="api_rollup_day_idx"),
+        ]
+
+    def __repr__(self):
+        return f"<StatementRollup (ID: {self.id})>"
+
+    def __str__(self):
+        return f"<StatementRollup (ID: {self.id}, Day: {self.day})>"
+
+
+class IdempotencyKey(models.Model):
+    """
+    First response to a POST-request with the `Idempotency-Key` header,
+    returned again to the retries of the request until `expires`.
+    A row without `status` is a request still being handled
+    """
+    resource = models.CharField(max_length=64)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True, encoder=JSONEncoder)
+    created = models.DateTimeField(default=timezone.now)
+    expires = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["resource", "key"],
+                                    name="api_idempotency_key_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["expires"], name="api_idempotency_expires_idx"),
+        ]
+
+    def __repr__(self):
+        return f"<IdempotencyKey (ID: {self.id})>"
+
+    def __str__(self):
+        return f"<IdempotencyKey (ID: {self.id}, Key: {self.key})>"
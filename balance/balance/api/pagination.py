@@ -1,7 +1,146 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from typing import Optional
+
+from django.core import exceptions
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .exceptions import InvalidCursor
 
 
 class BasicPagination(PageNumberPagination):
     page_size_query_param = 'limit'
     page_size = 10
 
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a queryset ordered by a key field
+    and the id as a tie-breaker, e.g. ("-timestamp", "-id").
+
+    Instead of OFFSET, a page continues from the (key, id) of the last row
+    of the previous page, so the cost of a page doesn't depend on its depth
+    and rows inserted meanwhile don't shift the pages.
+    The cursors are opaque. COUNT(*) is only run with `?count=true`.
+    Works with querysets and with AccountStatement.
+    """
+    page_size = 10
+    max_page_size = 1000
+    page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    mode_query_param = 'pagination'
+
+    @classmethod
+    def is_requested(cls, request) -> bool:
+        """
+        Checks if the request asks for cursor pagination
+        """
+        params = request.query_params
+        return cls.cursor_query_param in params \
+            or params.get(cls.mode_query_param) == 'cursor'
+
+    def get_page_size(self, request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_link(self, row, reverse: bool) -> str:
+        """
+        Returns the URL of the page next to the row - after it,
+        or before it if reverse is set
+        """
+        cursor = self.encode_cursor(self.key, getattr(row, self.key), row.id, reverse)
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    @staticmethod
+    def encode_cursor(key: str, value, row_id: int, reverse: bool) -> str:
+        """
+        Returns the opaque cursor pointing at the row with the key value and id
+        """
+        cursor = {
+            "k": key,
+            "v": value.isoformat() if hasattr(value, "isoformat") else str(value),
+            "id": row_id,
+            "r": reverse,
+        }
+        data = json.dumps(cursor, separators=(",", ":")).encode()
+        return base64.urlsafe_b64encode(data).decode()
+
+    def decode_cursor(self, request, model) -> Optional[tuple]:
+        """
+        Returns (key value, id, reverse) of the cursor in the request.
+        Raises InvalidCursor if the cursor is malformed or made
+        for another ordering
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if cursor["k"] != self.key:
+                raise InvalidCursor
+            value = model._meta.get_field(self.key).to_python(cursor["v"])
+            return value, int(cursor["id"]), bool(cursor["r"])
+        except (ValueError, TypeError, KeyError, binascii.Error, exceptions.ValidationError):
+            raise InvalidCursor
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        ordering = getattr(queryset, "ordering", None) or queryset.query.order_by
+        assert len(ordering) == 2 and ordering[1].lstrip("-") == "id", \
+            "KeysetPagination needs ordering by a key field and id"
+        self.key = ordering[0].lstrip("-")
+        descending = ordering[0].startswith("-")
+        self.page_size = self.get_page_size(request)
+
+        self.count = None
+        if request.query_params.get(self.count_query_param) == "true":
+            self.count = queryset.count()
+
+        cursor = self.decode_cursor(request, queryset.model)
+        reverse = False
+        if cursor is not None:
+            value, row_id, reverse = cursor
+            table = queryset.model._meta.db_table
+            column = queryset.model._meta.get_field(self.key).column
+            operator = "<" if descending != reverse else ">"
+            queryset = queryset.filter(RawSQL(
+                f'("{table}"."{column}", "{table}"."id") {operator} (%s, %s)',
+                [value, row_id], output_field=BooleanField()
+            ))
+        if reverse:
+            queryset = queryset.reverse()
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        has_next, has_previous = (cursor is not None, has_more) if reverse \
+            else (has_more, cursor is not None)
+        self.next = self.get_link(rows[-1], False) if has_next and rows else None
+        self.previous = self.get_link(rows[0], True) if has_previous and rows else None
+        return rows
+
+    def get_paginated_response(self, data):
+        response = OrderedDict([
+            ('next', self.next),
+            ('previous', self.previous),
+            ('results', data),
+        ])
+        if self.count is not None:
+            response['count'] = self.count
+            response.move_to_end('count', last=False)
+        return Response(response)
@@ -0,0 +1,61 @@
+import codecs
+
+import orjson
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+
+from .bulk import parse_csv, parse_ndjson
+from .renderers import FastJSONRenderer
+
+
+def decode_lines(stream, parser_context) -> iter:
+    """
+    Lazily decodes the request body line by line,
+    so that a large body is never loaded into memory at once
+    """
+    parser_context = parser_context or {}
+    encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for line in stream:
+        yield decoder.decode(line)
+
+
+class CSVRowsParser(BaseParser):
+    """
+    Parses `user_id,amount` CSV rows into a lazy iterator of tuples
+    """
+    media_type = "text/csv"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return parse_csv(decode_lines(stream, parser_context))
+
+
+class NDJSONRowsParser(BaseParser):
+    """
+    Parses `{"user_id": ..., "amount": ...}` lines into a lazy iterator of tuples
+    """
+    media_type = "application/x-ndjson"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return parse_ndjson(decode_lines(stream, parser_context))
+
+
+class FastJSONParser(JSONParser):
+    """
+    JSONParser parsing UTF-8 bodies with orjson. Numbers with a fraction
+    are parsed into floats as by JSONParser, DecimalField takes them
+    by the shortest repr
+    """
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        if codecs.lookup(encoding).name != "utf-8":
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
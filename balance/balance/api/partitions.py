@@ -0,0 +1,155 @@
+"""
+Monthly partitions of the Transaction table.
+
+api_transaction is partitioned by range of timestamp, one partition
+per month in UTC named api_transaction_pYYYY_MM, and the default partition
+for the rows out of their ranges. Queries with a range of timestamp
+read only the partitions of that range.
+
+A table partitioned when it already had rows keeps them in the partition
+api_transaction_legacy of everything before some month, the monthly
+partitions start from that month.
+"""
+import re
+from datetime import datetime, timezone as dt_timezone
+from typing import List, Optional, Tuple
+
+from django.db import connections, router, transaction
+
+from .models import Transaction
+
+TABLE = Transaction._meta.db_table
+DEFAULT_PARTITION = f"{TABLE}_default"
+LEGACY_PARTITION = f"{TABLE}_legacy"
+PARTITION_NAME = re.compile(rf"^{TABLE}_p(\d{{4}})_(\d{{2}})$")
+
+
+def month_start(moment: datetime) -> datetime:
+    """
+    Returns the beginning of the month of the moment in UTC
+    """
+    moment = moment.astimezone(dt_timezone.utc)
+    return datetime(moment.year, moment.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"{TABLE}_p{month:%Y_%m}"
+
+
+def list_partitions(cursor) -> List[Tuple[str, datetime]]:
+    """
+    Returns the monthly partitions with the beginnings of their months, oldest first
+    """
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = %s::regclass",
+        [TABLE]
+    )
+    partitions = []
+    for name, in cursor.fetchall():
+        match = PARTITION_NAME.match(name)
+        if match:
+            month = datetime(int(match[1]), int(match[2]), 1, tzinfo=dt_timezone.utc)
+            partitions.append((name, month))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def legacy_end(cursor) -> Optional[datetime]:
+    """
+    Returns the end of the range of the legacy partition, None without it
+    """
+    cursor.execute(
+        "SELECT (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \\(''(.+)''\\)'))[1]"
+        "::timestamptz FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = %s::regclass AND c.relname = %s",
+        [TABLE, LEGACY_PARTITION]
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def create_partition(cursor, month: datetime) -> int:
+    """
+    Creates the partition of the month. Rows of the month already in
+    the default partition are moved into it, with the default partition
+    detached meanwhile
+    :return: int - number of the moved rows
+    """
+    quote = cursor.db.ops.quote_name
+    name, default = quote(partition_name(month)), quote(DEFAULT_PARTITION)
+    bounds = [month, add_months(month, 1)]
+    cursor.execute(
+        f"SELECT EXISTS (SELECT 1 FROM {default} WHERE timestamp >= %s AND timestamp < %s)",
+        bounds
+    )
+    if not cursor.fetchone()[0]:
+        cursor.execute(
+            f"CREATE TABLE {name} PARTITION OF {quote(TABLE)} FOR VALUES FROM (%s) TO (%s)",
+            bounds
+        )
+        return 0
+
+    cursor.execute(f"ALTER TABLE {quote(TABLE)} DETACH PARTITION {default}")
+    cursor.execute(
+        f"CREATE TABLE {name} PARTITION OF {quote(TABLE)} FOR VALUES FROM (%s) TO (%s)",
+        bounds
+    )
+    cursor.execute(
+        f"WITH moved AS (DELETE FROM {default} WHERE timestamp >= %s AND timestamp < %s "
+        f"RETURNING *) INSERT INTO {name} SELECT * FROM moved",
+        bounds
+    )
+    moved = cursor.rowcount
+    cursor.execute(f"ALTER TABLE {quote(TABLE)} ATTACH PARTITION {default} DEFAULT")
+    return moved
+
+
+def create_partitions(now: datetime, ahead: int) -> dict:
+    """
+    Creates the missing partitions from the month of `now`
+    up to `ahead` months after it, the months of the legacy partition skipped
+    :return: dict with the names of the created partitions
+        and the number of rows moved from the default partition
+    """
+    using = router.db_for_write(Transaction)
+    created, moved = [], 0
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        existing = {month for _, month in list_partitions(cursor)}
+        first = month_start(now)
+        end = legacy_end(cursor)
+        for month in (add_months(first, i) for i in range(ahead + 1)):
+            if month not in existing and (end is None or month >= end):
+                moved += create_partition(cursor, month)
+                created.append(partition_name(month))
+    return {"created": created, "moved": moved}
+
+
+def detach_partitions(before: datetime, archive_schema: Optional[str] = None,
+                      drop: bool = False) -> List[str]:
+    """
+    Detaches the partitions of the months ending not later than `before`.
+    A detached partition is moved to the archive schema, dropped,
+    or left as a standalone table
+    :return: list of the names of the detached partitions
+    """
+    using = router.db_for_write(Transaction)
+    detached = []
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        quote = cursor.db.ops.quote_name
+        for name, month in list_partitions(cursor):
+            if add_months(month, 1) > before:
+                break
+            cursor.execute(f"ALTER TABLE {quote(TABLE)} DETACH PARTITION {quote(name)}")
+            if drop:
+                cursor.execute(f"DROP TABLE {quote(name)}")
+            elif archive_schema is not None:
+                cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {quote(archive_schema)}")
+                cursor.execute(f"ALTER TABLE {quote(name)} SET SCHEMA {quote(archive_schema)}")
+            detached.append(name)
+    return detached
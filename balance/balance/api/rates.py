@@ -0,0 +1,291 @@
+"""
+Exchange rates for currency conversion of balances.
+
+A rate provider fetches the whole table of rates for 1 RUB in one call.
+The table is kept in a TTL cache shared by the workers, so converting
+a balance with a warm cache needs no network at all.
+
+Calls to the provider go through a circuit breaker with a latency budget.
+When the provider fails, the last known table is served marked as stale.
+
+The `a`-prefixed functions do the same for the async views, awaiting
+the provider instead of blocking a thread.
+"""
+import asyncio
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Optional, Tuple
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from balance import metrics
+from .breaker import CircuitBreaker
+from .exceptions import ConvertResultNone, RatesUnavailable, \
+    CircuitOpen, CallTimeout
+
+CENT = Decimal("0.01")
+RATES_CACHE_KEY = "rates:RUB"
+# The last fetched table, kept without expiry for the stale fallback
+LAST_RATES_CACHE_KEY = "rates:RUB:last"
+
+
+class RateProvider:
+    """
+    Base class for rate providers
+    """
+    def fetch_rates(self) -> Dict[str, Decimal]:
+        """
+        Fetches the rates of all currencies for 1 RUB.
+        Raises RatesUnavailable if the rates can't be fetched
+        :return: dict of rates by currency code
+        """
+        raise NotImplementedError
+
+    async def afetch_rates(self) -> Dict[str, Decimal]:
+        """
+        Fetches the rates without blocking the event loop.
+        Runs fetch_rates in a thread unless overridden
+        """
+        return await sync_to_async(self.fetch_rates, thread_sensitive=False)()
+
+
+class ExchangeRateHostProvider(RateProvider):
+    """
+    Fetches rates from exchangerate.host, keeping the connection alive
+    between calls
+    """
+    def __init__(self, url: str = "https://api.exchangerate.host/latest",
+                 timeout=(2, 5)):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        # An async client is bound to the event loop it was used in
+        self.async_clients = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def parse_rates(rates) -> Dict[str, Decimal]:
+        if not rates:
+            raise RatesUnavailable
+        return {code: Decimal(str(rate)) for code, rate in rates.items()}
+
+    def fetch_rates(self) -> Dict[str, Decimal]:
+        try:
+            response = self.session.get(self.url, params={"base": "RUB"},
+                                        timeout=self.timeout)
+            response.raise_for_status()
+            rates = response.json(parse_float=Decimal).get("rates")
+        except (requests.RequestException, ValueError) as e:
+            raise RatesUnavailable from e
+        return self.parse_rates(rates)
+
+    async def get_async_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self.async_clients.get(loop)
+        if client is None:
+            connect, read = self.timeout
+            # Loading of the CA certificates would block the event loop
+            client = await sync_to_async(httpx.AsyncClient, thread_sensitive=False)(
+                timeout=httpx.Timeout(read, connect=connect)
+            )
+            client = self.async_clients.setdefault(loop, client)
+        return client
+
+    async def afetch_rates(self) -> Dict[str, Decimal]:
+        try:
+            client = await self.get_async_client()
+            response = await client.get(self.url, params={"base": "RUB"})
+            response.raise_for_status()
+            rates = response.json(parse_float=Decimal).get("rates")
+        except (httpx.HTTPError, ValueError) as e:
+            raise RatesUnavailable from e
+        return self.parse_rates(rates)
+
+
+_provider = None
+_breaker = None
+_fallbacks_lock = threading.Lock()
+fallbacks = {"stale": 0, "unavailable": 0}
+
+
+def get_provider() -> RateProvider:
+    """
+    Returns the provider set by RATE_PROVIDER and RATE_PROVIDER_OPTIONS settings
+    """
+    global _provider
+    if _provider is None:
+        provider_class = import_string(settings.RATE_PROVIDER)
+        _provider = provider_class(**settings.RATE_PROVIDER_OPTIONS)
+    return _provider
+
+
+def get_breaker() -> CircuitBreaker:
+    """
+    Returns the circuit breaker around the provider, set by RATES_BREAKER setting
+    """
+    global _breaker
+    if _breaker is None:
+        _breaker = CircuitBreaker(**settings.RATES_BREAKER)
+    return _breaker
+
+
+def reset():
+    """
+    Drops the provider, the breaker and the fallback counters
+    """
+    global _provider, _breaker
+    _provider = _breaker = None
+    with _fallbacks_lock:
+        fallbacks.update(stale=0, unavailable=0)
+
+
+@receiver(setting_changed)
+def reset_on_setting_changed(setting, **kwargs):
+    if setting in ("RATE_PROVIDER", "RATE_PROVIDER_OPTIONS", "RATES_BREAKER"):
+        reset()
+
+
+def count_fallback(kind: str):
+    with _fallbacks_lock:
+        fallbacks[kind] += 1
+    metrics.RATES_LOOKUPS.inc((kind,))
+
+
+@contextmanager
+def observe_fetch():
+    """
+    Times the call to the provider within the block
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        metrics.RATES_FETCH_SECONDS.observe((outcome,), time.perf_counter() - start)
+
+
+def cached_rates() -> Optional[Dict[str, Decimal]]:
+    return caches[settings.RATES_CACHE].get(RATES_CACHE_KEY)
+
+
+def cache_rates(rates: Dict[str, Decimal]) -> Dict[str, Decimal]:
+    cache = caches[settings.RATES_CACHE]
+    cache.set(RATES_CACHE_KEY, rates, settings.RATES_CACHE_TTL)
+    cache.set(LAST_RATES_CACHE_KEY, rates, None)
+    return rates
+
+
+def stale_rates() -> Tuple[Dict[str, Decimal], bool]:
+    """
+    Returns the last known rates marked as stale.
+    Raises RatesUnavailable if there are no rates at all
+    """
+    rates = caches[settings.RATES_CACHE].get(LAST_RATES_CACHE_KEY)
+    if rates is None:
+        count_fallback("unavailable")
+        raise RatesUnavailable
+    count_fallback("stale")
+    return rates, True
+
+
+def fetch_rates() -> Dict[str, Decimal]:
+    """
+    Fetches the rates from the provider and puts them into the cache
+    """
+    with observe_fetch():
+        rates = get_provider().fetch_rates()
+    return cache_rates(rates)
+
+
+async def afetch_rates() -> Dict[str, Decimal]:
+    with observe_fetch():
+        rates = await get_provider().afetch_rates()
+    return await sync_to_async(cache_rates, thread_sensitive=False)(rates)
+
+
+def get_rates() -> Tuple[Dict[str, Decimal], bool]:
+    """
+    Returns the rates for 1 RUB from the cache, fetching them
+    from the provider through the circuit breaker when the cache is cold.
+    If the provider fails, is slow or the breaker is open, returns the last
+    known rates marked as stale.
+    Raises RatesUnavailable if there are no rates at all
+    :return: tuple of dict of rates by currency code and the stale flag
+    """
+    rates = cached_rates()
+    if rates is not None:
+        metrics.RATES_LOOKUPS.inc(("cache",))
+        return rates, False
+    try:
+        rates = get_breaker().call(fetch_rates)
+        metrics.RATES_LOOKUPS.inc(("fetched",))
+        return rates, False
+    except (RatesUnavailable, CircuitOpen, CallTimeout):
+        return stale_rates()
+
+
+async def aget_rates() -> Tuple[Dict[str, Decimal], bool]:
+    """
+    Async version of get_rates - the cache is read in a thread,
+    the provider is awaited through the circuit breaker
+    """
+    rates = await sync_to_async(cached_rates, thread_sensitive=False)()
+    if rates is not None:
+        metrics.RATES_LOOKUPS.inc(("cache",))
+        return rates, False
+    try:
+        rates = await get_breaker().acall(afetch_rates)
+        metrics.RATES_LOOKUPS.inc(("fetched",))
+        return rates, False
+    except (RatesUnavailable, CircuitOpen, CallTimeout):
+        return await sync_to_async(stale_rates, thread_sensitive=False)()
+
+
+def apply_rate(amount: Decimal, currency: str,
+               rates: Dict[str, Decimal]) -> Decimal:
+    rate = rates.get(currency)
+    if rate is None:
+        raise ConvertResultNone
+    return (amount * rate).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def convert(amount: Decimal, currency: str) -> Tuple[Decimal, bool]:
+    """
+    Converts amount of RUB to the currency.
+    Raises ConvertResultNone if there is no rate for the currency,
+    RatesUnavailable if the rates can't be fetched
+    :param amount: Decimal - amount of RUB
+    :param currency: str - currency code
+    :return: tuple of amount in the currency, rounded to cents,
+        and the flag of the stale rate
+    """
+    rates, stale = get_rates()
+    return apply_rate(amount, currency, rates), stale
+
+
+async def aconvert(amount: Decimal, currency: str) -> Tuple[Decimal, bool]:
+    """
+    Async version of convert
+    """
+    rates, stale = await aget_rates()
+    return apply_rate(amount, currency, rates), stale
+
+
+def stats() -> dict:
+    """
+    State of the circuit breaker and the fallback counters
+    """
+    with _fallbacks_lock:
+        counters = dict(fallbacks)
+    return {"breaker": get_breaker().stats(), "fallbacks": counters}
@@ -0,0 +1,43 @@
+"""
+JSON renderer of the API built on orjson.
+
+Renders the same bytes as DRF JSONRenderer with the settings of the project
+(compact, UTF-8, U+2028 and U+2029 escaped): the values orjson doesn't
+serialize itself are converted by DRF JSONEncoder.default. Decimals are
+rendered as numbers, as COERCE_DECIMAL_TO_STRING is off, and only if
+the shortest repr of the float is the exact value of the Decimal.
+"""
+from decimal import Decimal
+
+import orjson
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+_encoder = JSONEncoder()
+
+
+def encode_default(obj):
+    if isinstance(obj, Decimal):
+        number = float(obj)
+        if Decimal(repr(number)) != obj:
+            raise TypeError(f"{obj} can't be rendered as a JSON number exactly")
+        return number
+    return _encoder.default(obj)
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        # orjson can't indent by more than 2 spaces
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        rendered = orjson.dumps(data, default=encode_default, option=OPTIONS)
+        if b"\xe2\x80\xa8" in rendered or b"\xe2\x80\xa9" in rendered:
+            rendered = rendered.replace(b"\xe2\x80\xa8", b"\\u2028") \
+                .replace(b"\xe2\x80\xa9", b"\\u2029")
+        return rendered
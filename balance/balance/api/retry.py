@@ -0,0 +1,90 @@
+import random
+import threading
+import time
+from functools import wraps
+
+from django.db import transaction, OperationalError
+
+# SQLSTATE codes of errors after which the transaction can simply be re-run:
+# serialization_failure and deadlock_detected
+RETRYABLE_PGCODES = {"40001", "40P01"}
+
+MAX_ATTEMPTS = 5
+BASE_DELAY = 0.01
+MAX_DELAY = 0.2
+
+
+class RetryStats:
+    """
+    Thread-safe counters of transactions run by `retry_on_conflict`
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.attempts = 0
+        self.retries = 0
+        self.failures = 0
+
+    def add(self, attempts: int = 0, retries: int = 0, failures: int = 0):
+        with self._lock:
+            self.attempts += attempts
+            self.retries += retries
+            self.failures += failures
+
+    def reset(self):
+        with self._lock:
+            self.attempts = self.retries = self.failures = 0
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "attempts": self.attempts,
+                "retries": self.retries,
+                "failures": self.failures,
+            }
+
+
+retry_stats = RetryStats()
+
+
+def is_retryable(error: OperationalError) -> bool:
+    """
+    Checks if the database error is a transient serialization failure
+    or a deadlock
+    """
+    return getattr(error.__cause__, "pgcode", None) in RETRYABLE_PGCODES
+
+
+def backoff(attempt: int) -> float:
+    """
+    Exponential backoff with full jitter, bounded by MAX_DELAY
+    :param attempt: int - number of the failed attempt, starting from 1
+    :return: float - seconds to sleep
+    """
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** (attempt - 1)))
+
+
+def retry_on_conflict(func=None, *, attempts: int = MAX_ATTEMPTS):
+    """
+    Decorator - runs the function inside `transaction.atomic` and re-runs it
+    when the transaction fails with a serialization failure or a deadlock.
+    Re-raises the error after `attempts` tries.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            for attempt in range(1, attempts + 1):
+                retry_stats.add(attempts=1)
+                try:
+                    with transaction.atomic():
+                        return func(*args, **kwargs)
+                except OperationalError as e:
+                    if not is_retryable(e) or attempt == attempts:
+                        retry_stats.add(failures=1)
+                        raise
+                retry_stats.add(retries=1)
+                time.sleep(backoff(attempt))
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
@@ -0,0 +1,148 @@
+"""
+Daily rollups of statement totals.
+
+A rollup row keeps the totals of a user's transactions over one closed day
+in the default time zone. The statement takes the totals of whole days
+covered by the rollups from them, and the rest of the range from
+the transactions.
+
+Rollups are built incrementally, like balance snapshots: every run reads
+only the transactions of the days after the newest rolled up day.
+"""
+import zlib
+from datetime import date, datetime, time, timedelta
+from typing import List, Optional, Tuple
+
+from django.db import connections, router, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import StatementRollup, Transaction
+
+# Key of the advisory lock serializing the builds
+LOCK_KEY = zlib.crc32(b"statement-rollups")
+
+
+def day_start(day: date) -> datetime:
+    """
+    Returns the beginning of the day in the default time zone
+    """
+    return timezone.make_aware(datetime.combine(day, time.min),
+                               timezone.get_default_timezone())
+
+
+def local_day(moment: datetime) -> date:
+    return timezone.localtime(moment, timezone.get_default_timezone()).date()
+
+
+def watermark(using: Optional[str] = None) -> Optional[date]:
+    """
+    Returns the newest rolled up day
+    """
+    return StatementRollup.objects.using(using).aggregate(day=Max("day"))["day"]
+
+
+def split_range(start: Optional[datetime], end: datetime) \
+        -> Tuple[Optional[Tuple[Optional[date], date]], List[tuple]]:
+    """
+    Splits [start, end) into whole rolled up days and the rest
+    :return: tuple of the (first, last) rolled up days or None,
+        and the list of (start, end) ranges left for the transactions
+    """
+    last_rolled = watermark()
+    if last_rolled is None:
+        return None, [(start, end)]
+
+    first = None
+    if start is not None:
+        first = local_day(start)
+        if day_start(first) < start:
+            first += timedelta(days=1)
+    last = min(local_day(end) - timedelta(days=1), last_rolled)
+    if first is not None and first > last:
+        return None, [(start, end)]
+
+    ranges = []
+    if first is not None and start < day_start(first):
+        ranges.append((start, day_start(first)))
+    if day_start(last + timedelta(days=1)) < end:
+        ranges.append((day_start(last + timedelta(days=1)), end))
+    return (first, last), ranges
+
+
+def rollup_days(cursor, first: date, last: date) -> int:
+    """
+    Adds the rollups of the days from first to last inclusive
+    :return: int - number of the rollups
+    """
+    rollup_table = StatementRollup._meta.db_table
+    transaction_table = Transaction._meta.db_table
+    params = {
+        "tz": timezone.get_default_timezone_name(),
+        "start": day_start(first),
+        "end": day_start(last + timedelta(days=1)),
+    }
+    cursor.execute(
+        f"INSERT INTO {rollup_table} "
+        f"(user_id, day, deposits, withdrawals, transfers_in, transfers_out) "
+        f"SELECT user_id, day, sum(deposits), sum(withdrawals), "
+        f"sum(transfers_in), sum(transfers_out) FROM ("
+        f"SELECT source_id AS user_id, (timestamp AT TIME ZONE %(tz)s)::date AS day, "
+        f"CASE WHEN source_id = target_id AND comment NOT IN ('Withdrawal', 'Transfer') "
+        f"THEN amount ELSE 0 END AS deposits, "
+        f"CASE WHEN source_id = target_id AND comment = 'Withdrawal' "
+        f"THEN amount ELSE 0 END AS withdrawals, "
+        f"0 AS transfers_in, "
+        f"CASE WHEN source_id <> target_id THEN amount ELSE 0 END AS transfers_out "
+        f"FROM {transaction_table} "
+        f"WHERE timestamp >= %(start)s AND timestamp < %(end)s "
+        f"UNION ALL "
+        f"SELECT target_id, (timestamp AT TIME ZONE %(tz)s)::date, 0, 0, amount, 0 "
+        f"FROM {transaction_table} "
+        f"WHERE timestamp >= %(start)s AND timestamp < %(end)s "
+        f"AND target_id <> source_id"
+        f") rows GROUP BY user_id, day",
+        params
+    )
+    return cursor.rowcount
+
+
+def rollup(until: datetime, step: int) -> dict:
+    """
+    Builds the rollups of the days after the newest rolled up day
+    which end before `until`, at most `step` days in one DB transaction.
+    Days without transactions are skipped. Builds running at once take turns
+    :param until: datetime - it has to be far enough in the past
+        for the transactions before it to be committed
+    :param step: int - most days in one DB transaction
+    :return: dict with the newest rolled up day, the number of
+        DB transactions and rollups
+    """
+    using = router.db_for_write(StatementRollup)
+    last_closed = local_day(until) - timedelta(days=1)
+    batches = rollups = 0
+    last_rolled: Optional[date] = None
+
+    while True:
+        with transaction.atomic(using=using), connections[using].cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [LOCK_KEY])
+            last_rolled = watermark(using)
+
+            rows = Transaction.objects.using(using) \
+                .filter(timestamp__lt=day_start(last_closed + timedelta(days=1)))
+            if last_rolled is not None:
+                rows = rows.filter(timestamp__gte=day_start(last_rolled + timedelta(days=1)))
+            first = rows.aggregate(first=Min("timestamp"))["first"]
+            if first is None:
+                break
+
+            first_day = local_day(first)
+            rollups += rollup_days(cursor, first_day,
+                                   min(first_day + timedelta(days=step - 1), last_closed))
+            batches += 1
+
+    return {
+        "watermark": last_rolled,
+        "batches": batches,
+        "rollups": rollups,
+    }
@@ -0,0 +1,270 @@
+"""
+Synthetic ledger for performance work.
+
+Generates users with power-law activity - the user of rank r takes part
+in transactions with probability proportional to 1 / r ** skew, user 1
+being the most active - and loads their transactions and balances with
+Postgres COPY.
+
+The time span is cut into chunks of transactions, every chunk is generated
+and copied by a worker process in its own connection. Workers return the
+net change and the lowest running change of the balance of every user
+in their chunk, from which the parent works out the opening deposit of
+every user that keeps the balance non-negative at any moment, and the
+closing withdrawal of the excess over the largest balance. The balances
+are then the sums of the transactions of the users.
+
+The secondary indexes of the transactions are dropped for the load and
+built back afterwards, one worker per index.
+"""
+import io
+import itertools
+import math
+import multiprocessing
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from django.db import connections, router, transaction
+
+from .bulk import max_balance
+from .models import Balance, Transaction
+from .partitions import create_partitions, month_start
+from . import balance_cache
+
+# Largest amount of a transaction in cents
+MAX_AMOUNT = 10 ** Transaction._meta.get_field("amount").max_digits - 1
+
+# Generator of the chunks of a worker process, set up by init_worker
+_generator = None
+
+
+def cents(value: int) -> str:
+    return f"{value // 100}.{value % 100:02d}"
+
+
+class LedgerGenerator:
+    """
+    Generates and copies the chunks of the ledger.
+    Chunk `index` covers its share of the time span from `start` to `end`,
+    so the chunks are in the order of time
+    """
+    def __init__(self, users: int, transactions: int, chunk_size: int, skew: float,
+                 transfer_share: float, max_amount: int, start: datetime, end: datetime,
+                 seed: int):
+        self.users = users
+        self.transactions = transactions
+        self.chunk_size = chunk_size
+        self.transfer_share = transfer_share
+        self.max_amount = max_amount
+        self.start = start
+        self.end = end
+        self.seed = seed
+        self.cum_weights = None
+        if skew:
+            self.cum_weights = list(itertools.accumulate(
+                1 / rank ** skew for rank in range(1, users + 1)
+            ))
+
+    @property
+    def chunks(self) -> int:
+        return math.ceil(self.transactions / self.chunk_size)
+
+    def pick_users(self, rng: random.Random, count: int) -> List[int]:
+        return rng.choices(range(self.users), cum_weights=self.cum_weights, k=count)
+
+    def rows(self, index: int) -> Tuple[List[tuple], Dict[int, list]]:
+        """
+        Generates the transactions of the chunk in the order of time
+        :return: tuple of the rows (amount, source_id, target_id, comment, timestamp)
+            and the net change and the lowest running change in cents
+            of the balances of the users, by the index of the user
+        """
+        rng = random.Random(self.seed * 1000003 + index)
+        count = min(self.chunk_size, self.transactions - index * self.chunk_size)
+        span = (self.end - self.start) / self.chunks
+        chunk_start = self.start + span * index
+        step = span / count
+        sources, targets = self.pick_users(rng, count), self.pick_users(rng, count)
+        log_max = math.log(self.max_amount)
+        half_other = (1 + self.transfer_share) / 2
+
+        changes = {}
+        rows = []
+        for i in range(count):
+            amount = max(1, int(math.exp(rng.random() * log_max)))
+            timestamp = chunk_start + step * (i + rng.random())
+            kind = rng.random()
+            if kind < self.transfer_share:
+                source, target = sources[i], targets[i]
+                if source == target:
+                    target = (target + 1) % self.users
+                comment = "Transfer"
+            else:
+                source = target = sources[i]
+                comment = "Deposit" if kind < half_other else "Withdrawal"
+
+            if comment != "Deposit":
+                change = changes.setdefault(source, [0, 0])
+                change[0] -= amount
+                change[1] = min(change[1], change[0])
+            if comment != "Withdrawal":
+                changes.setdefault(target, [0, 0])[0] += amount
+            rows.append((amount, source + 1, target + 1, comment, timestamp))
+        return rows, changes
+
+    def load_chunk(self, index: int) -> Dict[int, list]:
+        """
+        Generates the chunk and copies it into the transactions
+        :return: the changes of the balances of the users in the chunk
+        """
+        rows, changes = self.rows(index)
+        stream = io.StringIO()
+        for amount, source_id, target_id, comment, timestamp in rows:
+            stream.write(f"{cents(amount)}\t{source_id}\t{target_id}\t{comment}\t{timestamp}\n")
+        stream.seek(0)
+        copy_rows(Transaction, ["amount", "source_id", "target_id", "comment", "timestamp"],
+                  stream)
+        return changes
+
+
+def copy_rows(model, columns: List[str], stream) -> None:
+    """
+    Copies tab-separated rows into the table of the model in one transaction
+    """
+    using = router.db_for_write(model)
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        # The whole load is redone on a crash anyway
+        cursor.execute("SET LOCAL synchronous_commit TO off")
+        cursor.copy_expert(
+            f"COPY {model._meta.db_table} ({', '.join(columns)}) FROM STDIN", stream
+        )
+
+
+def init_worker(generator: LedgerGenerator) -> None:
+    global _generator
+    _generator = generator
+
+
+def load_chunk(index: int) -> Dict[int, list]:
+    return _generator.load_chunk(index)
+
+
+def build_index(sql: str) -> None:
+    using = router.db_for_write(Transaction)
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql)
+    connections.close_all()
+
+
+def secondary_indexes(cursor) -> List[Tuple[str, str]]:
+    """
+    Returns the names and the definitions of the indexes
+    of the transactions but the primary key
+    """
+    cursor.execute(
+        "SELECT c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i "
+        "JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE i.indrelid = %s::regclass AND NOT i.indisprimary ORDER BY c.relname",
+        [Transaction._meta.db_table]
+    )
+    # The definition of an index of a partitioned table is of its parent alone
+    return [(name, sql.replace(" ON ONLY ", " ON ", 1)) for name, sql in cursor.fetchall()]
+
+
+def split_rows(user_id: int, amount: int, comment: str, timestamp: datetime):
+    """
+    Yields the rows of a deposit or a withdrawal of the amount,
+    split into transactions of the largest amount
+    """
+    while amount > 0:
+        part = min(amount, MAX_AMOUNT)
+        yield f"{cents(part)}\t{user_id}\t{user_id}\t{comment}\t{timestamp}\n"
+        amount -= part
+
+
+def seed_ledger(users: int, transactions: int, start: datetime, end: datetime,
+                skew: float = 1.0, transfer_share: float = 0.8, max_amount: int = 100000,
+                opening_balance: int = 100000, chunk_size: int = 200000, workers: int = None,
+                seed: int = 0, drop_indexes: bool = True) -> dict:
+    """
+    Loads the balances of users 1 to `users` and their transactions
+    from `start` to `end` into the empty ledger.
+    Every user gets an opening deposit at `start` of up to `opening_balance`
+    cents above what keeps the balance non-negative, and the balances
+    over the largest one are cut with withdrawals at `end`
+    :param skew: float - exponent of the power law of the activity, 0 for uniform
+    :param transfer_share: float - share of the transfers, the rest are
+        deposits and withdrawals in equal shares
+    :param max_amount: int - largest amount of a transaction in cents,
+        the amounts are log-uniform
+    :return: dict with the numbers of the users and the transactions loaded
+    """
+    max_amount = min(max_amount, MAX_AMOUNT)
+    generator = LedgerGenerator(users, transactions, chunk_size, skew, transfer_share,
+                                max_amount, start + timedelta(seconds=1),
+                                end - timedelta(seconds=1), seed)
+    using = router.db_for_write(Transaction)
+
+    months = (month_start(end).year - month_start(start).year) * 12 \
+        + month_start(end).month - month_start(start).month
+    create_partitions(start, months)
+
+    indexes = []
+    if drop_indexes:
+        with transaction.atomic(using=using), connections[using].cursor() as cursor:
+            indexes = secondary_indexes(cursor)
+            for name, _ in indexes:
+                cursor.execute(f"DROP INDEX {connections[using].ops.quote_name(name)}")
+
+    # Forked workers must not share the connections of the parent
+    connections.close_all()
+    context = multiprocessing.get_context("fork")
+    try:
+        with context.Pool(workers, initializer=init_worker, initargs=(generator,)) as pool:
+            net, low = [0] * users, [0] * users
+            # The chunks come in the order of time, so the lowest running change
+            # of a chunk adds to the net change of the balance before it
+            for changes in pool.imap(load_chunk, range(generator.chunks)):
+                for user, (change, lowest) in changes.items():
+                    low[user] = min(low[user], net[user] + lowest)
+                    net[user] += change
+    finally:
+        if indexes:
+            with context.Pool(workers) as pool:
+                pool.map(build_index, [sql for _, sql in indexes])
+
+    rng = random.Random(seed)
+    limit = int(max_balance() * 100)
+    opening, closing, balances = io.StringIO(), io.StringIO(), io.StringIO()
+    closing_count = 0
+    for user in range(users):
+        user_id = user + 1
+        deposit = -low[user] + rng.randint(1, max(1, opening_balance))
+        balance = deposit + net[user]
+        opening.writelines(split_rows(user_id, deposit, "Deposit", start))
+        if balance > limit:
+            closing_count += 1
+            closing.writelines(split_rows(user_id, balance - limit, "Withdrawal", end))
+            balance = limit
+        balances.write(f"{cents(balance)}\t{user_id}\t{end}\n")
+
+    for stream in (opening, closing):
+        stream.seek(0)
+        copy_rows(Transaction, ["amount", "source_id", "target_id", "comment", "timestamp"],
+                  stream)
+    balances.seek(0)
+    copy_rows(Balance, ["balance", "user_id", "last_update"], balances)
+
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"ANALYZE {Balance._meta.db_table}")
+        cursor.execute(f"ANALYZE {Transaction._meta.db_table}")
+    balance_cache.invalidate_all()
+
+    return {
+        "users": users,
+        "transactions": transactions,
+        "chunks": generator.chunks,
+        "capped_balances": closing_count,
+        "rebuilt_indexes": [name for name, _ in indexes],
+    }
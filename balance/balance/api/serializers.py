@@ -1,9 +1,13 @@
+import decimal
 from decimal import Decimal
+from functools import lru_cache
+from typing import Callable, Iterable, List, Optional, Tuple
 
+from django.conf import settings
 from django.utils import timezone
-from django.core import exceptions
 
-from rest_framework import serializers
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 
 from .models import Balance, Transaction
 
@@ -34,24 +38,90 @@ class TransactionSerializer(serializers.ModelSerializer):
         fields = ["amount", "source_id", "target_id", "comment", "timestamp"]
 
 
+class StatementTransactionSerializer(TransactionSerializer):
+    """
+    A row of the account statement, with the direction
+    relative to the user - "out", "in" or "self"
+    """
+    direction = serializers.CharField(read_only=True)
+
+    class Meta(TransactionSerializer.Meta):
+        fields = TransactionSerializer.Meta.fields + ["direction"]
+
+
+@lru_cache(maxsize=None)
+def readable_fields(serializer_class) -> Tuple[Tuple[str, serializers.Field], ...]:
+    """
+    Returns the names and the fields of the serializer output,
+    built once per serializer class
+    """
+    return tuple((name, field) for name, field in serializer_class().fields.items()
+                 if not field.write_only)
+
+
+def field_converter(field: serializers.Field, tz) -> Optional[Callable]:
+    """
+    Returns the function converting a value of the field read from the DB
+    into the same representation as field.to_representation,
+    or None if the value is its own representation
+    :param tz: current time zone, None without USE_TZ
+    """
+    if isinstance(field, serializers.DecimalField) and field.decimal_places is not None \
+            and not getattr(field, "coerce_to_string", api_settings.COERCE_DECIMAL_TO_STRING):
+        quantum = Decimal(".1") ** field.decimal_places
+        context = decimal.getcontext().copy()
+        if field.max_digits is not None:
+            context.prec = field.max_digits
+        rounding = field.rounding
+        return lambda value: value.quantize(quantum, rounding, context)
+
+    if isinstance(field, serializers.DateTimeField) and tz is not None \
+            and getattr(field, "format", api_settings.DATETIME_FORMAT) == ISO_8601 \
+            and not hasattr(field, "timezone"):
+        def convert_datetime(value):
+            if timezone.is_naive(value):
+                return field.to_representation(value)
+            value = value.astimezone(tz).isoformat()
+            return value[:-6] + "Z" if value.endswith("+00:00") else value
+        return convert_datetime
+
+    if type(field) in (serializers.IntegerField, serializers.CharField):
+        return None
+    return field.to_representation
+
+
+class ValuesSerializer:
+    """
+    Fast path of a read-only DRF serializer for the rows read with
+    values_list(*serializer.fields): turns the tuples into the same dicts
+    as the serializer does with model instances, without building the
+    instances and looking the fields up for every row.
+    Extra trailing values of the rows are ignored
+    """
+    def __init__(self, serializer_class):
+        tz = timezone.get_current_timezone() if settings.USE_TZ else None
+        fields = readable_fields(serializer_class)
+        self.fields = [name for name, _ in fields]
+        self.sources = [field.source for _, field in fields]
+        self.converters = [field_converter(field, tz) for _, field in fields]
+
+    def to_representation(self, row: tuple) -> dict:
+        return {
+            name: value if convert is None or value is None else convert(value)
+            for name, convert, value in zip(self.fields, self.converters, row)
+        }
+
+    def many(self, rows: Iterable[tuple]) -> List[dict]:
+        to_representation = self.to_representation
+        return [to_representation(row) for row in rows]
+
+
 class ChangeBalanceSerializer(MyBaseSerializer):
     user_id = serializers.IntegerField()
     amount = serializers.DecimalField(max_digits=9, decimal_places=2)
 
-    def update(self, instance: Balance, validated_data):
-        instance.balance += validated_data.pop("amount")
-        instance.last_update = timezone.now()
-        try:
-            instance.clean_fields()
-        except exceptions.ValidationError:
-            raise serializers.ValidationError({
-                'balance': ['Would be negative after the operation.']
-            })
-        instance.save()
-        return instance
-
 
-class MakeTransferSerializer(MyBaseSerializer):
+class TransferSerializer(serializers.Serializer):
     source_id = serializers.IntegerField()
     target_id = serializers.IntegerField()
     amount = serializers.DecimalField(max_digits=9, decimal_places=2)
@@ -60,3 +130,25 @@ class MakeTransferSerializer(MyBaseSerializer):
         if amount < 0:
             raise serializers.ValidationError('Can\'t be negative.')
         return amount
+
+
+class MakeTransferSerializer(MyBaseSerializer, TransferSerializer):
+    pass
+
+
+class MakeTransfersSerializer(MyBaseSerializer):
+    """
+    Validates a batch of transfers - a list version of MakeTransferSerializer.
+    `atomic` chooses between all-or-nothing and per-item processing
+    """
+    max_transfers = 10000
+
+    transfers = TransferSerializer(many=True, allow_empty=False)
+    atomic = serializers.BooleanField(default=True)
+
+    def validate_transfers(self, transfers: list) -> list:
+        if len(transfers) > self.max_transfers:
+            raise serializers.ValidationError(
+                f'Can\'t contain more than {self.max_transfers} transfers.'
+            )
+        return transfers
@@ -0,0 +1,133 @@
+"""
+Balance snapshots - periodic checkpoints of balances.
+
+A snapshot stores the sum of a user's transactions up to its timestamp.
+The balance as of a moment is the nearest snapshot before it plus
+the transactions of the user after the snapshot, read through the
+(source_id, timestamp) and (target_id, timestamp) indexes.
+
+Snapshots are built incrementally: every run of compaction reads only
+the transactions after the newest snapshot, window by window, and adds
+a snapshot for each user who has transactions in the window.
+"""
+import zlib
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Optional
+
+from django.db import connections, router, transaction
+from django.db.models import Case, DecimalField, F, Max, Min, Sum, Value, When
+
+from .models import BalanceSnapshot, Transaction
+
+# Key of the advisory lock serializing compactions
+LOCK_KEY = zlib.crc32(b"balance-snapshots")
+
+
+def signed_amount(user_id: int):
+    """
+    Expression of the change of the user's balance by a transaction
+    sent by the user: deposits add to it, withdrawals and transfers subtract,
+    a transfer to oneself leaves it as it is
+    """
+    return Case(
+        When(target_id=user_id, comment="Withdrawal", then=-F("amount")),
+        When(target_id=user_id, comment="Transfer", then=Value(0)),
+        When(target_id=user_id, then=F("amount")),
+        default=-F("amount"),
+        output_field=DecimalField(max_digits=9, decimal_places=2),
+    )
+
+
+def balance_as_of(user_id: int, moment: datetime) -> Decimal:
+    """
+    Returns the balance of the user as of the moment - the nearest snapshot
+    plus the transactions after it
+    :param user_id: int - id of the User
+    :param moment: datetime - aware datetime
+    :return: Decimal balance
+    """
+    snapshot = BalanceSnapshot.objects.filter(user_id=user_id, timestamp__lte=moment) \
+        .order_by("-timestamp").values_list("balance", "timestamp").first()
+    balance, since = snapshot if snapshot is not None else (Decimal(0), None)
+
+    sent = Transaction.objects.filter(source_id=user_id, timestamp__lte=moment)
+    received = Transaction.objects.filter(target_id=user_id, timestamp__lte=moment) \
+        .exclude(source_id=user_id)
+    if since is not None:
+        sent = sent.filter(timestamp__gt=since)
+        received = received.filter(timestamp__gt=since)
+
+    balance += sent.aggregate(total=Sum(signed_amount(user_id)))["total"] or 0
+    balance += received.aggregate(total=Sum("amount"))["total"] or 0
+    return balance
+
+
+def compact_window(cursor, start: datetime, end: datetime) -> int:
+    """
+    Adds snapshots as of the end of the window for the users
+    with transactions in (start, end]
+    :return: int - number of the snapshots
+    """
+    snapshot_table = BalanceSnapshot._meta.db_table
+    transaction_table = Transaction._meta.db_table
+    cursor.execute(
+        f"INSERT INTO {snapshot_table} (user_id, balance, timestamp) "
+        f"SELECT d.user_id, coalesce(p.balance, 0) + d.delta, %(end)s "
+        f"FROM (SELECT user_id, sum(delta) AS delta FROM ("
+        f"SELECT source_id AS user_id, CASE "
+        f"WHEN source_id <> target_id THEN -amount "
+        f"WHEN comment = 'Withdrawal' THEN -amount "
+        f"WHEN comment = 'Transfer' THEN 0 "
+        f"ELSE amount END AS delta "
+        f"FROM {transaction_table} "
+        f"WHERE timestamp > %(start)s AND timestamp <= %(end)s "
+        f"UNION ALL "
+        f"SELECT target_id, amount FROM {transaction_table} "
+        f"WHERE timestamp > %(start)s AND timestamp <= %(end)s "
+        f"AND target_id <> source_id"
+        f") rows GROUP BY user_id) d "
+        f"LEFT JOIN LATERAL (SELECT balance FROM {snapshot_table} s "
+        f"WHERE s.user_id = d.user_id ORDER BY s.timestamp DESC LIMIT 1) p ON true",
+        {"start": start, "end": end}
+    )
+    return cursor.rowcount
+
+
+def compact(until: datetime, step: timedelta) -> dict:
+    """
+    Builds the snapshots of the transactions from the newest snapshot
+    up to `until`, in windows of at most `step`, each in its own DB transaction.
+    Empty periods are skipped. Compactions running at once take turns
+    :param until: datetime - transactions after it are left for the next run,
+        it has to be far enough in the past for them to be committed
+    :param step: timedelta - longest window
+    :return: dict with the watermark, the number of windows and snapshots
+    """
+    using = router.db_for_write(BalanceSnapshot)
+    windows = snapshots = 0
+    watermark: Optional[datetime] = None
+
+    while True:
+        with transaction.atomic(using=using), connections[using].cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [LOCK_KEY])
+            watermark = BalanceSnapshot.objects.using(using) \
+                .aggregate(watermark=Max("timestamp"))["watermark"]
+
+            rows = Transaction.objects.using(using).filter(timestamp__lte=until)
+            if watermark is not None:
+                rows = rows.filter(timestamp__gt=watermark)
+            first = rows.aggregate(first=Min("timestamp"))["first"]
+            if first is None:
+                break
+
+            start = watermark if watermark is not None else first - timedelta(microseconds=1)
+            end = min(first + step, until)
+            snapshots += compact_window(cursor, start, end)
+            windows += 1
+
+    return {
+        "watermark": watermark,
+        "windows": windows,
+        "snapshots": snapshots,
+    }
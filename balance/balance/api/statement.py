@@ -0,0 +1,185 @@
+"""
+Account statement - the transactions of a user in both directions.
+
+`source_id = X OR target_id = X` can't be served by one index range scan,
+so the statement is a UNION ALL of two branches, each an index range scan:
+the rows sent by the user, and the rows received from other users.
+Every branch is ordered and limited to the end of the requested window,
+so a page reads at most that many rows of each branch, whatever
+the size of the ledger, and the outer query merges them by the sort key.
+
+Totals of the statement per day, week or month are computed the same way,
+with date_trunc and GROUP BY over each branch.
+"""
+import heapq
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from operator import itemgetter
+from typing import Iterator, List, Optional
+
+from django.conf import settings
+from django.db.models import Case, CharField, DateField, Q, Sum, Value, When
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from . import rollups
+from .models import StatementRollup, Transaction
+
+OUT = "out"
+IN = "in"
+SELF = "self"
+
+GRANULARITIES = ("day", "week", "month")
+TOTALS = ("deposits", "withdrawals", "transfers_in", "transfers_out")
+
+
+class AccountStatement:
+    """
+    Queryset-like statement of a user, ordered by a key field and the id,
+    e.g. ("-timestamp", "-id"). Supports what the paginators need:
+    filter(), reverse(), count() and slicing. The rows are Transaction
+    instances with the `direction` attribute - "out", "in",
+    or "self" for deposits and withdrawals, or named tuples of the fields
+    given to values_list()
+    """
+    model = Transaction
+
+    def __init__(self, user_id: int, ordering: List[str], filters: tuple = (),
+                 fields: tuple = ()):
+        self.user_id = user_id
+        self.ordering = list(ordering)
+        self.filters = filters
+        self.fields = fields
+
+    def _clone(self, **kwargs) -> "AccountStatement":
+        options = {"user_id": self.user_id, "ordering": self.ordering,
+                   "filters": self.filters, "fields": self.fields}
+        options.update(kwargs)
+        return AccountStatement(**options)
+
+    def values_list(self, *fields: str) -> "AccountStatement":
+        """
+        Returns the statement with the rows as named tuples of the fields.
+        The ordering fields are added if missing, for the paginators
+        """
+        fields += tuple(field.lstrip("-") for field in self.ordering
+                        if field.lstrip("-") not in fields)
+        return self._clone(fields=fields)
+
+    def filter(self, *args) -> "AccountStatement":
+        """
+        Returns the statement with the expressions applied to both branches
+        """
+        return self._clone(filters=self.filters + args)
+
+    def reverse(self) -> "AccountStatement":
+        ordering = [field[1:] if field.startswith("-") else f"-{field}"
+                    for field in self.ordering]
+        return self._clone(ordering=ordering)
+
+    def branches(self) -> tuple:
+        """
+        Returns the querysets of the sent and the received rows
+        """
+        sent = Transaction.objects.filter(*self.filters, source_id=self.user_id).annotate(
+            direction=Case(When(target_id=self.user_id, then=Value(SELF)),
+                           default=Value(OUT), output_field=CharField())
+        )
+        received = Transaction.objects.filter(*self.filters, target_id=self.user_id) \
+            .exclude(source_id=self.user_id) \
+            .annotate(direction=Value(IN, output_field=CharField()))
+        return sent, received
+
+    def count(self) -> int:
+        sent, received = self.branches()
+        return sent.values("id").union(received.values("id"), all=True).count()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step is not None:
+            raise TypeError("AccountStatement supports only slices without a step")
+        if item.stop is not None and item.stop <= (item.start or 0):
+            return []
+        sent, received = self.branches()
+        sent, received = sent.order_by(*self.ordering), received.order_by(*self.ordering)
+        if item.stop is not None:
+            sent, received = sent[:item.stop], received[:item.stop]
+        if self.fields:
+            sent = sent.values_list(*self.fields, named=True)
+            received = received.values_list(*self.fields, named=True)
+        rows = sent.union(received, all=True).order_by(*self.ordering)
+        return list(rows[item])
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def values_iterator(self, *fields: str, chunk_size: int = 2000) -> Iterator[tuple]:
+        """
+        Yields tuples of the fields of all the rows in order, reading both
+        branches with server-side cursors and merging them, so that neither
+        the app nor the DB holds the whole statement.
+        The ordering fields have to be among the fields.
+        Has to be consumed inside a transaction, otherwise the cursors are
+        declared WITH HOLD and materialized by the DB
+        """
+        positions = [fields.index(field.lstrip("-")) for field in self.ordering]
+        descending = self.ordering[0].startswith("-")
+        cursors = [
+            branch.order_by(*self.ordering).values_list(*fields).iterator(chunk_size=chunk_size)
+            for branch in self.branches()
+        ]
+        return heapq.merge(*cursors, key=itemgetter(*positions), reverse=descending)
+
+
+def statement_totals(user_id: int, granularity: str, start: Optional[datetime],
+                     end: datetime) -> List[dict]:
+    """
+    Returns the totals of the user's transactions in [start, end)
+    per period of the granularity in the default time zone.
+    Whole days covered by the rollups are taken from them
+    if STATEMENT_ROLLUP setting is on.
+    Periods without transactions are left out
+    :param granularity: str - "day", "week" or "month"
+    :param start: datetime or None for the beginning of the ledger
+    :return: list of dicts with the first day of the period and the totals
+    """
+    buckets = defaultdict(lambda: dict.fromkeys(TOTALS, Decimal(0)))
+
+    def add(rows):
+        for row in rows:
+            bucket = buckets[row.pop("period")]
+            for name, value in row.items():
+                bucket[name] += value or 0
+
+    ranges = [(start, end)]
+    if settings.STATEMENT_ROLLUP:
+        days, ranges = rollups.split_range(start, end)
+        if days is not None:
+            first, last = days
+            rows = StatementRollup.objects.filter(user_id=user_id, day__lte=last)
+            if first is not None:
+                rows = rows.filter(day__gte=first)
+            add(rows.annotate(period=Trunc("day", granularity, output_field=DateField()))
+                .values("period").annotate(**{name: Sum(name) for name in TOTALS})
+                .order_by())
+
+    period = Trunc("timestamp", granularity, output_field=DateField(),
+                   tzinfo=timezone.get_default_timezone())
+    for range_start, range_end in ranges:
+        in_range = Q(timestamp__lt=range_end)
+        if range_start is not None:
+            in_range &= Q(timestamp__gte=range_start)
+        sent = Transaction.objects.filter(in_range, source_id=user_id)
+        received = Transaction.objects.filter(in_range, target_id=user_id) \
+            .exclude(source_id=user_id)
+        add(sent.annotate(period=period).values("period").annotate(
+            # A transfer to oneself is neither of the totals
+            deposits=Sum("amount", filter=Q(target_id=user_id)
+                         & ~Q(comment__in=("Withdrawal", "Transfer"))),
+            withdrawals=Sum("amount", filter=Q(target_id=user_id, comment="Withdrawal")),
+            transfers_out=Sum("amount", filter=~Q(target_id=user_id)),
+        ).order_by())
+        add(received.annotate(period=period).values("period")
+            .annotate(transfers_in=Sum("amount")).order_by())
+
+    return [{"period": day, **totals} for day, totals in sorted(buckets.items())]
@@ -0,0 +1,78 @@
+import json
+import threading
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+from ..exceptions import RatesUnavailable
+from ..rates import RateProvider
+
+
+class FakeRateProvider(RateProvider):
+    """
+    Local rate provider for tests - serves a fixed table of rates
+    and counts the calls
+    """
+    rates = {
+        "RUB": Decimal("1"),
+        "USD": Decimal("0.0137"),
+        "EUR": Decimal("0.0118"),
+    }
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.calls = 0
+
+    def fetch_rates(self) -> Dict[str, Decimal]:
+        self.calls += 1
+        if self.fail:
+            raise RatesUnavailable
+        return dict(self.rates)
+
+
+class FakeRateServer:
+    """
+    Local HTTP server imitating exchangerate.host `latest` endpoint.
+    Can be made slow with `delay` seconds or failing with `fail`
+    """
+    def __init__(self, rates: Dict[str, Decimal] = None):
+        self.rates = rates or FakeRateProvider.rates
+        self.delay = 0
+        self.fail = False
+        self.requests = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                time.sleep(server.delay)
+                if server.fail:
+                    self.send_error(503)
+                    return
+                body = json.dumps({
+                    "base": "RUB",
+                    "rates": {code: float(rate) for code, rate in server.rates.items()}
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/latest"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
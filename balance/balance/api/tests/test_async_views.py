@@ -0,0 +1,81 @@
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+
+from django.test import AsyncClient, override_settings
+from django.utils import timezone
+
+from .test_base import BaseTest
+from ..models import Transaction
+
+
+@override_settings(ROOT_URLCONF="balance.asgi_urls")
+class TestAsyncViews(BaseTest):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        start = timezone.now() - timedelta(days=1)
+        first, second = cls.user_ids[:2]
+        Transaction.objects.bulk_create(
+            Transaction(amount=i + 1, source_id=first if i % 2 else second,
+                        target_id=second if i % 2 else first,
+                        comment=f"Transfer {i}", timestamp=start + timedelta(minutes=i))
+            for i in range(12)
+        )
+
+    def compare(self, url: str, status: int = 200, if_none_match: str = None) -> dict:
+        """
+        Asserts that the async view returns the same response as the sync one
+        """
+        headers = {} if if_none_match is None else {"If-None-Match": if_none_match}
+        with override_settings(ROOT_URLCONF="balance.urls"):
+            expected = self.client.get(url, **{
+                f"HTTP_{name.upper().replace('-', '_')}": value for name, value in headers.items()
+            })
+
+        async def get():
+            return await AsyncClient().get(url, **headers)
+
+        res = async_to_sync(get)()
+        self.assertEqual(res.status_code, status)
+        self.assertEqual(res.status_code, expected.status_code)
+        self.assertEqual(res.get("Content-Type"), expected.get("Content-Type"))
+        self.assertEqual(res.content, expected.content)
+        self.assertEqual(res.get("ETag"), expected.get("ETag"))
+        return res.json() if res.content else {}
+
+    def test_get_balance(self):
+        """
+        Has to return the same responses as the sync GetBalance
+        """
+        user_id = self.user_ids[0]
+        self.compare(f"/api/get-balance/{user_id}/")
+        self.compare(f"/api/get-balance/{user_id}/?as_of=2020-01-01")
+        self.compare(f"/api/get-balance/{user_id}/?as_of=yesterday", status=400)
+        self.compare("/api/get-balance/12345/", status=404)
+
+        data = self.compare(f"/api/get-balance/{user_id}/currency=USD/")["data"]
+        self.assertEqual(data["currency"], "USD")
+        self.compare(f"/api/get-balance/{user_id}/currency=BDSS/")
+
+    def test_get_transactions(self):
+        """
+        Has to return the same responses as the sync GetTransactions
+        """
+        user_id = self.user_ids[0]
+        data = self.compare(f"/api/get-transactions/{user_id}/?page=2&limit=5")["data"]
+        self.assertEqual(len(data["results"]), 5)
+        data = self.compare(f"/api/get-transactions/{user_id}/sort_by=amount/?pagination=cursor&limit=5")
+        self.compare(data["data"]["next"])
+        self.compare(f"/api/get-transactions/{user_id}/sort_by=name/", status=400)
+        self.compare("/api/get-transactions/12345/", status=404)
+
+    def test_not_modified(self):
+        """
+        Has to return the same 304 responses as the sync views
+        """
+        for url in (f"/api/get-balance/{self.user_ids[0]}/",
+                    f"/api/get-balance/{self.user_ids[0]}/currency=USD/",
+                    f"/api/get-transactions/{self.user_ids[0]}/?page=2&limit=5"):
+            etag = self.client.get(url)["ETag"]
+            self.compare(url, status=304, if_none_match=etag)
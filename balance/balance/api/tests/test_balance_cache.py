@@ -0,0 +1,136 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import caches
+from django.db import connection, connections, transaction
+from django.test import Client, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .test_base import TEST_CACHES
+from ..models import Balance
+from ..serializers import BalanceSerializer
+from .. import balance_cache
+
+
+@override_settings(CACHES=TEST_CACHES, DATABASE_REPLICAS=[],
+                   RATE_PROVIDER="balance.api.tests.fake_rates.FakeRateProvider")
+class TestBalanceCache(TransactionTestCase):
+    def setUp(self):
+        caches["balances"].clear()
+        balance_cache.cache_stats.reset()
+        Balance.objects.create(user_id=1, balance=100)
+        Balance.objects.create(user_id=2, balance=200)
+
+    def balance(self, user_id: int, client: Client = None) -> float:
+        res = (client or self.client).get(f"/api/get-balance/{user_id}/")
+        self.assertEqual(res.status_code, 200)
+        return res.json()["data"]["balance"]
+
+    def post(self, name: str, data, client: Client = None):
+        res = (client or self.client).post(reverse(name), data=json.dumps({"data": data}),
+                                           content_type="application/json")
+        self.assertEqual(res.status_code, 200)
+
+    def test_hits_and_misses(self):
+        """
+        Has to serve the second read from the cache without queries
+        and count the hits and the misses
+        """
+        first = self.client.get("/api/get-balance/1/")
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get("/api/get-balance/1/")
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(first.content, second.content)
+
+        res = self.client.get(reverse("cache-status"))
+        self.assertEqual(res.json()["data"]["balances"],
+                         {"hits": 1, "misses": 1, "hit_ratio": 0.5})
+
+    def test_writes_invalidate(self):
+        """
+        Has to read the balance changed by every kind of write from the DB
+        """
+        self.assertEqual((self.balance(1), self.balance(2)), (100, 200))
+
+        self.post("change-balance", {"user_id": 1, "amount": 10})
+        self.assertEqual((self.balance(1), self.balance(2)), (110, 200))
+
+        self.post("make-transfer", {"source_id": 1, "target_id": 2, "amount": 10})
+        self.assertEqual((self.balance(1), self.balance(2)), (100, 210))
+
+        self.post("make-transfers", {"transfers": [
+            {"source_id": 2, "target_id": 1, "amount": 5},
+        ]})
+        self.assertEqual((self.balance(1), self.balance(2)), (105, 205))
+
+        res = self.client.post(reverse("change-balances"), data="user_id,amount\n2,-5\n",
+                               content_type="text/csv")
+        self.assertEqual(res.json()["data"]["applied"], 1)
+        self.assertEqual((self.balance(1), self.balance(2)), (105, 200))
+
+    def test_no_invalidation_on_rollback(self):
+        """
+        Has to keep the cached balance if the write rolls back
+        """
+        self.balance(1)
+        with transaction.atomic():
+            balance_cache.invalidate([1])
+            transaction.set_rollback(True)
+        self.balance(1)
+        self.assertEqual(balance_cache.cache_stats.hits, 1)
+
+    def test_read_racing_write(self):
+        """
+        Has to never serve the balance read before a write
+        committed while the read was being cached
+        """
+        def load(using: str) -> dict:
+            data = BalanceSerializer(Balance.objects.using(using).get(user_id=1)).data
+            self.post("change-balance", {"user_id": 1, "amount": 10})
+            return data
+
+        self.assertEqual(balance_cache.cached_balance(1, load)["balance"], 100)
+        self.assertEqual(self.balance(1), 110)
+
+    def test_parallel_reads_never_stale(self):
+        """
+        Has to return a balance not older than the last write
+        committed before the read started
+        """
+        writes = 30
+        committed = 0
+        lock = threading.Lock()
+
+        def write():
+            nonlocal committed
+            client = Client()
+            try:
+                for _ in range(writes):
+                    self.post("change-balance", {"user_id": 1, "amount": 1}, client)
+                    with lock:
+                        committed += 1
+            finally:
+                connections.close_all()
+
+        def read() -> list:
+            client = Client()
+            stale = []
+            try:
+                while committed < writes:
+                    with lock:
+                        expected = 100 + committed
+                    balance = self.balance(1, client)
+                    if balance < expected:
+                        stale.append((balance, expected))
+            finally:
+                connections.close_all()
+            return stale
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            readers = [pool.submit(read) for _ in range(3)]
+            pool.submit(write).result()
+            self.assertEqual([reader.result() for reader in readers], [[], [], []])
+        self.assertEqual(self.balance(1), 100 + writes)
+        self.assertGreater(balance_cache.cache_stats.hits, 0)
@@ -1,10 +1,29 @@
-from django.test import TestCase
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from .. import rates
 from ..models import Balance
 
 
+TEST_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "rates": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+              "LOCATION": "rates"},
+    "replica_pins": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                     "LOCATION": "replica_pins"},
+    "balances": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                 "LOCATION": "balances"},
+}
+
+
+@override_settings(CACHES=TEST_CACHES,
+                   RATE_PROVIDER="balance.api.tests.fake_rates.FakeRateProvider")
 class BaseTest(TestCase):
     user_ids = []
 
+    def setUp(self):
+        caches["rates"].clear()
+        rates.reset()
+
     @classmethod
     def setUpTestData(cls):
         balance = Balance.objects.create(user_id=1, balance=100)
@@ -14,4 +33,4 @@ class BaseTest(TestCase):
         cls.user_ids.append(balance.user_id)
 
         balance = Balance.objects.create(user_id=3, balance=500)
-        cls.user_ids.append(balance.user_id)
\ No newline at end of file
+        cls.user_ids.append(balance.user_id)
@@ -0,0 +1,127 @@
+import json
+import tempfile
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command, CommandError
+from django.urls import reverse
+
+from .test_base import BaseTest
+from ..models import Balance, Transaction
+
+
+class TestChangeBalances(BaseTest):
+    def post_rows(self, body: str, content_type: str = "text/csv"):
+        return self.client.post(reverse("change-balances"),
+                                data=body,
+                                content_type=content_type)
+
+    def test_csv_ok(self):
+        """
+        Has to return 200 OK HTTP-response, change and create balances,
+        create a Transaction for every row
+        """
+        body = "user_id,amount\n" \
+               f"{self.user_ids[0]},50.50\n" \
+               f"{self.user_ids[1]},-1000\n" \
+               "777,300\n" \
+               f"{self.user_ids[0]},-150.50\n"
+        res = self.post_rows(body)
+        self.assertEqual(res.status_code, 200)
+        data = res.json()["data"]
+        self.assertEqual(data["rows"], 4)
+        self.assertEqual(data["applied"], 4)
+        self.assertEqual(data["rejected"], [])
+
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[0]).balance, 0)
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[1]).balance, 1000)
+        self.assertEqual(Balance.objects.get(user_id=777).balance, 300)
+        self.assertEqual(Transaction.objects.filter(comment="Deposit").count(), 2)
+        self.assertEqual(Transaction.objects.filter(comment="Withdrawal").count(), 2)
+
+    def test_ndjson_ok(self):
+        """
+        Has to return 200 OK HTTP-response and change the balance
+        """
+        body = "\n".join(json.dumps(row) for row in [
+            {"user_id": self.user_ids[2], "amount": 0.1},
+            {"user_id": self.user_ids[2], "amount": 0.2},
+        ])
+        res = self.post_rows(body, "application/x-ndjson")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[2]).balance, Decimal("500.30"))
+
+    def test_negative_rows_rejected(self):
+        """
+        Has to apply none of the rows of a user whose balance would
+        become negative at any row, report the user
+        """
+        body = f"{self.user_ids[0]},-200\n" \
+               f"{self.user_ids[0]},500\n" \
+               f"{self.user_ids[1]},100\n" \
+               "888,-5\n"
+        res = self.post_rows(body)
+        self.assertEqual(res.status_code, 200)
+        data = res.json()["data"]
+        self.assertEqual(data["applied"], 1)
+        self.assertEqual([row["user_id"] for row in data["rejected"]],
+                         [self.user_ids[0], 888])
+
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[0]).balance, 100)
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[1]).balance, 2100)
+        self.assertFalse(Balance.objects.filter(user_id=888).exists())
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_invalid_row(self):
+        """
+        Has to return 400 BAD REQUEST HTTP-response with the number of the row,
+        make no changes to the database
+        """
+        body = f"{self.user_ids[0]},50\n" \
+               f"{self.user_ids[0]},0.001\n"
+        res = self.post_rows(body)
+        self.assertEqual(res.status_code, 400)
+        self.assertIn("2", res.json()["errors"]["rows"])
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[0]).balance, 100)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_user_id_out_of_range(self):
+        """
+        Has to return 400 BAD REQUEST HTTP-response for a user_id
+        not fitting into Balance.user_id, make no changes to the database
+        """
+        body = f"{self.user_ids[0]},50\n" \
+               "2147483648,10\n"
+        res = self.post_rows(body)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.json()["errors"]["rows"],
+                         {"2": ["user_id can't be greater than 2147483647"]})
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[0]).balance, 100)
+
+    def test_import_command(self):
+        """
+        Has to apply the rows from the file and report the throughput
+        """
+        with tempfile.NamedTemporaryFile("w", suffix=".ndjson") as file:
+            file.write(json.dumps({"user_id": self.user_ids[1], "amount": -500}) + "\n")
+            file.write(json.dumps({"user_id": 999, "amount": 10}) + "\n")
+            file.flush()
+            out = StringIO()
+            call_command("import_balance_changes", file.name, stdout=out)
+
+        result = json.loads(out.getvalue())
+        self.assertEqual(result["rows"], 2)
+        self.assertEqual(result["applied"], 2)
+        self.assertIn("rows_per_second", result)
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[1]).balance, 1500)
+        self.assertEqual(Balance.objects.get(user_id=999).balance, 10)
+
+    def test_import_command_invalid_row(self):
+        """
+        Has to fail with the number of the invalid row
+        """
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as file:
+            file.write("1,10\nabc,10\n")
+            file.flush()
+            with self.assertRaisesMessage(CommandError, "Row 2"):
+                call_command("import_balance_changes", file.name, stdout=StringIO())
@@ -0,0 +1,168 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.db import connections
+from django.test import Client, TransactionTestCase
+from django.urls import reverse
+
+from ..models import Balance, Transaction
+
+
+class TestChangeBalanceConcurrency(TransactionTestCase):
+    workers = 16
+
+    def setUp(self):
+        Balance.objects.create(user_id=1, balance=1000)
+
+    @staticmethod
+    def change_balance(user_id: int, amount: int) -> int:
+        """
+        Posts a change-balance request from a separate thread,
+        returns the HTTP-status of the response
+        """
+        payload = json.dumps({
+            "data": {
+                "user_id": user_id,
+                "amount": amount
+            }
+        })
+        try:
+            res = Client().post(reverse("change-balance"),
+                                data=payload,
+                                content_type="application/json")
+            return res.status_code
+        finally:
+            connections.close_all()
+
+    def run_parallel(self, user_id: int, amounts: list) -> list:
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(lambda amount: self.change_balance(user_id, amount),
+                                 amounts))
+
+    def test_parallel_deposits_and_withdrawals(self):
+        """
+        Has to apply every operation exactly once
+        """
+        amounts = [10, -5] * 100
+        statuses = self.run_parallel(1, amounts)
+        self.assertEqual(statuses, [200] * len(amounts))
+
+        balance = Balance.objects.get(user_id=1)
+        self.assertEqual(balance.balance, Decimal(1000 + sum(amounts)))
+        self.assertEqual(Transaction.objects.filter(source_id=1).count(), len(amounts))
+
+    def test_parallel_withdrawals_never_overdraft(self):
+        """
+        Has to let through only the withdrawals covered by the balance
+        """
+        amounts = [-30] * 50
+        statuses = self.run_parallel(1, amounts)
+        self.assertEqual(statuses.count(200), 33)
+        self.assertEqual(statuses.count(400), 17)
+
+        balance = Balance.objects.get(user_id=1)
+        self.assertEqual(balance.balance, Decimal(10))
+        self.assertEqual(Transaction.objects.filter(source_id=1).count(), 33)
+
+    def test_parallel_first_deposits(self):
+        """
+        Has to create the balance once and apply every deposit
+        """
+        amounts = [15] * 40
+        statuses = self.run_parallel(2, amounts)
+        self.assertEqual(statuses.count(201), 1)
+        self.assertEqual(statuses.count(200), len(amounts) - 1)
+
+        balance = Balance.objects.get(user_id=2)
+        self.assertEqual(balance.balance, Decimal(sum(amounts)))
+
+
+class TestMakeTransferConcurrency(TransactionTestCase):
+    workers = 16
+
+    def setUp(self):
+        Balance.objects.create(user_id=1, balance=1000)
+        Balance.objects.create(user_id=2, balance=1000)
+
+    @staticmethod
+    def make_transfer(source_id: int, target_id: int, amount: int) -> int:
+        """
+        Posts a make-transfer request from a separate thread,
+        returns the HTTP-status of the response
+        """
+        payload = json.dumps({
+            "data": {
+                "source_id": source_id,
+                "target_id": target_id,
+                "amount": amount
+            }
+        })
+        try:
+            res = Client().post(reverse("make-transfer"),
+                                data=payload,
+                                content_type="application/json")
+            return res.status_code
+        finally:
+            connections.close_all()
+
+    def test_opposite_transfers_do_not_deadlock(self):
+        """
+        Has to apply A->B and B->A transfers running at once
+        without losing money
+        """
+        transfers = [(1, 2, 10), (2, 1, 7)] * 100
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            statuses = list(pool.map(lambda args: self.make_transfer(*args), transfers))
+        self.assertEqual(statuses, [200] * len(transfers))
+
+        self.assertEqual(Balance.objects.get(user_id=1).balance, Decimal(1000 - 300))
+        self.assertEqual(Balance.objects.get(user_id=2).balance, Decimal(1000 + 300))
+        self.assertEqual(Transaction.objects.filter(comment="Transfer").count(), len(transfers))
+
+    def test_parallel_transfers_never_overdraft(self):
+        """
+        Has to let through only the transfers covered by the source balance
+        """
+        transfers = [(1, 2, 300)] * 10
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            statuses = list(pool.map(lambda args: self.make_transfer(*args), transfers))
+        self.assertEqual(statuses.count(200), 3)
+        self.assertEqual(statuses.count(400), 7)
+
+        self.assertEqual(Balance.objects.get(user_id=1).balance, Decimal(100))
+        self.assertEqual(Balance.objects.get(user_id=2).balance, Decimal(1900))
+
+
+class TestIdempotentTransferConcurrency(TransactionTestCase):
+    workers = 8
+
+    def setUp(self):
+        Balance.objects.create(user_id=1, balance=1000)
+        Balance.objects.create(user_id=2, balance=1000)
+
+    @staticmethod
+    def make_transfer(key: str) -> dict:
+        """
+        Posts the same make-transfer request with the idempotency key
+        from a separate thread, returns the JSON of the response
+        """
+        payload = json.dumps({"data": {"source_id": 1, "target_id": 2, "amount": 10}})
+        try:
+            res = Client().post(reverse("make-transfer"), data=payload,
+                                content_type="application/json",
+                                HTTP_IDEMPOTENCY_KEY=key)
+            return res.json()
+        finally:
+            connections.close_all()
+
+    def test_parallel_duplicates_transfer_once(self):
+        """
+        Has to make the transfer once and return its response to every duplicate
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            responses = list(pool.map(self.make_transfer, ["key"] * 40))
+        self.assertEqual(len({json.dumps(res, sort_keys=True) for res in responses}), 1)
+
+        self.assertEqual(Balance.objects.get(user_id=1).balance, Decimal(990))
+        self.assertEqual(Transaction.objects.filter(comment="Transfer").count(), 1)
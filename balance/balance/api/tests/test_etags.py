@@ -0,0 +1,98 @@
+import json
+
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .test_base import BaseTest
+from ..rates import RATES_CACHE_KEY
+from .fake_rates import FakeRateProvider
+
+
+class TestETags(BaseTest):
+    def post(self, name: str, data: dict):
+        res = self.client.post(reverse(name), data=json.dumps({"data": data}),
+                               content_type="application/json")
+        self.assertEqual(res.status_code, 200)
+
+    def assert_not_modified(self, url: str, etag: str, if_none_match: str = None,
+                            queries: int = None):
+        with CaptureQueriesContext(connection) as captured:
+            res = self.client.get(url, HTTP_IF_NONE_MATCH=if_none_match or etag)
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.content, b"")
+        self.assertEqual(res["ETag"], etag)
+        if queries is not None:
+            self.assertEqual(len(captured), queries)
+
+    def test_get_balance(self):
+        """
+        Has to return 304 for the ETag of the current balance
+        and a new ETag after the balance changes
+        """
+        url = f"/api/get-balance/{self.user_ids[0]}/"
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        etag = res["ETag"]
+        self.assertTrue(etag.startswith('"') and etag.endswith('"'))
+        self.assert_not_modified(url, etag)
+        self.assert_not_modified(url, etag, f'"other", W/{etag}')
+        self.assert_not_modified(url, etag, "*")
+
+        self.post("change-balance", {"user_id": self.user_ids[0], "amount": 10})
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res["ETag"], etag)
+        self.assertEqual(res.json()["data"]["balance"], 110)
+
+    def test_get_balance_as_of(self):
+        """
+        Has to return 304 for the balance as of a moment
+        without reading the transactions
+        """
+        url = f"/api/get-balance/{self.user_ids[0]}/?as_of=2020-01-01"
+        etag = self.client.get(url)["ETag"]
+        self.assertNotEqual(etag, self.client.get(f"/api/get-balance/{self.user_ids[0]}/")["ETag"])
+        self.assert_not_modified(url, etag, queries=1)
+
+    def test_get_balance_currency(self):
+        """
+        Has to change the ETag of a converted balance with the rate
+        """
+        url = f"/api/get-balance/{self.user_ids[0]}/currency=USD/"
+        etag = self.client.get(url)["ETag"]
+        self.assertNotEqual(etag, self.client.get(f"/api/get-balance/{self.user_ids[0]}/")["ETag"])
+        self.assert_not_modified(url, etag)
+
+        caches["rates"].set(RATES_CACHE_KEY, {**FakeRateProvider.rates, "USD": 1})
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()["data"]["balance"], 100)
+
+    def test_get_transactions(self):
+        """
+        Has to return 304 without reading the transactions
+        and a new ETag after a transaction of the user
+        """
+        first, second = self.user_ids[:2]
+        self.post("make-transfer", {"source_id": second, "target_id": first, "amount": 5})
+        url = f"/api/get-transactions/{first}/"
+        res = self.client.get(url)
+        etag, count = res["ETag"], res.json()["data"]["count"]
+        self.assertNotEqual(etag, self.client.get(f"{url}?page=1&limit=1")["ETag"])
+        self.assertNotEqual(etag, self.client.get(f"/api/get-transactions/{first}/sort_by=amount/")["ETag"])
+        self.assert_not_modified(url, etag, queries=1)
+
+        self.post("make-transfer", {"source_id": second, "target_id": first, "amount": 5})
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()["data"]["count"], count + 1)
+
+    def test_no_etag_on_errors(self):
+        """
+        Has to return the errors without ETags
+        """
+        self.assertNotIn("ETag", self.client.get("/api/get-balance/12345/"))
+        self.assertNotIn("ETag", self.client.get("/api/get-transactions/12345/"))
+        self.assertNotIn("ETag", self.client.get(f"/api/get-transactions/{self.user_ids[0]}/sort_by=name/"))
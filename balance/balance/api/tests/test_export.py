@@ -0,0 +1,137 @@
+import csv
+import io
+import json
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from balance.handlers import ASGIHandler
+
+from .test_base import BaseTest, TEST_CACHES
+from .. import export
+from ..models import Balance, Transaction
+
+
+class TestExportTransactions(BaseTest):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        start = timezone.now()
+        first, second = cls.user_ids[:2]
+        # Sent and received rows alternate in time
+        Transaction.objects.bulk_create(
+            Transaction(amount=i + 1, source_id=first if i % 2 else second,
+                        target_id=second if i % 2 else first,
+                        comment=f"Transfer {i}", timestamp=start + timedelta(seconds=i))
+            for i in range(10)
+        )
+
+    def download(self, url: str) -> str:
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.streaming)
+        return b"".join(res.streaming_content).decode()
+
+    @mock.patch.object(export, "CHUNK_SIZE", 3)
+    def test_ndjson(self):
+        """
+        Has to stream every row of both directions, oldest first
+        """
+        content = self.download(f"/api/export-transactions/{self.user_ids[0]}/")
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row["comment"] for row in rows],
+                         [f"Transfer {i}" for i in range(10)])
+        self.assertEqual([row["direction"] for row in rows[:2]], ["in", "out"])
+        self.assertEqual(rows[0]["amount"], 1)
+
+    @mock.patch.object(export, "CHUNK_SIZE", 4)
+    def test_csv(self):
+        """
+        Has to stream the header and every row as CSV
+        """
+        content = self.download(f"/api/export-transactions/{self.user_ids[0]}/format=csv/")
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(rows[-1]["comment"], "Transfer 9")
+        self.assertEqual(rows[-1]["amount"], "10.00")
+
+    def test_same_as_get_transactions(self):
+        """
+        Has to export the timestamps as get-transactions returns them
+        """
+        user_id = self.user_ids[0]
+        res = self.client.get(f"/api/get-transactions/{user_id}/")
+        listed = {row["comment"]: row for row in res.json()["data"]["results"]}
+        self.assertTrue(listed)
+
+        ndjson = self.download(f"/api/export-transactions/{user_id}/")
+        csv_content = self.download(f"/api/export-transactions/{user_id}/format=csv/")
+        for rows in ([json.loads(line) for line in ndjson.splitlines()],
+                     list(csv.DictReader(io.StringIO(csv_content)))):
+            for row in rows:
+                if row["comment"] in listed:
+                    self.assertEqual(row["timestamp"], listed[row["comment"]]["timestamp"])
+
+    def test_no_such_user(self):
+        """
+        Has to return 404 NOT FOUND HTTP-response
+        """
+        res = self.client.get("/api/export-transactions/123445/")
+        self.assertEqual(res.status_code, 404)
+
+    def test_invalid_format(self):
+        """
+        Has to return 400 BAD REQUEST HTTP-response
+        """
+        res = self.client.get(f"/api/export-transactions/{self.user_ids[0]}/format=xml/")
+        self.assertEqual(res.status_code, 400)
+
+
+@override_settings(CACHES=TEST_CACHES, DATABASE_REPLICAS=[], ROOT_URLCONF="balance.asgi_urls")
+class TestExportUnderASGI(TransactionTestCase):
+    def request(self, path: str) -> list:
+        """
+        Sends the GET request through the ASGI handler
+        :return: list of the ASGI messages sent back
+        """
+        messages = []
+        scope = {"type": "http", "method": "GET", "path": path, "query_string": b"",
+                 "headers": [], "server": ("testserver", 80)}
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        async_to_sync(ASGIHandler().__call__)(scope, receive, send)
+        return messages
+
+    @mock.patch.object(export, "CHUNK_SIZE", 3)
+    def test_streams(self):
+        """
+        Has to stream the rows read from the DB chunk by chunk
+        """
+        Balance.objects.create(user_id=1, balance=55)
+        Transaction.objects.bulk_create(
+            Transaction(amount=i + 1, source_id=1, target_id=1, comment="Deposit")
+            for i in range(10)
+        )
+        start, *body = self.request("/api/export-transactions/1/format=csv/")
+        self.assertEqual(start["status"], 200)
+        self.assertIn((b"Content-Type", b"text/csv"), start["headers"])
+        self.assertEqual(len(body), 5)
+        self.assertFalse(body[-1].get("more_body", False))
+        rows = list(csv.DictReader(io.StringIO(
+            b"".join(message.get("body", b"") for message in body).decode()
+        )))
+        self.assertEqual([row["amount"] for row in rows], [f"{i + 1}.00" for i in range(10)])
+
+        start, body = self.request("/api/export-transactions/2/")
+        self.assertEqual(start["status"], 404)
+        self.assertEqual(json.loads(body["body"])["errors"]["user_id"],
+                         ["No user with such ID found"])
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.utils import timezone
+
+from rest_framework.renderers import JSONRenderer
+
+from .test_base import BaseTest
+from ..models import Balance, Transaction
+from ..serializers import BalanceSerializer, StatementTransactionSerializer, ValuesSerializer
+from ..statement import AccountStatement
+
+
+class TestValuesSerializer(BaseTest):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        first, second = cls.user_ids[:2]
+        start = datetime(2021, 3, 28, 0, 0, 0, tzinfo=dt_timezone.utc)
+        amounts = [Decimal("0.01"), Decimal("9999999.99"), Decimal("10"), Decimal("123.45")]
+        Transaction.objects.bulk_create(
+            Transaction(amount=amounts[i % len(amounts)],
+                        source_id=first if i % 3 else second,
+                        target_id=second if i % 3 == 1 else first,
+                        comment=f"Перевод {i}",
+                        timestamp=start + timedelta(hours=i, microseconds=i * 1001))
+            for i in range(30)
+        )
+
+    def assert_same(self, serializer_class, instances, rows):
+        expected = JSONRenderer().render(serializer_class(instances, many=True).data)
+        fast = ValuesSerializer(serializer_class).many(rows)
+        self.assertEqual(JSONRenderer().render(fast), expected)
+
+    def test_balance(self):
+        """
+        Has to return the same data as BalanceSerializer
+        """
+        fast = ValuesSerializer(BalanceSerializer)
+        queryset = Balance.objects.order_by("user_id")
+        self.assert_same(BalanceSerializer, queryset, queryset.values_list(*fast.sources))
+
+    def test_statement(self):
+        """
+        Has to return the same data as StatementTransactionSerializer
+        in both orderings and time zones
+        """
+        fast = ValuesSerializer(StatementTransactionSerializer)
+        for ordering in (["-timestamp", "-id"], ["amount", "id"]):
+            statement = AccountStatement(self.user_ids[0], ordering)
+            for zone in ("Europe/Moscow", "UTC"):
+                with timezone.override(zone):
+                    self.assert_same(StatementTransactionSerializer, statement[:],
+                                     statement.values_list(*fast.sources)[:])
+
+    def test_endpoint(self):
+        """
+        Has to return the pages of get-transactions as of the DRF serializer
+        """
+        user_id = self.user_ids[0]
+        statement = AccountStatement(user_id, ["-timestamp", "-id"])
+        expected = StatementTransactionSerializer(statement[10:20], many=True).data
+        res = self.client.get(f"/api/get-transactions/{user_id}/?page=2")
+        self.assertEqual(JSONRenderer().render(res.json()["data"]["results"]),
+                         JSONRenderer().render(expected))
+
+        res = self.client.get(f"/api/get-transactions/{user_id}/?pagination=cursor")
+        next_page = self.client.get(res.json()["data"]["next"]).json()["data"]["results"]
+        self.assertEqual(JSONRenderer().render(next_page), JSONRenderer().render(expected))
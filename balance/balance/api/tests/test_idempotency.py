@@ -0,0 +1,96 @@
+import json
+from datetime import timedelta
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .test_base import BaseTest
+from ..idempotency import REPLAYED_HEADER, purge
+from ..models import Balance, IdempotencyKey, Transaction
+
+
+class TestIdempotencyKeys(BaseTest):
+    def post(self, name: str, data: dict, key: str):
+        return self.client.post(reverse(name), data=json.dumps({"data": data}),
+                                content_type="application/json",
+                                HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_change_balance_retry(self):
+        """
+        Has to change the balance once and return the stored response
+        to the retry with one query
+        """
+        data = {"user_id": self.user_ids[0], "amount": 50}
+        first = self.post("change-balance", data, "deposit-1")
+        self.assertEqual(first.status_code, 200)
+        self.assertNotIn(REPLAYED_HEADER, first)
+
+        with CaptureQueriesContext(connection) as context:
+            retry = self.post("change-balance", data, "deposit-1")
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry[REPLAYED_HEADER], "true")
+        self.assertEqual(retry.json(), first.json())
+
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[0]).balance, 150)
+        self.assertEqual(Transaction.objects.filter(source_id=self.user_ids[0]).count(), 1)
+
+    def test_make_transfer_retry(self):
+        """
+        Has to make the transfer once, also storing the error responses
+        """
+        data = {"source_id": self.user_ids[0], "target_id": self.user_ids[1], "amount": 60}
+        self.assertEqual(self.post("make-transfer", data, "transfer-1").status_code, 200)
+        self.assertEqual(self.post("make-transfer", data, "transfer-1").status_code, 200)
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[0]).balance, 40)
+
+        overdraft = self.post("make-transfer", data, "transfer-2")
+        self.assertEqual(overdraft.status_code, 400)
+        Balance.objects.filter(user_id=self.user_ids[0]).update(balance=1000)
+        retry = self.post("make-transfer", data, "transfer-2")
+        self.assertEqual(retry.status_code, 400)
+        self.assertEqual(retry.json(), overdraft.json())
+
+    def test_key_per_resource(self):
+        """
+        Has to keep the keys of different endpoints apart
+        """
+        self.post("change-balance", {"user_id": self.user_ids[0], "amount": 10}, "same")
+        data = {"source_id": self.user_ids[0], "target_id": self.user_ids[1], "amount": 10}
+        self.assertEqual(self.post("make-transfer", data, "same").status_code, 200)
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[0]).balance, 100)
+
+    def test_another_request(self):
+        """
+        Has to return 422 UNPROCESSABLE ENTITY HTTP-response
+        """
+        self.post("change-balance", {"user_id": self.user_ids[0], "amount": 10}, "key")
+        res = self.post("change-balance", {"user_id": self.user_ids[0], "amount": 20}, "key")
+        self.assertEqual(res.status_code, 422)
+        self.assertIn("idempotency_key", res.json()["errors"])
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[0]).balance, 110)
+
+    def test_invalid_key(self):
+        """
+        Has to return 400 BAD REQUEST HTTP-response
+        """
+        res = self.post("change-balance", {"user_id": self.user_ids[0], "amount": 10}, "k" * 256)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(IdempotencyKey.objects.count(), 0)
+
+    def test_expired_key(self):
+        """
+        Has to handle the request again after the key expires,
+        purging deletes only the expired keys
+        """
+        data = {"user_id": self.user_ids[0], "amount": 10}
+        self.post("change-balance", data, "expiring")
+        self.post("change-balance", data, "kept")
+        IdempotencyKey.objects.filter(key="expiring").update(expires=timezone.now())
+        self.assertEqual(self.post("change-balance", data, "expiring").status_code, 200)
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[0]).balance, 130)
+
+        self.assertEqual(purge(timezone.now() + timedelta(minutes=1)), 0)
+        self.assertEqual(purge(timezone.now() + timedelta(days=2)), 2)
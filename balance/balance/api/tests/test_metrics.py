@@ -0,0 +1,261 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from asgiref.sync import SyncToAsync, async_to_sync
+
+from django.db import connections, transaction
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from balance import metrics
+
+from .fake_rates import FakeRateServer
+from .test_base import BaseTest, TEST_CACHES
+from ..models import Balance
+
+
+class MetricsTestMixin:
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.metrics_dir = directory.name
+        settings_override = override_settings(METRICS_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        metrics.REGISTRY.reset()
+
+    def value(self, metric: metrics.Metric, labels: tuple):
+        return metric.values.get(labels)
+
+
+class TestMetrics(MetricsTestMixin, BaseTest):
+    def test_requests(self):
+        """
+        Has to count and time the requests and their DB queries by resource
+        """
+        user_id = self.user_ids[0]
+        for _ in range(2):
+            self.client.get(f"/api/get-balance/{user_id}/")
+        self.client.get("/api/get-balance/12345/")
+        self.client.get("/api/nowhere/")
+
+        self.assertEqual(self.value(metrics.HTTP_REQUESTS, ("get_balance", "GET", "200")), 2)
+        self.assertEqual(self.value(metrics.HTTP_REQUESTS, ("get_balance", "GET", "404")), 1)
+        self.assertEqual(self.value(metrics.HTTP_REQUESTS, ("other", "GET", "404")), 1)
+        durations = self.value(metrics.HTTP_REQUEST_SECONDS, ("get_balance",))
+        self.assertEqual(sum(durations[:-1]), 3)
+        self.assertGreater(durations[-1], 0)
+        queries = self.value(metrics.DB_QUERIES_PER_REQUEST, ("get_balance",))
+        self.assertEqual(sum(queries[:-1]), 3)
+        self.assertGreaterEqual(queries[-1], 3)
+        self.assertGreater(sum(self.value(metrics.DB_QUERY_SECONDS, ("get_balance",))[:-1]), 0)
+
+    @override_settings(ROOT_URLCONF="balance.asgi_urls")
+    def test_async_views(self):
+        """
+        Has to label the requests of the async views
+        and their DB queries run in threads
+        """
+        async def get():
+            return await AsyncClient().get(f"/api/get-transactions/{self.user_ids[0]}/")
+
+        self.assertEqual(async_to_sync(get)().status_code, 200)
+        self.assertEqual(self.value(metrics.HTTP_REQUESTS, ("get_transactions", "GET", "200")), 1)
+        queries = self.value(metrics.DB_QUERIES_PER_REQUEST, ("get_transactions",))
+        self.assertGreaterEqual(queries[-1], 2)
+
+    def test_locking_queries(self):
+        """
+        Has to time the queries taking the locks of the balances
+        """
+        res = self.client.post(reverse("make-transfer"), data=json.dumps({"data": {
+            "source_id": self.user_ids[1], "target_id": self.user_ids[0], "amount": 10
+        }}), content_type="application/json")
+        self.assertEqual(res.status_code, 200)
+        self.assertGreater(sum(self.value(metrics.DB_LOCKING_SECONDS, ("make-transfer",))[:-1]), 0)
+
+    def test_rates(self):
+        """
+        Has to count the lookups of the rates and time the calls to the provider
+        """
+        for _ in range(2):
+            self.client.get(f"/api/get-balance/{self.user_ids[0]}/currency=USD/")
+        self.assertEqual(self.value(metrics.RATES_LOOKUPS, ("fetched",)), 1)
+        self.assertEqual(self.value(metrics.RATES_LOOKUPS, ("cache",)), 1)
+        self.assertEqual(sum(self.value(metrics.RATES_FETCH_SECONDS, ("ok",))[:-1]), 1)
+
+    def test_endpoint(self):
+        """
+        Has to render the metrics in the Prometheus text format
+        """
+        self.client.get(f"/api/get-balance/{self.user_ids[0]}/")
+        res = self.client.get("/metrics")
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res["Content-Type"].startswith("text/plain; version=0.0.4"))
+        text = res.content.decode()
+        self.assertIn("# TYPE balance_http_requests_total counter\n", text)
+        self.assertIn('balance_http_requests_total{resource="get_balance",method="GET",'
+                      'status="200"} 1\n', text)
+        self.assertIn('balance_http_request_duration_seconds_bucket{resource="get_balance",'
+                      'le="+Inf"} 1\n', text)
+        self.assertIn('balance_http_request_duration_seconds_count{resource="get_balance"} 1\n',
+                      text)
+
+    def test_aggregates_workers(self):
+        """
+        Has to sum the metrics of all the workers and keep those
+        of the workers gone in the archive
+        """
+        self.client.get(f"/api/get-balance/{self.user_ids[0]}/")
+        worker = {"balance_http_requests_total": [[["get_balance", "GET", "200"], 3]]}
+        gone = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                              capture_output=True, text=True).stdout.strip()
+        workers_dir = os.path.join(self.metrics_dir, "workers")
+        os.makedirs(workers_dir)
+        # The parent process of the tests is alive
+        for pid, name in ((os.getppid(), "1"), (gone, "2")):
+            with open(os.path.join(workers_dir, f"{pid}-{name}.json"), "w") as file:
+                json.dump(worker, file)
+
+        for _ in range(2):
+            merged = metrics.collect()
+            self.assertEqual(merged["balance_http_requests_total"][("get_balance", "GET", "200")],
+                             7)
+        self.assertEqual(len(os.listdir(workers_dir)), 2)
+        self.assertTrue(os.path.exists(os.path.join(self.metrics_dir, "archive.json")))
+
+    def test_concurrent_flushes(self):
+        """
+        Has to flush from the flusher and /metrics at once without errors,
+        the counters never going back
+        """
+        labels = ("get_balance", "GET", "200")
+        errors = []
+
+        def flush_many():
+            try:
+                for _ in range(300):
+                    metrics.HTTP_REQUESTS.inc(labels)
+                    metrics.flush()
+            except Exception as e:
+                errors.append(e)
+
+        def collect_many():
+            seen = 0
+            try:
+                for _ in range(300):
+                    count = metrics.collect()["balance_http_requests_total"][labels]
+                    self.assertGreaterEqual(count, seen)
+                    seen = count
+            except Exception as e:
+                errors.append(e)
+
+        metrics.HTTP_REQUESTS.inc(labels)
+        threads = [threading.Thread(target=target)
+                   for target in (flush_many, flush_many, collect_many, collect_many)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(metrics.collect()["balance_http_requests_total"][labels], 601)
+        self.assertEqual(os.listdir(os.path.join(self.metrics_dir, "workers")),
+                         [metrics.worker_file()])
+
+    @override_settings(METRICS_FLUSH_INTERVAL=0.05)
+    def test_forked_worker(self):
+        """
+        Has to start the flusher in every worker forked after the app
+        was loaded and write the snapshot of the worker
+        """
+        middleware = metrics.MetricsMiddleware(lambda request: HttpResponse())
+        request = RequestFactory().get("/api/")
+        middleware(request)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                middleware(request)
+                time.sleep(0.3)
+                os._exit(0 if metrics.worker_file().startswith(f"{os.getpid()}-") else 1)
+            finally:
+                os._exit(1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        snapshots = os.listdir(os.path.join(self.metrics_dir, "workers"))
+        self.assertIn(pid, [int(name.split("-")[0]) for name in snapshots])
+
+    def test_escapes_labels(self):
+        """
+        Has to escape the quotes, backslashes and new lines of label values
+        """
+        self.assertEqual(metrics.format_labels(("a",), ('x"\\\n',)), '{a="x\\"\\\\\\n"}')
+
+    @override_settings(METRICS=False)
+    def test_disabled(self):
+        """
+        Has to record no requests if the metrics are off
+        """
+        self.client.get(f"/api/get-balance/{self.user_ids[0]}/")
+        self.assertEqual(metrics.HTTP_REQUESTS.values, {})
+
+
+@override_settings(CACHES=TEST_CACHES, DATABASE_REPLICAS=[],
+                   RATE_PROVIDER="balance.api.tests.fake_rates.FakeRateProvider")
+class TestTransactionMetrics(MetricsTestMixin, TransactionTestCase):
+    def test_transactions(self):
+        """
+        Has to time the committed and the rolled back transactions
+        """
+        Balance.objects.create(user_id=1, balance=100)
+        for amount in (10, -1000):
+            self.client.post(reverse("change-balance"),
+                             data=json.dumps({"data": {"user_id": 1, "amount": amount}}),
+                             content_type="application/json")
+        committed = self.value(metrics.DB_TRANSACTION_SECONDS, ("change_balance", "commit"))
+        self.assertEqual(sum(committed[:-1]), 2)
+
+        with self.assertRaises(ValueError), transaction.atomic():
+            Balance.objects.update(balance=0)
+            raise ValueError
+        rolled_back = self.value(metrics.DB_TRANSACTION_SECONDS, ("other", "rollback"))
+        self.assertEqual(sum(rolled_back[:-1]), 1)
+
+    @override_settings(ROOT_URLCONF="balance.asgi_urls", RATES_CACHE_TTL=0,
+                       RATE_PROVIDER="balance.api.rates.ExchangeRateHostProvider",
+                       RATES_BREAKER={"budget": 5, "failure_threshold": 3, "reset_timeout": 30})
+    def test_async_concurrency(self):
+        """
+        Has to serve the async views concurrently under ASGI, the requests
+        waiting for the slow rate provider together
+        """
+        Balance.objects.create(user_id=1, balance=100)
+        delay, requests = 0.5, 5
+
+        async def get_many():
+            client = AsyncClient()
+            return await asyncio.gather(*(
+                client.get("/api/get-balance/1/currency=USD/") for _ in range(requests)
+            ))
+
+        with FakeRateServer() as server, \
+                override_settings(RATE_PROVIDER_OPTIONS={"url": server.url}):
+            server.delay = delay
+            start = time.perf_counter()
+            responses = async_to_sync(get_many)()
+            seconds = time.perf_counter() - start
+        # The concurrent DB work ran in the thread of sync_to_async
+        SyncToAsync.single_thread_executor.submit(connections.close_all).result()
+
+        self.assertEqual([res.status_code for res in responses], [200] * requests)
+        # One after another they would take `requests` delays
+        self.assertLess(seconds, 2 * delay)
+        self.assertEqual(self.value(metrics.HTTP_REQUESTS, ("get_balance", "GET", "200")),
+                         requests)
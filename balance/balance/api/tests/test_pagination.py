@@ -0,0 +1,123 @@
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .test_base import BaseTest
+from ..models import Transaction
+
+
+class TestKeysetPagination(BaseTest):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        start = timezone.now()
+        # Pairs of rows share timestamps and amounts to check the tie-breaker,
+        # the rows are told apart by the comment
+        Transaction.objects.bulk_create(
+            Transaction(amount=i // 2 * 10, source_id=cls.user_ids[1], target_id=cls.user_ids[0],
+                        comment=f"Transfer {i}", timestamp=start + timedelta(seconds=i // 2))
+            for i in range(25)
+        )
+        # Received rows interleave with the sent ones
+        Transaction.objects.bulk_create(
+            Transaction(amount=i * 10 + 5, source_id=cls.user_ids[2], target_id=cls.user_ids[1],
+                        comment=f"Incoming {i}", timestamp=start + timedelta(seconds=i, milliseconds=500))
+            for i in range(7)
+        )
+
+    def get_path(self, url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.path}?{parts.query}"
+
+    def walk(self, url: str, link: str = "next") -> list:
+        """
+        Follows the links from the url, returns the comments of all the rows
+        """
+        rows, pages = [], []
+        while url is not None:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, 200)
+            data = res.json()["data"]
+            pages.append([row["comment"] for row in data["results"]])
+            url = data[link] and self.get_path(data[link])
+        if link == "previous":
+            pages.reverse()
+        for page in pages:
+            rows.extend(page)
+        return rows
+
+    def expected_rows(self, *ordering) -> list:
+        user_id = self.user_ids[1]
+        return list(Transaction.objects.filter(Q(source_id=user_id) | Q(target_id=user_id))
+                    .order_by(*ordering).values_list("comment", flat=True))
+
+    def test_walk_by_date(self):
+        """
+        Has to return every row once, newest first
+        """
+        url = f"/api/get-transactions/{self.user_ids[1]}/?pagination=cursor&limit=4"
+        self.assertEqual(self.walk(url), self.expected_rows("-timestamp", "-id"))
+
+    def test_walk_by_amount(self):
+        """
+        Has to return every row once, in the order of amount
+        """
+        url = f"/api/get-transactions/{self.user_ids[1]}/sort_by=amount/?pagination=cursor&limit=3"
+        self.assertEqual(self.walk(url), self.expected_rows("amount", "id"))
+
+    def test_walk_back(self):
+        """
+        Has to return the same rows following the previous links from the last page
+        """
+        url = f"/api/get-transactions/{self.user_ids[1]}/sort_by=amount/?pagination=cursor&limit=4"
+        while True:
+            data = self.client.get(url).json()["data"]
+            if data["next"] is None:
+                break
+            url = self.get_path(data["next"])
+        self.assertEqual(self.walk(url, "previous"), self.expected_rows("amount", "id"))
+
+    def test_inserted_rows_do_not_shift_pages(self):
+        """
+        Has to continue after the last seen row when new rows are inserted
+        """
+        url = f"/api/get-transactions/{self.user_ids[1]}/?pagination=cursor&limit=5"
+        data = self.client.get(url).json()["data"]
+        first_page = [row["comment"] for row in data["results"]]
+
+        Transaction.objects.create(amount=1, source_id=self.user_ids[1],
+                                   target_id=self.user_ids[0], comment="Transfer new",
+                                   timestamp=timezone.now() + timedelta(hours=1))
+        rest = self.walk(self.get_path(data["next"]))
+        self.assertEqual(first_page + rest, self.expected_rows("-timestamp", "-id")[1:])
+
+    def test_count_optional(self):
+        """
+        Has to count the rows only when asked
+        """
+        url = f"/api/get-transactions/{self.user_ids[1]}/?pagination=cursor"
+        self.assertNotIn("count", self.client.get(url).json()["data"])
+        data = self.client.get(url + "&count=true").json()["data"]
+        self.assertEqual(data["count"], 32)
+
+    def test_invalid_cursor(self):
+        """
+        Has to return 400 BAD REQUEST HTTP-response
+        """
+        url = f"/api/get-transactions/{self.user_ids[1]}/?cursor=abc"
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, 400)
+        self.assertIn("cursor", res.json()["errors"])
+
+    def test_cursor_of_other_sort_by(self):
+        """
+        Has to return 400 BAD REQUEST HTTP-response for a cursor
+        made for the other ordering
+        """
+        url = f"/api/get-transactions/{self.user_ids[1]}/?pagination=cursor&limit=2"
+        cursor = self.client.get(url).json()["data"]["next"].split("cursor=")[1]
+        res = self.client.get(f"/api/get-transactions/{self.user_ids[1]}/sort_by=amount/"
+                              f"?cursor={cursor}")
+        self.assertEqual(res.status_code, 400)
@@ -0,0 +1,113 @@
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .test_base import BaseTest
+from ..models import Transaction
+from ..partitions import DEFAULT_PARTITION, LEGACY_PARTITION, create_partitions, \
+    detach_partitions, partition_name
+
+
+class TestPartitions(BaseTest):
+    january = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+    february = datetime(2020, 2, 1, tzinfo=dt_timezone.utc)
+
+    def count_rows(self, table: str) -> int:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {table}")
+            return cursor.fetchone()[0]
+
+    def create_transfer(self, moment: datetime, comment: str = "Transfer") -> Transaction:
+        return Transaction.objects.create(amount=10, source_id=self.user_ids[0],
+                                          target_id=self.user_ids[1], comment=comment,
+                                          timestamp=moment)
+
+    def test_create_partitions(self):
+        """
+        Has to create the partitions ahead and move the rows of their
+        months from the default partition
+        """
+        moment = timezone.now() + timedelta(days=3 * 365)
+        self.create_transfer(moment)
+        self.assertEqual(self.count_rows(DEFAULT_PARTITION), 1)
+
+        result = create_partitions(moment, ahead=1)
+        self.assertEqual(len(result["created"]), 2)
+        self.assertEqual(result["moved"], 1)
+        self.assertEqual(self.count_rows(DEFAULT_PARTITION), 0)
+        self.assertEqual(self.count_rows(result["created"][0]), 1)
+        self.assertEqual(create_partitions(moment, ahead=1)["created"], [])
+
+    def test_skip_legacy_partition(self):
+        """
+        Has to create only the months after the range of the legacy partition
+        and leave the legacy partition attached
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE TABLE {LEGACY_PARTITION} PARTITION OF {Transaction._meta.db_table} "
+                           f"FOR VALUES FROM (MINVALUE) TO (%s)", [self.february])
+        result = create_partitions(self.january, ahead=2)
+        self.assertEqual(result["created"], [partition_name(self.february),
+                                             partition_name(datetime(2020, 3, 1))])
+        self.create_transfer(self.january + timedelta(days=3))
+        self.assertEqual(self.count_rows(LEGACY_PARTITION), 1)
+        self.assertEqual(detach_partitions(self.february), [])
+
+    def test_detach_to_archive(self):
+        """
+        Has to move the old partitions out of the table into the archive schema
+        """
+        create_partitions(self.january, ahead=1)
+        self.create_transfer(self.january + timedelta(days=3))
+        self.create_transfer(self.february + timedelta(days=3))
+
+        detached = detach_partitions(self.february, archive_schema="archive")
+        self.assertEqual(detached, [partition_name(self.january)])
+        self.assertEqual(Transaction.objects.filter(timestamp__lt=self.february).count(), 0)
+        self.assertEqual(Transaction.objects.filter(timestamp__gte=self.february).count(), 1)
+        self.assertEqual(self.count_rows(f"archive.{detached[0]}"), 1)
+
+    def test_detach_needs_snapshots(self):
+        """
+        Has to refuse detaching the months not covered by balance snapshots
+        """
+        with self.assertRaises(CommandError):
+            call_command("manage_partitions", "--detach-older-than", "1")
+
+    def test_get_transactions_date_range(self):
+        """
+        Has to return the rows in the range, reading only its partitions
+        """
+        create_partitions(self.january, ahead=1)
+        self.create_transfer(self.january + timedelta(days=3), "January")
+        self.create_transfer(self.february + timedelta(days=3), "February")
+
+        url = f"/api/get-transactions/{self.user_ids[0]}/?from=2020-02-01T00:00:00Z" \
+              f"&to=2020-03-01T00:00:00Z"
+        with CaptureQueriesContext(connection) as context:
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        comments = [row["comment"] for row in res.json()["data"]["results"]]
+        self.assertEqual(comments, ["February"])
+
+        relations = set()
+        with connection.cursor() as cursor:
+            for query in context.captured_queries:
+                if Transaction._meta.db_table not in query["sql"]:
+                    continue
+                cursor.execute("EXPLAIN (FORMAT JSON) " + query["sql"])
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                nodes = [plan[0]["Plan"]]
+                while nodes:
+                    node = nodes.pop()
+                    if "Relation Name" in node:
+                        relations.add(node["Relation Name"])
+                    nodes.extend(node.get("Plans", []))
+        self.assertEqual(relations, {partition_name(self.february)})
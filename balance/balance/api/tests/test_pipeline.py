@@ -0,0 +1,113 @@
+import io
+import json
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from .test_base import BaseTest
+from ..parsers import FastJSONParser
+from ..renderers import FastJSONRenderer
+
+
+class TestFastJSON(BaseTest):
+    def test_renders_as_drf(self):
+        """
+        Has to render the same bytes as DRF JSONRenderer
+        """
+        moment = datetime(2021, 9, 1, 12, 30, 15, 123456, tzinfo=dt_timezone.utc)
+        payloads = [
+            {"data": {"balance": Decimal("100.00"), "user_id": 1, "currency": "RUB"}},
+            {"data": [OrderedDict(amount=Decimal("0.01"), timestamp=moment)]},
+            {"as_of": moment, "day": date(2021, 9, 1), "naive": datetime(2021, 9, 1),
+             "local": timezone.localtime(moment), "period": timedelta(days=1)},
+            {"max": Decimal("9999999.99"), "sum": Decimal("123456789012.34"),
+             "float": 0.1, "none": None, "flag": True},
+            {1: "int key", "text": "Перевод\n\t\"quoted\"    \x01"},
+            {"errors": {"rows": {"2": ["Has to be a number"]}}},
+            [],
+        ]
+        for payload in payloads:
+            self.assertEqual(FastJSONRenderer().render(payload), JSONRenderer().render(payload))
+        self.assertEqual(FastJSONRenderer().render(None), b"")
+
+    def test_renders_decimals_exactly(self):
+        """
+        Has to refuse a Decimal the float of which isn't exact
+        """
+        self.assertEqual(FastJSONRenderer().render([Decimal("9999999.99")]), b"[9999999.99]")
+        with self.assertRaises(TypeError):
+            FastJSONRenderer().render([Decimal("1234567890.1234567890")])
+
+    def test_renders_indent(self):
+        """
+        Has to indent as DRF JSONRenderer if asked to
+        """
+        payload = {"data": {"balance": Decimal("1.50")}}
+        media_type = "application/json; indent=4"
+        self.assertEqual(FastJSONRenderer().render(payload, media_type),
+                         JSONRenderer().render(payload, media_type))
+
+    def test_parses_as_drf(self):
+        """
+        Has to parse the same data as DRF JSONParser
+        and raise ParseError on malformed JSON
+        """
+        for body in ('{"data": {"user_id": 1, "amount": 0.1}}',
+                     '{"data": {"transfers": [{"amount": 1e2}], "atomic": false}}',
+                     '{"text": "Перевод \\u2028"}'):
+            self.assertEqual(FastJSONParser().parse(io.BytesIO(body.encode())),
+                             JSONParser().parse(io.BytesIO(body.encode())))
+        for body in (b"", b"{", b'{"amount": NaN}'):
+            with self.assertRaises(ParseError):
+                FastJSONParser().parse(io.BytesIO(body))
+        latin = FastJSONParser().parse(io.BytesIO('{"a": "é"}'.encode("latin-1")),
+                                       parser_context={"encoding": "latin-1"})
+        self.assertEqual(latin, {"a": "é"})
+
+    def test_endpoints_render_as_drf(self):
+        """
+        Has to return the bytes DRF JSONRenderer would render
+        """
+        user_id = self.user_ids[0]
+        res = self.client.post(reverse("change-balance"),
+                               data=json.dumps({"data": {"user_id": user_id, "amount": 10.5}}),
+                               content_type="application/json")
+        self.assertEqual(res.status_code, 200)
+        for url in (f"/api/get-balance/{user_id}/", f"/api/get-balance/{user_id}/currency=USD/",
+                    f"/api/get-balance/{user_id}/?as_of=2020-01-01",
+                    f"/api/get-transactions/{user_id}/", f"/api/get-statement/{user_id}/",
+                    "/api/get-balance/12345/"):
+            res = self.client.get(url)
+            self.assertEqual(res.content, JSONRenderer().render(res.data), url)
+
+
+class TestSiteOnlyMiddleware(BaseTest):
+    def test_api_skips_site_middleware(self):
+        """
+        Has to answer the API requests without the session,
+        CSRF and X-Frame-Options
+        """
+        res = self.client.get(f"/api/get-balance/{self.user_ids[0]}/")
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn("X-Frame-Options", res)
+        self.assertNotIn("Vary", res)
+        self.assertFalse(hasattr(res.wsgi_request, "session"))
+        # Set by DRF without any authentication
+        self.assertIsNone(res.wsgi_request.user)
+
+    def test_site_keeps_middleware(self):
+        """
+        Has to run the middleware for the admin site
+        """
+        res = self.client.get("/admin/login/")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res["X-Frame-Options"], "DENY")
+        self.assertIn("csrftoken", res.cookies)
+        self.assertTrue(hasattr(res.wsgi_request, "session"))
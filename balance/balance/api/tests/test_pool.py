@@ -0,0 +1,132 @@
+import threading
+import time
+
+from psycopg2 import extensions
+
+from django.db import connection
+from django.test import TestCase
+
+from balance.pool.base import connect
+from balance.pool.pool import ConnectionPool, PoolTimeout
+
+
+class TestConnectionPool(TestCase):
+    def make_pool(self, **options) -> ConnectionPool:
+        conn_params = connection.get_connection_params()
+        pool = ConnectionPool(lambda: connect(conn_params), **options)
+        self.addCleanup(pool.close_idle)
+        return pool
+
+    def test_reuses_connections(self):
+        """
+        Has to hand out the returned connection instead of opening a new one
+        """
+        pool = self.make_pool()
+        conn = pool.checkout()
+        pool.checkin(conn)
+        self.assertIs(pool.checkout(), conn)
+
+        stats = pool.stats()
+        self.assertEqual(stats["created"], 1)
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertEqual(stats["in_use"], 1)
+        self.assertEqual(stats["idle"], 0)
+
+    def test_max_size_timeout(self):
+        """
+        Has to raise PoolTimeout when no connection gets free in time
+        """
+        pool = self.make_pool(max_size=1, timeout=0.1)
+        conn = pool.checkout()
+        with self.assertRaises(PoolTimeout):
+            pool.checkout()
+        pool.checkin(conn)
+        self.assertEqual(pool.stats()["timeouts"], 1)
+
+    def test_waits_for_connection(self):
+        """
+        Has to hand out a connection returned by another thread while waiting
+        """
+        pool = self.make_pool(max_size=1, timeout=5)
+        conn = pool.checkout()
+        threading.Timer(0.1, pool.checkin, [conn]).start()
+        self.assertIs(pool.checkout(), conn)
+
+        stats = pool.stats()
+        self.assertEqual(stats["waits"], 1)
+        self.assertGreater(stats["wait_time_max"], 0.05)
+
+    def test_max_size_under_load(self):
+        """
+        Has to keep at most max_size connections open while the returned
+        ones are being reset
+        """
+        pool = self.make_pool(max_size=4, timeout=10)
+        reset = pool._reset
+
+        def slow_reset(pooled):
+            # A rollback round trip
+            time.sleep(0.0005)
+            return reset(pooled)
+
+        pool._reset = slow_reset
+
+        def borrow():
+            for _ in range(20):
+                pool.checkin(pool.checkout())
+
+        threads = [threading.Thread(target=borrow) for _ in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = pool.stats()
+        self.assertEqual(stats["checkouts"], 320)
+        self.assertLessEqual(stats["created"], 4)
+
+    def test_health_check(self):
+        """
+        Has to replace a connection that died while idle
+        """
+        pool = self.make_pool(health_check_after=0)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_terminate_backend(%s)", [conn.get_backend_pid()])
+        time.sleep(0.1)
+
+        new_conn = pool.checkout()
+        self.assertIsNot(new_conn, conn)
+        self.assertEqual(pool.stats()["health_check_failures"], 1)
+
+    def test_checkin_rolls_back(self):
+        """
+        Has to roll back a transaction left open by the borrower
+        """
+        pool = self.make_pool()
+        conn = pool.checkout()
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        self.assertEqual(conn.info.transaction_status, extensions.TRANSACTION_STATUS_INTRANS)
+        pool.checkin(conn)
+        self.assertEqual(conn.info.transaction_status, extensions.TRANSACTION_STATUS_IDLE)
+
+    def test_expired_connection_closed(self):
+        """
+        Has to close a connection older than max_lifetime on checkin
+        """
+        pool = self.make_pool(max_lifetime=0)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats()["idle"], 0)
+
+    def test_pool_status(self):
+        """
+        Has to return 200 OK HTTP-response with the pool statistics
+        """
+        res = self.client.get("/api/pool-status/")
+        self.assertEqual(res.status_code, 200)
+        for stats in res.json()["data"].values():
+            self.assertIn("in_use", stats)
+            self.assertIn("wait_time_avg", stats)
@@ -0,0 +1,182 @@
+import asyncio
+import json
+import os
+import pstats
+import tempfile
+import time
+
+from asgiref.sync import SyncToAsync, async_to_sync
+
+from django.db import connections
+from django.test import AsyncClient, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from balance import profiling
+
+from .fake_rates import FakeRateServer
+from .test_base import BaseTest
+from ..models import Balance
+
+TOKEN = "secret"
+
+
+class ProfilingTestMixin:
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.profiles_dir = directory.name
+        settings_override = override_settings(PROFILING_DIR=directory.name,
+                                              PROFILING_TOKEN=TOKEN)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def bundles(self):
+        return sorted(os.listdir(self.profiles_dir))
+
+    def read(self, bundle: str, name: str):
+        with open(os.path.join(self.profiles_dir, bundle, name)) as file:
+            return json.load(file)
+
+    def functions(self, bundle: str) -> set:
+        stats = pstats.Stats(os.path.join(self.profiles_dir, bundle, "profile.prof"))
+        return {function for _, _, function in stats.stats}
+
+
+class TestProfiling(ProfilingTestMixin, BaseTest):
+    def test_profiles_on_header(self):
+        """
+        Has to write the profile, the statements with their plans and
+        the request to a bundle named in the response
+        """
+        res = self.client.get(f"/api/get-balance/{self.user_ids[0]}/", HTTP_X_PROFILE=TOKEN)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.bundles(), [res["X-Profile-Id"]])
+        bundle = res["X-Profile-Id"]
+        self.assertIn("-get_balance-", bundle)
+
+        path = os.path.join(self.profiles_dir, bundle)
+        self.assertGreater(pstats.Stats(os.path.join(path, "profile.prof")).total_calls, 0)
+        with open(os.path.join(path, "profile.txt")) as file:
+            self.assertIn("cumulative", file.read())
+
+        queries = self.read(bundle, "sql.json")["queries"]
+        selects = [query for query in queries if "api_balance" in query["sql"]]
+        self.assertTrue(selects)
+        self.assertGreater(selects[0]["seconds"], 0)
+        self.assertIn("Scan", selects[0]["plan"])
+
+        meta = self.read(bundle, "request.json")
+        self.assertEqual((meta["resource"], meta["status"], meta["trigger"]),
+                         ("get_balance", 200, "header"))
+
+    def test_ignores_wrong_token(self):
+        """
+        Has to profile nothing without the right token or outside the API
+        """
+        res = self.client.get(f"/api/get-balance/{self.user_ids[0]}/", HTTP_X_PROFILE="wrong")
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(res.has_header("X-Profile-Id"))
+        self.client.get("/metrics", HTTP_X_PROFILE=TOKEN)
+        self.assertEqual(self.bundles(), [])
+
+    @override_settings(PROFILING_TOKEN="", PROFILING_SAMPLE_RATE=1)
+    def test_samples(self):
+        """
+        Has to profile the drawn requests without naming the bundle
+        """
+        res = self.client.get(f"/api/get-transactions/{self.user_ids[0]}/")
+        self.assertFalse(res.has_header("X-Profile-Id"))
+        [bundle] = self.bundles()
+        self.assertEqual(self.read(bundle, "request.json")["trigger"], "sample")
+
+    def test_explain_errors(self):
+        """
+        Has to record the statements that can't be explained
+        and leave the transaction usable
+        """
+        csv = f"user_id,amount\n{self.user_ids[0]},10\n"
+        res = self.client.post(reverse("change-balances"), data=csv, content_type="text/csv",
+                               HTTP_X_PROFILE=TOKEN)
+        self.assertEqual(res.status_code, 200)
+        queries = self.read(res["X-Profile-Id"], "sql.json")["queries"]
+        plans = [query.get("plan") for query in queries if query.get("plan")]
+        self.assertTrue(any(plan.startswith("EXPLAIN failed") for plan in plans))
+        res = self.client.get(f"/api/get-balance/{self.user_ids[0]}/")
+        self.assertEqual(res.status_code, 200)
+
+    def test_size_cap(self):
+        """
+        Has to remove the oldest bundles above the size cap but the newest
+        """
+        with override_settings(PROFILING_MAX_BYTES=1):
+            for _ in range(3):
+                res = self.client.get(f"/api/get-balance/{self.user_ids[0]}/",
+                                      HTTP_X_PROFILE=TOKEN)
+        self.assertEqual(self.bundles(), [res["X-Profile-Id"]])
+
+    @override_settings(PROFILING_TOKEN="")
+    def test_disabled(self):
+        """
+        Has to keep the middleware out without the token and the sample rate
+        """
+        self.assertFalse(profiling.enabled())
+        self.client.get(f"/api/get-balance/{self.user_ids[0]}/", HTTP_X_PROFILE="")
+        self.assertEqual(self.bundles(), [])
+
+    @override_settings(ROOT_URLCONF="balance.asgi_urls")
+    def test_asgi_threads(self):
+        """
+        Has to profile the code of the request in the event loop
+        and in the threads of sync_to_async under ASGI
+        """
+        async def get(url: str):
+            return await AsyncClient().get(url, **{"X-Profile": TOKEN})
+
+        res = async_to_sync(get)(f"/api/get-transactions/{self.user_ids[0]}/")
+        self.assertEqual(res.status_code, 200)
+        functions = self.functions(res["X-Profile-Id"])
+        self.assertIn("get_transactions", functions)
+        self.assertIn("transactions_payload", functions)
+        self.assertIn("api_transaction", json.dumps(self.read(res["X-Profile-Id"], "sql.json")))
+
+        # A sync view, called by the handler in the thread of sync_to_async
+        res = async_to_sync(get)(f"/api/get-statement/{self.user_ids[0]}/")
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("statement_totals", self.functions(res["X-Profile-Id"]))
+
+
+class TestAsyncProfiling(ProfilingTestMixin, TransactionTestCase):
+    @override_settings(ROOT_URLCONF="balance.asgi_urls", RATES_CACHE_TTL=0,
+                       RATE_PROVIDER="balance.api.rates.ExchangeRateHostProvider",
+                       RATES_BREAKER={"budget": 5, "failure_threshold": 3, "reset_timeout": 30})
+    def test_async_concurrency(self):
+        """
+        Has to serve the async views concurrently under ASGI,
+        one of the requests profiled
+        """
+        Balance.objects.create(user_id=1, balance=100)
+        delay, requests = 0.5, 5
+
+        async def get_many():
+            client = AsyncClient()
+            return await asyncio.gather(*(
+                client.get("/api/get-balance/1/currency=USD/",
+                           **{"X-Profile": TOKEN if i == 0 else ""})
+                for i in range(requests)
+            ))
+
+        with FakeRateServer() as server, \
+                override_settings(RATE_PROVIDER_OPTIONS={"url": server.url}):
+            server.delay = delay
+            start = time.perf_counter()
+            responses = async_to_sync(get_many)()
+            seconds = time.perf_counter() - start
+        # The concurrent DB work ran in the thread of sync_to_async
+        SyncToAsync.single_thread_executor.submit(connections.close_all).result()
+
+        self.assertEqual([res.status_code for res in responses], [200] * requests)
+        # One after another they would take `requests` delays
+        self.assertLess(seconds, 2 * delay)
+        self.assertEqual(self.bundles(), [responses[0]["X-Profile-Id"]])
+        self.assertIn("current_balance", self.functions(responses[0]["X-Profile-Id"]))
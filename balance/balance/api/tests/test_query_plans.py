@@ -0,0 +1,172 @@
+import json
+import re
+from datetime import timedelta
+from urllib.parse import quote, urlsplit
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .test_base import TEST_CACHES
+from ..models import Balance, Transaction
+from ..partitions import create_partitions
+from ..rollups import rollup
+from ..snapshots import compact
+
+USERS = 20000
+TRANSACTIONS = 300000
+
+# Tables which must never be read with a sequential scan by the endpoints
+LEDGER_TABLES = (Balance._meta.db_table, Transaction._meta.db_table)
+
+EXPLAINABLE = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b", re.IGNORECASE)
+# Transaction bookkeeping, not counted against the budgets
+SAVEPOINTS = re.compile(r"^\s*(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b")
+
+
+@override_settings(CACHES=TEST_CACHES,
+                   RATE_PROVIDER="balance.api.tests.fake_rates.FakeRateProvider")
+class TestQueryPlans(TestCase):
+    """
+    Runs every endpoint against a large ledger, checks the plans of all
+    its queries with EXPLAIN and the number of queries it makes.
+    A failure means an index is not used anymore or a query was added -
+    update the budgets below only on purpose
+    """
+    user_id = 42
+
+    @classmethod
+    def setUpTestData(cls):
+        balance_table, transaction_table = LEDGER_TABLES
+        # The ledger may start in the previous month
+        create_partitions(timezone.now() - timedelta(days=31), ahead=1)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {balance_table} (user_id, balance, last_update) "
+                f"SELECT i, 100000, now() FROM generate_series(1, %s) i",
+                [USERS]
+            )
+            cursor.execute(
+                f"INSERT INTO {transaction_table} "
+                f"(amount, source_id, target_id, comment, timestamp) "
+                f"SELECT (i %% 1000) + 0.5, 1 + (i::bigint * 7919) %% %s, 1 + (i::bigint * 104729) %% %s, "
+                f"'Transfer', now() - make_interval(secs => i) "
+                f"FROM generate_series(1, %s) i",
+                [USERS, USERS, TRANSACTIONS]
+            )
+            cursor.execute(f"ANALYZE {balance_table}")
+            cursor.execute(f"ANALYZE {transaction_table}")
+
+    def seq_scans(self, sql: str) -> list:
+        """
+        Returns the ledger tables read with a sequential scan in the plan of sql
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        found = []
+        nodes = [plan[0]["Plan"]]
+        while nodes:
+            node = nodes.pop()
+            relation = node.get("Relation Name")
+            if node["Node Type"] == "Seq Scan" and self.is_ledger(relation):
+                found.append(relation)
+            nodes.extend(node.get("Plans", []))
+        return [relation for relation in found if not self.is_empty(relation)]
+
+    @staticmethod
+    def is_ledger(relation: str) -> bool:
+        # Monthly and default partitions of api_transaction included
+        return relation in LEDGER_TABLES \
+            or relation is not None and relation.startswith(f"{Transaction._meta.db_table}_")
+
+    @staticmethod
+    def is_empty(relation: str) -> bool:
+        # The planner may scan empty partitions sequentially, it costs nothing
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT NOT EXISTS (SELECT 1 FROM {connection.ops.quote_name(relation)})")
+            return cursor.fetchone()[0]
+
+    def check_endpoint(self, budget: int, method: str, url: str, data: dict = None,
+                       status: int = 200):
+        with CaptureQueriesContext(connection) as context:
+            if method == "post":
+                res = self.client.post(url, data=json.dumps(data),
+                                       content_type="application/json")
+            else:
+                res = self.client.get(url)
+        self.assertEqual(res.status_code, status, res.content)
+
+        queries = [query["sql"] for query in context.captured_queries
+                   if not SAVEPOINTS.match(query["sql"])]
+        self.assertLessEqual(len(queries), budget,
+                             f"{url} makes more queries than expected:\n" + "\n".join(queries))
+        for sql in queries:
+            if EXPLAINABLE.match(sql):
+                self.assertEqual(self.seq_scans(sql), [], f"Sequential scan in:\n{sql}")
+
+    def test_change_balance(self):
+        url = reverse("change-balance")
+        self.check_endpoint(5, "post", url, {"data": {"user_id": self.user_id, "amount": 100}})
+        self.check_endpoint(5, "post", url, {"data": {"user_id": self.user_id, "amount": -100}})
+        self.check_endpoint(5, "post", url, {"data": {"user_id": USERS + 1, "amount": 100}},
+                            status=201)
+
+    def test_get_balance(self):
+        self.check_endpoint(1, "get", reverse("get-balance", args=[self.user_id]))
+        self.check_endpoint(1, "get", f"/api/get-balance/{self.user_id}/currency=USD/")
+
+    def test_get_balance_as_of(self):
+        compact(timezone.now() - timedelta(hours=12), timedelta(days=1))
+        as_of = (timezone.now() - timedelta(hours=6)).isoformat()
+        self.check_endpoint(4, "get", f"/api/get-balance/{self.user_id}/?as_of={quote(as_of)}")
+
+    def test_make_transfer(self):
+        self.check_endpoint(6, "post", reverse("make-transfer"), {"data": {
+            "source_id": self.user_id, "target_id": self.user_id + 1, "amount": 10
+        }})
+
+    def test_make_transfers(self):
+        transfers = [
+            {"source_id": self.user_id + i, "target_id": self.user_id + i + 1, "amount": 10}
+            for i in range(50)
+        ]
+        self.check_endpoint(6, "post", reverse("make-transfers"),
+                            {"data": {"transfers": transfers}})
+
+    @override_settings(STATEMENT_ROLLUP=False)
+    def test_get_statement(self):
+        url = f"/api/get-statement/{self.user_id}/?granularity=day"
+        self.check_endpoint(3, "get", url)
+
+    def test_get_statement_from_rollups(self):
+        rollup(timezone.now() - timedelta(days=1), 31)
+        since = (timezone.now() - timedelta(days=3)).isoformat()
+        url = f"/api/get-statement/{self.user_id}/?granularity=week&from={quote(since)}"
+        self.check_endpoint(7, "get", url)
+
+    def test_get_transactions(self):
+        base = f"/api/get-transactions/{self.user_id}/"
+        self.check_endpoint(3, "get", base)
+        self.check_endpoint(3, "get", base + "sort_by=amount/?page=2")
+        self.check_endpoint(2, "get", base + "?pagination=cursor")
+        self.check_endpoint(2, "get", base + "sort_by=amount/?pagination=cursor")
+
+    def test_get_transactions_date_range(self):
+        start = timezone.now() - timedelta(days=2)
+        end = start + timedelta(days=1)
+        url = f"/api/get-transactions/{self.user_id}/?from={quote(start.isoformat())}" \
+              f"&to={quote(end.isoformat())}"
+        self.check_endpoint(3, "get", url)
+
+    def test_get_transactions_deep_cursor(self):
+        url = f"/api/get-transactions/{self.user_id}/?pagination=cursor&limit=2"
+        for _ in range(3):
+            parts = urlsplit(self.client.get(url).json()["data"]["next"])
+            url = f"{parts.path}?{parts.query}"
+        self.check_endpoint(7, "get", url)
@@ -0,0 +1,296 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from decimal import Decimal
+
+import time
+
+from asgiref.sync import async_to_sync
+
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+
+from .fake_rates import FakeRateServer
+from .test_base import BaseTest
+from .. import rates
+from ..breaker import CircuitBreaker
+from ..exceptions import CircuitOpen, ConvertResultNone, RatesUnavailable
+
+
+class TestRates(BaseTest):
+    def test_convert(self):
+        """
+        Has to convert with Decimal, rounding to cents
+        """
+        self.assertEqual(rates.convert(Decimal("2000.00"), "USD"), (Decimal("27.40"), False))
+        self.assertEqual(rates.convert(Decimal("0.50"), "EUR"), (Decimal("0.01"), False))
+
+    def test_warm_cache_needs_no_provider(self):
+        """
+        Has to fetch the rates once and serve the next conversions from the cache
+        """
+        provider = rates.get_provider()
+        calls = provider.calls
+        for currency in ("USD", "EUR", "USD"):
+            rates.convert(Decimal(100), currency)
+        self.assertEqual(provider.calls - calls, 1)
+
+    def test_unknown_currency(self):
+        """
+        Has to raise ConvertResultNone
+        """
+        with self.assertRaises(ConvertResultNone):
+            rates.convert(Decimal(100), "BDSS")
+
+    @override_settings(RATE_PROVIDER_OPTIONS={"fail": True})
+    def test_provider_failure_not_cached(self):
+        """
+        Has to raise RatesUnavailable and not cache the failure
+        """
+        with self.assertRaises(RatesUnavailable):
+            rates.convert(Decimal(100), "USD")
+        with self.assertRaises(RatesUnavailable):
+            rates.convert(Decimal(100), "USD")
+        self.assertEqual(rates.get_provider().calls, 2)
+
+    def test_get_balance_converted(self):
+        """
+        Has to return 200 OK HTTP-response and the converted balance
+        """
+        user_id = self.user_ids[1]
+        res = self.client.get(f"/api/get-balance/{user_id}/currency=USD/")
+        self.assertEqual(res.status_code, 200)
+        data = res.json().get("data")
+        self.assertEqual(data.get("currency"), "USD")
+        self.assertEqual(Decimal(str(data.get("balance"))), Decimal("27.40"))
+        self.assertFalse(data.get("stale"))
+
+    @override_settings(RATE_PROVIDER_OPTIONS={"fail": True})
+    def test_get_balance_rates_unavailable(self):
+        """
+        Has to return 200 OK HTTP-response and the RUB balance
+        """
+        user_id = self.user_ids[1]
+        res = self.client.get(f"/api/get-balance/{user_id}/currency=USD/")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json().get("data").get("currency"), "RUB")
+
+
+class RatesServerMixin:
+    """
+    Serves the rates from a FakeRateServer, with the breaker
+    configured by the `breaker` of the class
+    """
+    breaker: dict
+
+    def setUp(self):
+        super().setUp()
+        self.server = FakeRateServer().__enter__()
+        self.settings_override = override_settings(
+            RATE_PROVIDER="balance.api.rates.ExchangeRateHostProvider",
+            RATE_PROVIDER_OPTIONS={"url": self.server.url},
+            RATES_BREAKER=self.breaker,
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.server.fail = False
+        self.server.delay = 0
+        self.server.__exit__()
+        super().tearDown()
+
+    def expire_rates(self):
+        caches["rates"].delete(rates.RATES_CACHE_KEY)
+
+
+class TestRatesBreaker(RatesServerMixin, BaseTest):
+    breaker = {"budget": 0.2, "failure_threshold": 3, "reset_timeout": 0.3}
+
+    def get_balance(self, currency: str = "USD") -> dict:
+        res = self.client.get(f"/api/get-balance/{self.user_ids[1]}/currency={currency}/")
+        self.assertEqual(res.status_code, 200)
+        return res.json()["data"]
+
+    def test_fetches_from_upstream(self):
+        """
+        Has to convert with the rates of the upstream
+        """
+        data = self.get_balance()
+        self.assertEqual(data["currency"], "USD")
+        self.assertEqual(Decimal(str(data["balance"])), Decimal("27.40"))
+        self.assertEqual(self.server.requests, 1)
+
+    def test_slow_upstream_within_budget(self):
+        """
+        Has to answer with RUB within the latency budget
+        when the upstream is slow and no rates are known
+        """
+        self.server.delay = 2
+        start = time.monotonic()
+        data = self.get_balance()
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(data["currency"], "RUB")
+        self.assertEqual(rates.stats()["breaker"]["timeouts"], 1)
+        self.assertEqual(rates.stats()["fallbacks"]["unavailable"], 1)
+
+    def test_stale_fallback(self):
+        """
+        Has to serve the last known rates marked as stale
+        when the upstream fails
+        """
+        self.get_balance()
+        self.expire_rates()
+        self.server.fail = True
+
+        data = self.get_balance()
+        self.assertEqual(data["currency"], "USD")
+        self.assertEqual(Decimal(str(data["balance"])), Decimal("27.40"))
+        self.assertTrue(data["stale"])
+        self.assertEqual(rates.stats()["fallbacks"]["stale"], 1)
+
+    def test_breaker_opens(self):
+        """
+        Has to stop calling the upstream after repeated failures
+        """
+        self.server.fail = True
+        for _ in range(self.breaker["failure_threshold"]):
+            self.assertEqual(self.get_balance()["currency"], "RUB")
+        self.assertEqual(rates.stats()["breaker"]["state"], "open")
+
+        requests = self.server.requests
+        self.assertEqual(self.get_balance()["currency"], "RUB")
+        self.assertEqual(self.server.requests, requests)
+        self.assertEqual(rates.stats()["breaker"]["short_circuits"], 1)
+
+    def test_breaker_probes_in_background(self):
+        """
+        Has to close the breaker after a successful background probe
+        """
+        self.server.fail = True
+        for _ in range(self.breaker["failure_threshold"]):
+            self.get_balance()
+        self.server.fail = False
+        time.sleep(self.breaker["reset_timeout"])
+
+        self.assertEqual(self.get_balance()["currency"], "RUB")
+        for _ in range(50):
+            if rates.stats()["breaker"]["state"] == "closed":
+                break
+            time.sleep(0.05)
+        self.assertEqual(rates.stats()["breaker"]["state"], "closed")
+        self.assertEqual(self.get_balance()["currency"], "USD")
+
+    def test_rates_status(self):
+        """
+        Has to return 200 OK HTTP-response with the breaker state
+        """
+        self.get_balance()
+        res = self.client.get("/api/rates-status/")
+        self.assertEqual(res.status_code, 200)
+        data = res.json()["data"]
+        self.assertEqual(data["breaker"]["state"], "closed")
+        self.assertEqual(data["breaker"]["successes"], 1)
+
+
+class TestAsyncRates(RatesServerMixin, BaseTest):
+    breaker = {"budget": 1, "failure_threshold": 3, "reset_timeout": 30}
+
+    def test_slow_upstream_does_not_block(self):
+        """
+        Has to await the slow upstream, sharing one call between
+        concurrent conversions and leaving the event loop free
+        """
+        self.server.delay = 0.3
+        ticks = []
+
+        async def tick():
+            for _ in range(5):
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.02)
+
+        async def convert_many():
+            return await asyncio.gather(
+                *(rates.aconvert(Decimal("2000.00"), "USD") for _ in range(10)), tick()
+            )
+
+        results = async_to_sync(convert_many)()[:-1]
+        self.assertEqual(results, [(Decimal("27.40"), False)] * 10)
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(len(ticks), 5)
+        self.assertLess(ticks[-1] - ticks[0], 0.25)
+
+    def test_slow_upstream_within_budget(self):
+        """
+        Has to fall back to the last known rates when the upstream
+        doesn't answer within the budget, the call still completes
+        in the background
+        """
+        async_to_sync(rates.aconvert)(Decimal(100), "USD")
+        self.expire_rates()
+        self.server.delay = 1.2
+
+        async def convert_late():
+            start = time.monotonic()
+            result = await rates.aconvert(Decimal("2000.00"), "USD")
+            seconds = time.monotonic() - start
+            await asyncio.sleep(0.5)
+            return result, seconds
+
+        result, seconds = async_to_sync(convert_late)()
+        self.assertEqual(result, (Decimal("27.40"), True))
+        self.assertLess(seconds, 1.2)
+        self.assertEqual(rates.stats()["breaker"]["timeouts"], 1)
+        self.assertIsNotNone(caches["rates"].get(rates.RATES_CACHE_KEY))
+
+
+class ImmediateExecutor:
+    """
+    Runs the calls at once, returning finished futures
+    """
+    def submit(self, func) -> Future:
+        future = Future()
+        try:
+            future.set_result(func())
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class TestCircuitBreaker(SimpleTestCase):
+    def call(self, breaker: CircuitBreaker, func):
+        """
+        Calls the breaker in a thread, failing instead of hanging on a deadlock
+        """
+        errors = []
+
+        def run():
+            try:
+                breaker.call(func)
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(timeout=2)
+        self.assertFalse(thread.is_alive(), "the breaker call deadlocked")
+        return errors[0] if errors else None
+
+    def test_probe_done_at_once(self):
+        """
+        Has to close or reopen the breaker after a probe
+        finished before its callback was attached
+        """
+        def fail():
+            raise ValueError
+
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0, budget=1)
+        breaker._executor = ImmediateExecutor()
+        self.assertIsInstance(self.call(breaker, fail), ValueError)
+        self.assertEqual(breaker.stats()["state"], "open")
+
+        self.assertIsInstance(self.call(breaker, fail), CircuitOpen)
+        self.assertEqual(breaker.stats()["state"], "open")
+        self.assertIsInstance(self.call(breaker, lambda: 1), CircuitOpen)
+        self.assertEqual(breaker.stats()["state"], "closed")
+        self.assertEqual(breaker.stats()["probes"], 2)
@@ -0,0 +1,67 @@
+from unittest import mock
+
+from django.db import OperationalError
+from django.test import TestCase
+
+from ..retry import retry_on_conflict, retry_stats
+
+
+class PgError(Exception):
+    def __init__(self, pgcode):
+        self.pgcode = pgcode
+
+
+def db_error(pgcode: str) -> OperationalError:
+    error = OperationalError()
+    error.__cause__ = PgError(pgcode)
+    return error
+
+
+@mock.patch("balance.api.retry.time.sleep")
+class TestRetryOnConflict(TestCase):
+    def setUp(self):
+        retry_stats.reset()
+
+    def test_retries_deadlock(self, sleep):
+        """
+        Has to re-run the function after a deadlock and return its result
+        """
+        calls = []
+
+        @retry_on_conflict
+        def func():
+            calls.append(1)
+            if len(calls) < 3:
+                raise db_error("40P01")
+            return "ok"
+
+        self.assertEqual(func(), "ok")
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual(retry_stats.as_dict(),
+                         {"attempts": 3, "retries": 2, "failures": 0})
+
+    def test_gives_up_after_attempts(self, sleep):
+        """
+        Has to re-raise the error when attempts are exhausted
+        """
+        @retry_on_conflict(attempts=2)
+        def func():
+            raise db_error("40001")
+
+        with self.assertRaises(OperationalError):
+            func()
+        self.assertEqual(retry_stats.as_dict(),
+                         {"attempts": 2, "retries": 1, "failures": 1})
+
+    def test_does_not_retry_other_errors(self, sleep):
+        """
+        Has to re-raise non-transient errors at once
+        """
+        @retry_on_conflict
+        def func():
+            raise db_error("23505")
+
+        with self.assertRaises(OperationalError):
+            func()
+        sleep.assert_not_called()
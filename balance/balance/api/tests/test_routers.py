@@ -0,0 +1,124 @@
+import json
+from unittest import skipUnless
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from balance.routers import is_pinned, pin_to_primary, replica_for
+from .test_base import TEST_CACHES
+from ..models import Balance
+
+
+@skipUnless("replica1" in settings.DATABASES,
+            "needs the replica of balance/settings_test.py, run with --settings=balance.settings_test")
+@override_settings(CACHES=TEST_CACHES, DATABASE_REPLICAS=["replica1"],
+                   RATE_PROVIDER="balance.api.tests.fake_rates.FakeRateProvider")
+class TestReplicaRouting(TransactionTestCase):
+    # The checks before the tests look up the databases of the skipped classes too
+    databases = {"default", "replica1"} & set(settings.DATABASES)
+
+    def setUp(self):
+        caches["replica_pins"].clear()
+        caches["balances"].clear()
+        Balance.objects.create(user_id=1, balance=100)
+        Balance.objects.create(user_id=2, balance=200)
+
+    def tearDown(self):
+        connections["replica1"].close()
+
+    def get(self, url: str):
+        """
+        Makes the GET-request, returns the response and the numbers
+        of queries run on the primary and on the replica
+        """
+        with CaptureQueriesContext(connections["default"]) as primary, \
+                CaptureQueriesContext(connections["replica1"]) as replica:
+            res = self.client.get(url)
+            if res.streaming:
+                b"".join(res.streaming_content)
+        self.assertEqual(res.status_code, 200)
+        return res, len(primary), len(replica)
+
+    def post(self, name: str, data: dict):
+        res = self.client.post(reverse(name), data=json.dumps({"data": data}),
+                               content_type="application/json")
+        self.assertEqual(res.status_code, 200)
+
+    def test_reads_from_replica(self):
+        """
+        Has to run the queries of the read views on the replica
+        """
+        # The current balance comes from the cache, read from the primary once
+        self.get("/api/get-balance/1/")
+        for url in ("/api/get-balance/1/?as_of=2020-01-01",
+                    "/api/get-transactions/1/", "/api/get-transactions/1/?pagination=cursor",
+                    "/api/get-statement/1/", "/api/export-transactions/1/"):
+            _, on_primary, on_replica = self.get(url)
+            self.assertEqual(on_primary, 0, url)
+            self.assertGreater(on_replica, 0, url)
+
+    def test_balance_cache_misses_read_primary(self):
+        """
+        Has to read the current balance missing in the cache from the primary
+        """
+        _, on_primary, on_replica = self.get("/api/get-balance/1/")
+        self.assertEqual((on_primary, on_replica), (1, 0))
+        self.assertEqual(self.get("/api/get-balance/1/")[1:], (0, 0))
+
+    def test_read_your_writes(self):
+        """
+        Has to read the balances of the users changed by a write from the primary
+        """
+        self.post("make-transfer", {"source_id": 1, "target_id": 2, "amount": 10})
+        self.assertTrue(is_pinned(1) and is_pinned(2))
+        res, on_primary, on_replica = self.get("/api/get-balance/2/")
+        self.assertEqual(res.json()["data"]["balance"], 210)
+        self.assertEqual((on_primary > 0, on_replica), (True, 0))
+
+        self.post("change-balance", {"user_id": 1, "amount": 5})
+        caches["replica_pins"].delete("pin:2")
+        self.assertEqual(self.get("/api/get-transactions/1/")[2], 0)
+        self.assertGreater(self.get("/api/get-transactions/2/")[2], 0)
+
+    def test_bulk_changes_pin(self):
+        """
+        Has to pin the users of the applied bulk changes only
+        """
+        res = self.client.post(reverse("change-balances"), data="1,10\n2,-500\n",
+                                content_type="text/csv")
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(is_pinned(1))
+        self.assertFalse(is_pinned(2))
+
+    def test_no_pin_on_rollback(self):
+        """
+        Has to pin the users only when the write commits
+        """
+        with transaction.atomic():
+            Balance.objects.filter(user_id=1).update(balance=0)
+            pin_to_primary([1])
+            transaction.set_rollback(True)
+        self.assertFalse(is_pinned(1))
+
+    def test_atomic_block_on_primary(self):
+        """
+        Has to read from the primary inside an atomic block
+        """
+        with replica_for(1) as alias, transaction.atomic():
+            self.assertEqual(alias, "replica1")
+            with CaptureQueriesContext(connections["replica1"]) as replica:
+                Balance.objects.get(user_id=1)
+        self.assertEqual(len(replica), 0)
+
+    def test_writes_to_primary(self):
+        """
+        Has to run the writes on the primary, even in a replica block
+        """
+        with replica_for(1), CaptureQueriesContext(connections["replica1"]) as replica:
+            Balance.objects.filter(user_id=1).update(balance=50)
+            self.assertEqual(Balance.objects.get(user_id=1).balance, 50)
+        self.assertEqual(len(replica), 1)
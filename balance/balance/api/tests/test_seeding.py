@@ -0,0 +1,87 @@
+import json
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command, CommandError
+from django.db import connection
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from ..bulk import max_balance
+from ..models import Balance, Transaction
+from ..seeding import MAX_AMOUNT, seed_ledger
+
+# Changes of the balances by the transactions, in the order of time
+CHANGES = """
+SELECT source_id AS user_id, timestamp, id, CASE
+WHEN source_id <> target_id OR comment = 'Withdrawal' THEN -amount ELSE amount END AS change
+FROM api_transaction
+UNION ALL
+SELECT target_id, timestamp, id, amount FROM api_transaction WHERE source_id <> target_id
+"""
+
+
+class TestSeedLedger(TransactionTestCase):
+    def assert_consistent(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT count(*) FROM api_balance b "
+                f"LEFT JOIN (SELECT user_id, sum(change) AS total FROM ({CHANGES}) c "
+                f"GROUP BY user_id) t ON t.user_id = b.user_id "
+                f"WHERE t.total IS DISTINCT FROM b.balance"
+            )
+            self.assertEqual(cursor.fetchone()[0], 0)
+            cursor.execute(
+                f"SELECT min(running) FROM (SELECT sum(change) OVER "
+                f"(PARTITION BY user_id ORDER BY timestamp, id) AS running "
+                f"FROM ({CHANGES}) c) r"
+            )
+            self.assertGreaterEqual(cursor.fetchone()[0], 0)
+
+    def test_seed(self):
+        """
+        Has to load the balances equal to the sums of the transactions,
+        never negative, with the first users the most active,
+        and rebuild the indexes
+        """
+        out = StringIO()
+        call_command("seed_ledger", users=50, transactions=3000, chunk_size=400,
+                     workers=2, days=90, stdout=out)
+        result = json.loads(out.getvalue())
+        self.assertEqual(result["chunks"], 8)
+        self.assertEqual(len(result["rebuilt_indexes"]), 5)
+
+        self.assertEqual(Balance.objects.count(), 50)
+        # Opening deposits of every user included
+        self.assertGreaterEqual(Transaction.objects.count(), 3050)
+        self.assert_consistent()
+
+        first, last = (Transaction.objects.filter(source_id=user_id).count()
+                       for user_id in (1, 50))
+        self.assertGreater(first, 10 * last)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_indexes WHERE tablename = 'api_transaction'")
+            self.assertEqual(cursor.fetchone()[0], 6)
+
+    def test_caps_balances(self):
+        """
+        Has to withdraw the excess of the balances over the largest one
+        """
+        end = timezone.now()
+        result = seed_ledger(users=3, transactions=3000, start=end - timedelta(days=10),
+                             end=end, max_amount=MAX_AMOUNT, chunk_size=1000, workers=1)
+        self.assertGreater(result["capped_balances"], 0)
+        self.assertEqual(Balance.objects.order_by("-balance")[0].balance, max_balance())
+        self.assert_consistent()
+
+    def test_refuses_filled_ledger(self):
+        """
+        Has to refuse to seed the ledger with balances
+        unless asked to empty it
+        """
+        Balance.objects.create(user_id=1, balance=10)
+        with self.assertRaises(CommandError):
+            call_command("seed_ledger", users=10, transactions=10, stdout=StringIO())
+        call_command("seed_ledger", users=10, transactions=10, truncate=True, stdout=StringIO())
+        self.assertEqual(Balance.objects.count(), 10)
+        self.assert_consistent()
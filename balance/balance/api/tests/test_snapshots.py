@@ -0,0 +1,109 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.utils import timezone
+
+from .test_base import BaseTest
+from ..models import BalanceSnapshot, Transaction
+from ..snapshots import balance_as_of, compact
+
+
+class TestBalanceSnapshots(BaseTest):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.start = timezone.now() - timedelta(days=10)
+        first, second = cls.user_ids[:2]
+        # (day, amount, source_id, target_id, comment)
+        rows = [
+            (0, 100, first, first, "Deposit"),
+            (1, 30, first, second, "Transfer"),
+            (2, 50, second, second, "Deposit"),
+            (3, 20, second, first, "Transfer"),
+            (5, 40, first, first, "Withdrawal"),
+            # A transfer to oneself changes nothing
+            (5, 25, first, first, "Transfer"),
+            (8, 10, first, second, "Transfer"),
+        ]
+        Transaction.objects.bulk_create(
+            Transaction(amount=amount, source_id=source_id, target_id=target_id,
+                        comment=comment, timestamp=cls.start + timedelta(days=day))
+            for day, amount, source_id, target_id, comment in rows
+        )
+        # Balance of the first user at the end of every day
+        cls.expected = [100, 70, 70, 90, 90, 50, 50, 50, 40, 40]
+
+    def moment(self, day: int):
+        return self.start + timedelta(days=day, hours=12)
+
+    def assert_history(self):
+        for day, balance in enumerate(self.expected):
+            self.assertEqual(balance_as_of(self.user_ids[0], self.moment(day)),
+                             Decimal(balance), f"Day {day}")
+
+    def test_without_snapshots(self):
+        """
+        Has to replay the transactions up to the moment
+        """
+        self.assertEqual(balance_as_of(self.user_ids[0], self.start - timedelta(days=1)), 0)
+        self.assert_history()
+
+    def test_with_snapshots(self):
+        """
+        Has to return the same balances from the snapshots
+        """
+        result = compact(timezone.now(), timedelta(days=2))
+        self.assertEqual(result["windows"], 3)
+        self.assertTrue(BalanceSnapshot.objects.filter(user_id=self.user_ids[0]).exists())
+        self.assert_history()
+
+    def test_incremental(self):
+        """
+        Has to add snapshots only for the transactions after the previous run
+        """
+        self.assertEqual(compact(self.moment(4), timedelta(days=1))["windows"], 2)
+        watermark = BalanceSnapshot.objects.latest("timestamp").timestamp
+        self.assertEqual(watermark, self.start + timedelta(days=3))
+
+        result = compact(timezone.now(), timedelta(days=1))
+        self.assertEqual(result["windows"], 2)
+        self.assertFalse(BalanceSnapshot.objects.filter(timestamp__gt=watermark,
+                                                        timestamp__lt=self.moment(5)).exists())
+        self.assertEqual(compact(timezone.now(), timedelta(days=1))["windows"], 0)
+        self.assert_history()
+
+    def test_command(self):
+        """
+        Has to leave the transactions younger than the lag for the next run
+        """
+        Transaction.objects.create(amount=5, source_id=self.user_ids[0],
+                                   target_id=self.user_ids[0], comment="Deposit")
+        out = StringIO()
+        call_command("compact_balances", "--lag", "3600", stdout=out)
+        self.assertIn('"windows"', out.getvalue())
+        self.assertLess(BalanceSnapshot.objects.latest("timestamp").timestamp,
+                        timezone.now() - timedelta(minutes=59))
+        self.assertEqual(balance_as_of(self.user_ids[0], timezone.now()), Decimal(45))
+
+    def test_get_balance_as_of(self):
+        """
+        Has to return 200 OK HTTP-response with the balance as of the moment
+        """
+        compact(timezone.now(), timedelta(days=1))
+        moment = self.moment(3).isoformat()
+        res = self.client.get(f"/api/get-balance/{self.user_ids[0]}/", {"as_of": moment})
+        self.assertEqual(res.status_code, 200)
+        data = res.json()["data"]
+        self.assertEqual(data["balance"], 90)
+        self.assertEqual(data["currency"], "RUB")
+        self.assertIn("as_of", data)
+
+    def test_get_balance_invalid_as_of(self):
+        """
+        Has to return 400 BAD REQUEST HTTP-response
+        """
+        res = self.client.get(f"/api/get-balance/{self.user_ids[0]}/", {"as_of": "yesterday"})
+        self.assertEqual(res.status_code, 400)
+        self.assertIn("as_of", res.json()["errors"])
@@ -0,0 +1,170 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.test import override_settings
+from django.utils import timezone
+
+from .test_base import BaseTest
+from .. import rollups
+from ..models import Transaction
+from ..rollups import rollup
+from ..statement import AccountStatement, GRANULARITIES, TOTALS, statement_totals
+
+
+class TestAccountStatement(BaseTest):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        start = timezone.now()
+        first, second, third = cls.user_ids[:3]
+        Transaction.objects.bulk_create([
+            Transaction(amount=10, source_id=second, target_id=second,
+                        comment="Deposit", timestamp=start),
+            Transaction(amount=20, source_id=second, target_id=first,
+                        comment="Sent", timestamp=start + timedelta(seconds=1)),
+            Transaction(amount=30, source_id=third, target_id=second,
+                        comment="Received", timestamp=start + timedelta(seconds=2)),
+            Transaction(amount=40, source_id=first, target_id=third,
+                        comment="Other", timestamp=start + timedelta(seconds=3)),
+        ])
+
+    def test_directions(self):
+        """
+        Has to return the rows of both directions, newest first,
+        with the direction relative to the user
+        """
+        res = self.client.get(f"/api/get-transactions/{self.user_ids[1]}/")
+        self.assertEqual(res.status_code, 200)
+        rows = [(row["comment"], row["direction"]) for row in res.json()["data"]["results"]]
+        self.assertEqual(rows, [("Received", "in"), ("Sent", "out"), ("Deposit", "self")])
+
+    def test_sort_by_amount(self):
+        """
+        Has to merge both directions in the order of amount
+        """
+        res = self.client.get(f"/api/get-transactions/{self.user_ids[1]}/sort_by=amount/")
+        amounts = [row["amount"] for row in res.json()["data"]["results"]]
+        self.assertEqual(amounts, [10, 20, 30])
+
+    def test_pages(self):
+        """
+        Has to return the same rows page by page as at once
+        """
+        statement = AccountStatement(self.user_ids[1], ["-timestamp", "-id"])
+        rows = list(statement)
+        self.assertEqual(statement.count(), 3)
+        self.assertEqual(statement[0:2] + statement[2:4], rows)
+        self.assertEqual(statement[1:1], [])
+
+
+@override_settings(STATEMENT_ROLLUP=True)
+class TestStatementTotals(BaseTest):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user_id, other = cls.user_ids[:2]
+        start = timezone.make_aware(datetime(2025, 1, 10, 9, 30))
+        cls.rows = []
+        for i in range(60):
+            moment = start + timedelta(days=i * 0.7)
+            if i % 4 == 0:
+                row = (i + 100, cls.user_id, cls.user_id, "Deposit")
+            elif i % 4 == 1:
+                row = (i, cls.user_id, cls.user_id, "Withdrawal")
+            elif i % 4 == 2:
+                row = (i + 0.5, cls.user_id, other, "Transfer")
+            else:
+                row = (i + 0.25, other, cls.user_id, "Transfer")
+            cls.rows.append((moment,) + row)
+        # A transfer to oneself, on the day of a deposit, is neither of the totals
+        cls.rows.append((cls.rows[4][0], 7, cls.user_id, cls.user_id, "Transfer"))
+        Transaction.objects.bulk_create(
+            Transaction(timestamp=moment, amount=amount, source_id=source_id,
+                        target_id=target_id, comment=comment)
+            for moment, amount, source_id, target_id, comment in cls.rows
+        )
+
+    def expected(self, granularity: str, start=None, end=None) -> list:
+        buckets = {}
+        for moment, amount, source_id, target_id, comment in self.rows:
+            if start is not None and moment < start or end is not None and moment >= end:
+                continue
+            if source_id == target_id and comment == "Transfer":
+                continue
+            day = timezone.localtime(moment).date()
+            period = {"day": day, "week": day - timedelta(days=day.weekday()),
+                      "month": day.replace(day=1)}[granularity]
+            bucket = buckets.setdefault(period, dict.fromkeys(TOTALS, Decimal(0)))
+            if source_id != target_id:
+                name = "transfers_out" if source_id == self.user_id else "transfers_in"
+            else:
+                name = "withdrawals" if comment == "Withdrawal" else "deposits"
+            bucket[name] += Decimal(str(amount))
+        return [{"period": period, **totals} for period, totals in sorted(buckets.items())]
+
+    def ranges(self) -> list:
+        return [
+            (None, timezone.now()),
+            (timezone.make_aware(datetime(2025, 1, 15, 13, 0)),
+             timezone.make_aware(datetime(2025, 2, 20, 7, 45))),
+            (timezone.make_aware(datetime(2025, 2, 1)),
+             timezone.make_aware(datetime(2025, 3, 1))),
+        ]
+
+    def test_totals(self):
+        """
+        Has to sum the transactions of every period in the range
+        """
+        for granularity in GRANULARITIES:
+            for start, end in self.ranges():
+                self.assertEqual(statement_totals(self.user_id, granularity, start, end),
+                                 self.expected(granularity, start, end))
+
+    def test_totals_from_rollups(self):
+        """
+        Has to return the same totals with whole days taken from the rollups
+        """
+        rollup(timezone.make_aware(datetime(2025, 2, 5, 12, 0)), 7)
+        self.assertEqual(rollups.watermark(), date(2025, 2, 4))
+        rollup(timezone.now(), 7)
+        self.assertEqual(rollup(timezone.now(), 7)["batches"], 0)
+
+        for granularity in GRANULARITIES:
+            for start, end in self.ranges():
+                self.assertEqual(statement_totals(self.user_id, granularity, start, end),
+                                 self.expected(granularity, start, end))
+
+    def test_get_statement(self):
+        """
+        Has to return 200 OK HTTP-response with the totals per month
+        """
+        res = self.client.get(f"/api/get-statement/{self.user_id}/",
+                              {"from": "2025-02-01", "granularity": "month"})
+        self.assertEqual(res.status_code, 200)
+        periods = res.json()["data"]["periods"]
+        self.assertEqual(len(periods), 1)
+        self.assertEqual(periods[0]["period"], "2025-02-01")
+
+    def test_get_statement_invalid_granularity(self):
+        """
+        Has to return 400 BAD REQUEST HTTP-response
+        """
+        res = self.client.get(f"/api/get-statement/{self.user_id}/", {"granularity": "year"})
+        self.assertEqual(res.status_code, 400)
+        self.assertIn("granularity", res.json()["errors"])
+
+    def test_get_statement_invalid_range(self):
+        """
+        Has to return 400 BAD REQUEST HTTP-response
+        """
+        res = self.client.get(f"/api/get-statement/{self.user_id}/",
+                              {"from": "2025-02-01", "to": "2025-01-01"})
+        self.assertEqual(res.status_code, 400)
+        self.assertIn("to", res.json()["errors"])
+
+    def test_get_statement_no_such_user(self):
+        """
+        Has to return 404 NOT FOUND HTTP-response
+        """
+        res = self.client.get("/api/get-statement/123445/")
+        self.assertEqual(res.status_code, 404)
@@ -434,3 +434,100 @@ class TestViews(BaseTest):
         user_id = self.user_ids[1]
         res = self.client.get(f"/api/get-transactions/{user_id}/sort_by=amount/")
         self.assertEqual(res.status_code, 200)
+
+    def post_transfers(self, transfers: list, atomic: bool = True):
+        payload = {
+            "data": {
+                "atomic": atomic,
+                "transfers": transfers
+            }
+        }
+        payload = json.dumps(payload)
+        return self.client.post(reverse("make-transfers"),
+                                data=payload,
+                                content_type="application/json")
+
+    def test_make_transfers_ok(self):
+        """
+        Has to return 200 OK HTTP-response, change the balances
+        and create a Transaction for every transfer
+        """
+        res = self.post_transfers([
+            {"source_id": self.user_ids[1], "target_id": self.user_ids[0], "amount": 1000},
+            {"source_id": self.user_ids[0], "target_id": self.user_ids[2], "amount": 1050},
+            {"source_id": self.user_ids[2], "target_id": self.user_ids[1], "amount": 50},
+        ])
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.json()["data"]), 3)
+
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[0]).balance, 50)
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[1]).balance, 1050)
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[2]).balance, 1500)
+        self.assertEqual(Transaction.objects.filter(comment="Transfer").count(), 3)
+
+    def test_make_transfers_atomic_overdraft(self):
+        """
+        Has to return 400 BAD REQUEST HTTP-response with the index
+        of the failed transfer, make no changes to the database
+        """
+        res = self.post_transfers([
+            {"source_id": self.user_ids[1], "target_id": self.user_ids[0], "amount": 1000},
+            {"source_id": self.user_ids[0], "target_id": self.user_ids[2], "amount": 5000},
+        ])
+        self.assertEqual(res.status_code, 400)
+        self.assertIn("source_id", res.json()["errors"]["transfers"]["1"])
+
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[0]).balance, 100)
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[1]).balance, 2000)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_make_transfers_atomic_no_such_user(self):
+        """
+        Has to return 404 NOT FOUND HTTP-response,
+        make no changes to the database
+        """
+        res = self.post_transfers([
+            {"source_id": self.user_ids[1], "target_id": 99999, "amount": 100},
+        ])
+        self.assertEqual(res.status_code, 404)
+        self.assertIn("target_id", res.json()["errors"]["transfers"]["0"])
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[1]).balance, 2000)
+
+    def test_make_transfers_per_item(self):
+        """
+        Has to return 200 OK HTTP-response with a result for every transfer,
+        apply only the valid transfers
+        """
+        res = self.post_transfers([
+            {"source_id": self.user_ids[0], "target_id": self.user_ids[1], "amount": 500},
+            {"source_id": 99999, "target_id": self.user_ids[1], "amount": 10},
+            {"source_id": self.user_ids[0], "target_id": self.user_ids[1], "amount": 60},
+            {"source_id": self.user_ids[0], "target_id": self.user_ids[1], "amount": 50},
+        ], atomic=False)
+        self.assertEqual(res.status_code, 200)
+        results = res.json()["data"]
+        self.assertEqual([result["status"] for result in results], [400, 404, 200, 400])
+        self.assertEqual(results[2]["data"]["amount"], 60)
+
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[0]).balance, 40)
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[1]).balance, 2060)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_make_transfers_invalid_item(self):
+        """
+        Has to return 400 BAD REQUEST HTTP-response if any transfer
+        is malformed, make no changes to the database
+        """
+        res = self.post_transfers([
+            {"source_id": self.user_ids[1], "target_id": self.user_ids[0], "amount": 100},
+            {"source_id": self.user_ids[1], "target_id": self.user_ids[0], "amount": -100},
+        ], atomic=False)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(Balance.objects.get(user_id=self.user_ids[1]).balance, 2000)
+
+    def test_make_transfers_empty(self):
+        """
+        Has to return 400 BAD REQUEST HTTP-response
+        """
+        res = self.post_transfers([])
+        self.assertEqual(res.status_code, 400)
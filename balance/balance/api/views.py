@@ -1,28 +1,64 @@
-import requests
-from requests.exceptions import Timeout, ConnectionError
-
 from abc import abstractmethod
-from typing import List, Dict
+from datetime import datetime, time
+from typing import List, Dict, Optional, Tuple
 from decimal import Decimal
 
 from django.core import exceptions
 
-from django.db import transaction
+from django.db import transaction, DataError
+from django.db.models import Q
+from django.http import StreamingHttpResponse
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
 from rest_framework import status
 from rest_framework.serializers import BaseSerializer
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.parsers import JSONParser
+
+from balance.pool.pool import all_pools
+from balance.routers import pin_to_primary, replica_for
 
 from .serializers import BalanceSerializer, \
     ChangeBalanceSerializer, MakeTransferSerializer, \
-    TransactionSerializer
+    MakeTransfersSerializer, TransactionSerializer, StatementTransactionSerializer, \
+    ValuesSerializer
 from .models import Balance, Transaction
 from .exceptions import BalanceDoesNotExist, InvalidSortField, \
-    ConvertResultNone
-from .pagination import BasicPagination
+    ConvertResultNone, TransferInvalid, BulkRowInvalid, RatesUnavailable, \
+    InvalidCursor, InvalidDateTime, InvalidGranularity, NotModified
+from .pagination import BasicPagination, KeysetPagination
+from .parsers import CSVRowsParser, FastJSONParser, NDJSONRowsParser
+from .bulk import apply_balance_changes
+from . import balance_cache, etags, export, idempotency, rates
+from .retry import retry_on_conflict
+from .statement import AccountStatement, GRANULARITIES, statement_totals
+from .snapshots import balance_as_of
+
+
+def parse_moment(request, name: str) -> Optional[datetime]:
+    """
+    Returns the moment of the query parameter, an ISO 8601 datetime or date.
+    Naive moments and dates are taken in the current time zone.
+    Raises InvalidDateTime if the parameter is malformed
+    :param name: str - name of the query parameter
+    :return: aware datetime or None if there is no such parameter
+    """
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            moment = day and datetime.combine(day, time.min)
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise InvalidDateTime(name)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
 
 
 class BaseView(APIView):
@@ -30,42 +66,86 @@ class BaseView(APIView):
     Base class for views - takes a post request, validates data
     with the child-specific serializer
     """
-    parser_classes = [JSONParser]
+    parser_classes = [FastJSONParser]
     serializer = BaseSerializer
 
-    @transaction.atomic()
     def post(self, request) -> Response:
         errors = {}
         serializer = self.serializer(data=request.data)
         if not serializer.is_valid():
             errors["errors"] = serializer.errors
             return Response(errors, status=status.HTTP_400_BAD_REQUEST)
-        return self.handler(serializer)
+        key = request.headers.get(idempotency.HEADER)
+        if key is None:
+            return self.handler(serializer)
+        return self.idempotent_handler(serializer, key)
+
+    def idempotent_handler(self, serializer, key: str) -> Response:
+        """
+        Runs the handler once per idempotency key. Retries of the request
+        get the stored response of the first one, concurrent duplicates
+        wait for the first one to finish.
+        :param serializer - a serializer needed for processing JSON
+        :param key: str - value of the Idempotency-Key header
+        :return: Response of the handler or the stored one
+        """
+        if not key or len(key) > idempotency.MAX_KEY_LENGTH:
+            payload = {"errors": {"idempotency_key": [
+                f"Has to be from 1 to {idempotency.MAX_KEY_LENGTH} characters long"
+            ]}}
+            return Response(payload, status=status.HTTP_400_BAD_REQUEST)
+
+        now = timezone.now()
+        digest = idempotency.request_hash(self.request.data)
+        stored = idempotency.find(self.resource_name, key, now)
+        if stored is None:
+            with transaction.atomic():
+                key_id = idempotency.claim(self.resource_name, key, digest, now)
+                if key_id is not None:
+                    response = self.handler(serializer)
+                    idempotency.store(key_id, response)
+                    return response
+            stored = idempotency.find(self.resource_name, key, now)
+
+        if stored.request_hash != digest:
+            payload = {"errors": {"idempotency_key": [
+                "Was already used with another request"
+            ]}}
+            return Response(payload, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        return idempotency.replay(stored)
 
     @abstractmethod
     def handler(self, serializer) -> Response:
         pass
 
     @staticmethod
-    def get_balances(serializer: BaseSerializer, *args: str) -> List[Balance]:
+    def lock_balances(serializer: BaseSerializer, *args: str) -> List[Balance]:
         """
         Takes names of user_id-fields in JSON as arguments,
-        returns a list of Balance-instances for these users.
+        returns a list of Balance-instances for these users, locked
+        with SELECT ... FOR UPDATE. The rows are locked in one query
+        in the order of user_id, so that concurrent transactions
+        over the same balances never deadlock.
         Raises BalanceDoesNotExist if no balance found.
         :param serializer - a serializer needed for processing JSON
         :param args: strings - names of fields in JSON
-        :return: list of Balance instances
+        :return: list of Balance instances in the order of args
         """
         ids = {}
-        balances = []
 
         for field_name in args:
-            ids[field_name] = serializer.data.get(field_name)
+            ids[field_name] = serializer.validated_data.get(field_name)
 
+        locked = Balance.objects.select_for_update() \
+            .filter(user_id__in=set(ids.values())) \
+            .order_by("user_id")
+        found: Dict[int, Balance] = {balance.user_id: balance for balance in locked}
+
+        balances = []
         for key in ids:
             try:
-                balances.append(Balance.objects.get(user_id=ids[key]))
-            except Balance.DoesNotExist:
+                balances.append(found[ids[key]])
+            except KeyError:
                 raise BalanceDoesNotExist(key)
         return balances
 
@@ -91,69 +171,185 @@ class ChangeBalance(BaseView):
     def handler(self, serializer) -> Response:
         payload = {}
         http_status = status.HTTP_200_OK
+        user_id: int = serializer.validated_data.get("user_id")
         amount: Decimal = serializer.validated_data.get("amount")
 
         try:
-            balance: Balance = self.get_balances(serializer, "user_id")[0]
-            serializer.update(balance, serializer.validated_data)
-            self.do_transaction(balance.user_id, amount)
-            payload["data"] = BalanceSerializer(balance).data
-        except BalanceDoesNotExist as e:
-            if amount < 0:
-                http_status = status.HTTP_404_NOT_FOUND
-                payload["errors"] = {e.field_name: ["No user with such ID found"]}
+            with transaction.atomic():
+                if amount >= 0:
+                    balance = Balance.objects.deposit(user_id, amount)
+                else:
+                    balance = Balance.objects.change(user_id, amount)
+        except DataError:
+            payload["errors"] = {
+                "balance": ["Would be out of range after the operation."]
+            }
+            return Response(payload, status=status.HTTP_400_BAD_REQUEST)
+
+        if balance is None:
+            if Balance.objects.filter(user_id=user_id).exists():
+                http_status = status.HTTP_400_BAD_REQUEST
+                payload["errors"] = {
+                    "balance": ["Would be negative after the operation."]
+                }
             else:
-                user_id = serializer.validated_data.get("user_id")
-                balance = Balance.objects.create(balance=amount, user_id=user_id)
-                self.do_transaction(balance.user_id, amount)
-                balance_serializer = BalanceSerializer(balance)
-                payload["data"] = balance_serializer.data
-                http_status = status.HTTP_201_CREATED
+                http_status = status.HTTP_404_NOT_FOUND
+                payload["errors"] = {"user_id": ["No user with such ID found"]}
+            return Response(payload, status=http_status)
+
+        self.do_transaction(balance.user_id, amount)
+        pin_to_primary([balance.user_id])
+        balance_cache.invalidate([balance.user_id])
+        payload["data"] = BalanceSerializer(balance).data
+        if getattr(balance, "created", False):
+            http_status = status.HTTP_201_CREATED
 
         return Response(payload, status=http_status)
 
 
+class ChangeBalances(APIView):
+    """
+    Applies deposits and withdrawals of many users at once.
+    Takes `user_id,amount` CSV rows or NDJSON objects in the request body
+    """
+    parser_classes = [CSVRowsParser, NDJSONRowsParser]
+    resource_name = "change_balances"
+
+    def post(self, request) -> Response:
+        try:
+            result = apply_balance_changes(request.data)
+        except BulkRowInvalid as e:
+            payload = {"errors": {"rows": {str(e.line): [e.message]}}}
+            return Response(payload, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"data": result}, status=status.HTTP_200_OK)
+
+
 class GetBalance(APIView):
     serializer = BalanceSerializer
     resource_name = "get_balance"
 
     @staticmethod
-    def convert_currency(amount: Decimal, convert_to: str) -> Decimal:
-        payload = {
-            "from": "RUB",
-            "to": convert_to,
-            "amount": amount
-        }
-        response = requests.get("https://api.exchangerate.host/convert",
-                                params=payload, timeout=(2, 5))
-        response = (response.json())
-        result = response.get("result")
-        if result is None:
-            raise ConvertResultNone
-        return Decimal(round(result, 2))
+    def currency_rates(currency: str) -> Optional[Tuple[Dict[str, Decimal], bool]]:
+        """
+        Returns the rates for the conversion of RUB to the currency
+        and the flag of stale rates, None for RUB or if the rates are unavailable
+        """
+        if currency == "RUB":
+            return None
+        try:
+            return rates.get_rates()
+        except RatesUnavailable:
+            return None
 
-    def get(self, request, user_id: int, currency: str = "RUB") -> Response:
+    @classmethod
+    def current_balance(cls, user_id: int) -> dict:
+        """
+        Returns the serialized current balance of the user from the cache.
+        Raises Balance.DoesNotExist if no balance found
+        """
+        fast = ValuesSerializer(cls.serializer)
+        return balance_cache.cached_balance(user_id, lambda using: fast.to_representation(
+            Balance.objects.using(using).values_list(*fast.sources).get(user_id=user_id)
+        ))
+
+    @staticmethod
+    def balance_etag(current: dict, as_of: Optional[datetime], currency: str,
+                     rates_state: Optional[Tuple[Dict[str, Decimal], bool]]) -> str:
+        """
+        Returns the ETag of the balance data, built without the data itself
+        :param current: dict - serialized current balance
+        """
+        rate = rates_state and (rates_state[0].get(currency), rates_state[1])
+        return etags.make_etag("balance", current["user_id"], current["last_update"],
+                               as_of, currency, rate)
+
+    @staticmethod
+    def balance_data(user_id: int, current: dict, as_of: Optional[datetime], currency: str,
+                     rates_state: Optional[Tuple[Dict[str, Decimal], bool]]) -> dict:
+        """
+        Builds the balance of the user, current or as of the moment,
+        converted to the currency if there is a rate for it
+        :param current: dict - serialized current balance
+        :param rates_state: tuple of the rates and the stale flag or None
+        :return: dict - data of the response
+        """
         data = {"currency": "RUB"}
-        payload = {"data": data}
+        if as_of is None:
+            data.update(current)
+        else:
+            with replica_for(user_id):
+                amount = balance_as_of(user_id, as_of)
+            data.update(balance=amount, user_id=current["user_id"], as_of=as_of)
+        if rates_state is not None:
+            try:
+                amount = rates.apply_rate(data["balance"], currency, rates_state[0])
+            except ConvertResultNone:
+                return data
+            data.update(balance=amount, currency=currency, stale=rates_state[1])
+        return data
+
+    def get(self, request, user_id: int, currency: str = "RUB") -> Response:
+        payload = {}
         http_status = status.HTTP_200_OK
+        headers = None
 
         try:
-            balance: Balance = Balance.objects.get(user_id=user_id)
-            payload["data"].update(self.serializer(balance).data)
-
-            if currency != "RUB":
-                amount: Decimal = self.convert_currency(balance.balance,
-                                                        currency)
-                data["balance"] = amount
-                data["currency"] = currency
-
+            as_of = parse_moment(request, "as_of")
+            current = self.current_balance(user_id)
+            rates_state = self.currency_rates(currency)
+            etag = self.balance_etag(current, as_of, currency, rates_state)
+            etags.check(request, etag)
+            payload["data"] = self.balance_data(user_id, current, as_of, currency, rates_state)
+            headers = {"ETag": etag}
+
+        except NotModified as e:
+            return etags.not_modified(e.etag)
+        except InvalidDateTime as e:
+            http_status = status.HTTP_400_BAD_REQUEST
+            payload = {"errors": {e.field_name: [e.message]}}
         except Balance.DoesNotExist:
             http_status = status.HTTP_404_NOT_FOUND
             payload = {"errors": {"user_id": ["No user with such ID found"]}}
-        except (ConvertResultNone, Timeout, ConnectionError):
-            pass
 
-        return Response(payload, status=http_status)
+        return Response(payload, status=http_status, headers=headers)
+
+
+class GetRatesStatus(APIView):
+    """
+    Shows the state of the circuit breaker around the rate provider
+    and the number of fallbacks
+    """
+    resource_name = "rates_status"
+
+    def get(self, request) -> Response:
+        return Response({"data": rates.stats()}, status=status.HTTP_200_OK)
+
+
+class GetCacheStatus(APIView):
+    """
+    Shows the hits and misses of the balance cache
+    of the worker process
+    """
+    resource_name = "cache_status"
+
+    def get(self, request) -> Response:
+        data = {"balances": balance_cache.cache_stats.as_dict()}
+        return Response({"data": data}, status=status.HTTP_200_OK)
+
+
+class GetPoolStatus(APIView):
+    """
+    Shows the statistics of the database connection pools
+    of the worker process
+    """
+    resource_name = "pool_status"
+
+    def get(self, request) -> Response:
+        data = {
+            f"{alias}:{dict(params).get('database')}": pool.stats()
+            for (alias, params), pool in all_pools().items()
+        }
+        return Response({"data": data}, status=status.HTTP_200_OK)
 
 
 class MakeTransfer(BaseView):
@@ -173,15 +369,16 @@ class MakeTransfer(BaseView):
         :param amount: Decimal - amount to transfer
         :return: Transaction instance
         """
+        now = timezone.now()
         source_balance.balance -= amount
-        source_balance.last_update = timezone.now()
+        source_balance.last_update = now
         source_balance.clean_fields()
 
         target_balance.balance += amount
-        target_balance.last_update = timezone.now()
+        target_balance.last_update = now
 
-        source_balance.save()
-        target_balance.save()
+        source_balance.save(update_fields=["balance", "last_update"])
+        target_balance.save(update_fields=["balance", "last_update"])
 
         trans = Transaction.objects.create(
             amount=abs(amount),
@@ -191,15 +388,17 @@ class MakeTransfer(BaseView):
         )
         return trans
 
-    @transaction.atomic()
+    @retry_on_conflict
     def handler(self, serializer) -> Response:
         payload = {}
         http_status = status.HTTP_200_OK
 
         try:
-            balances: List[Balance] = self.get_balances(serializer, "source_id", "target_id")
+            balances: List[Balance] = self.lock_balances(serializer, "source_id", "target_id")
             amount: Decimal = serializer.validated_data.get("amount")
             trans: Transaction = self.do_transaction(balances[0], balances[1], amount)
+            pin_to_primary([trans.source_id, trans.target_id])
+            balance_cache.invalidate([trans.source_id, trans.target_id])
             payload["data"] = TransactionSerializer(trans).data
         except BalanceDoesNotExist as e:
             payload["errors"] = {e.field_name: ["No user with such ID found"]}
@@ -213,18 +412,148 @@ class MakeTransfer(BaseView):
         return Response(payload, status=http_status)
 
 
+class MakeTransfers(BaseView):
+    """
+    Makes a batch of transfers in one request and one DB transaction.
+    With `atomic` set, the first failed transfer cancels the whole batch,
+    otherwise failed transfers are skipped and reported per item.
+    """
+    serializer = MakeTransfersSerializer
+    resource_name = "make-transfers"
+
+    @staticmethod
+    def lock_all_balances(transfers: List[dict]) -> Dict[int, Balance]:
+        """
+        Locks every Balance involved in the transfers with one IN-query,
+        in the order of user_id
+        :param transfers: list of validated transfers
+        :return: dict of Balance instances by user_id
+        """
+        ids = set()
+        for item in transfers:
+            ids.add(item["source_id"])
+            ids.add(item["target_id"])
+        locked = Balance.objects.select_for_update() \
+            .filter(user_id__in=ids) \
+            .order_by("user_id")
+        return {balance.user_id: balance for balance in locked}
+
+    @staticmethod
+    def apply_transfer(balances: Dict[int, Balance], item: dict) -> Transaction:
+        """
+        Applies the transfer to the in-memory balances and returns
+        an unsaved Transaction-instance.
+        Leaves the balances untouched if the transfer fails.
+        Raises BalanceDoesNotExist if no balance found,
+        TransferInvalid if a balance would be out of range.
+        :param balances: dict of Balance instances by user_id
+        :param item: validated transfer
+        :return: Transaction instance
+        """
+        for field_name in ("source_id", "target_id"):
+            if item[field_name] not in balances:
+                raise BalanceDoesNotExist(field_name)
+        source_balance = balances[item["source_id"]]
+        target_balance = balances[item["target_id"]]
+        amount: Decimal = item["amount"]
+
+        source_balance.balance -= amount
+        target_balance.balance += amount
+        for field_name, balance, message in (
+            ("source_id", source_balance, "This balance would be negative after the transfer"),
+            ("target_id", target_balance, "This balance would be out of range after the transfer"),
+        ):
+            try:
+                balance.clean_fields(exclude=["user_id", "last_update"])
+            except exceptions.ValidationError:
+                source_balance.balance += amount
+                target_balance.balance -= amount
+                raise TransferInvalid(field_name, message)
+
+        return Transaction(
+            amount=amount,
+            source_id=source_balance.user_id,
+            target_id=target_balance.user_id,
+            comment="Transfer"
+        )
+
+    @staticmethod
+    def save_transfers(balances: Dict[int, Balance],
+                       transactions: List[Transaction]) -> List[Transaction]:
+        """
+        Writes the resulting balances of the accounts touched by
+        the transfers with one UPDATE and all Transactions with one INSERT
+        """
+        now = timezone.now()
+        touched = set()
+        for trans in transactions:
+            trans.timestamp = now
+            touched.add(trans.source_id)
+            touched.add(trans.target_id)
+        changed = [balances[user_id] for user_id in sorted(touched)]
+        for balance in changed:
+            balance.last_update = now
+
+        Balance.objects.bulk_update(changed, ["balance", "last_update"])
+        pin_to_primary(touched)
+        balance_cache.invalidate(touched)
+        return Transaction.objects.bulk_create(transactions)
+
+    @retry_on_conflict
+    def handler(self, serializer) -> Response:
+        transfers: List[dict] = serializer.validated_data.get("transfers")
+        atomic: bool = serializer.validated_data.get("atomic")
+        balances = self.lock_all_balances(transfers)
+
+        transactions = []
+        results = []
+        for index, item in enumerate(transfers):
+            try:
+                transactions.append(self.apply_transfer(balances, item))
+                results.append(None)
+            except BalanceDoesNotExist as e:
+                error = {e.field_name: ["No user with such ID found"]}
+                http_status = status.HTTP_404_NOT_FOUND
+            except TransferInvalid as e:
+                error = {e.field_name: [e.message]}
+                http_status = status.HTTP_400_BAD_REQUEST
+            else:
+                continue
+
+            if atomic:
+                payload = {"errors": {"transfers": {str(index): error}}}
+                return Response(payload, status=http_status)
+            results.append({"status": http_status, "errors": error})
+
+        saved = iter(self.save_transfers(balances, transactions))
+        if atomic:
+            payload = {"data": TransactionSerializer(saved, many=True).data}
+            return Response(payload, status=status.HTTP_200_OK)
+
+        for index, result in enumerate(results):
+            if result is None:
+                results[index] = {
+                    "status": status.HTTP_200_OK,
+                    "data": TransactionSerializer(next(saved)).data
+                }
+        return Response({"data": results}, status=status.HTTP_200_OK)
+
+
 class GetTransactions(APIView):
-    serializer = TransactionSerializer
+    serializer = StatementTransactionSerializer
     pagination_class = BasicPagination
     resource_name = "get_transactions"
 
     @property
     def paginator(self):
         if not hasattr(self, '_paginator'):
-            if self.pagination_class is None:
+            pagination_class = self.pagination_class
+            if KeysetPagination.is_requested(self.request):
+                pagination_class = KeysetPagination
+            if pagination_class is None:
                 self._paginator = None
             else:
-                self._paginator = self.pagination_class()
+                self._paginator = pagination_class()
         else:
             pass
         return self._paginator
@@ -240,34 +569,145 @@ class GetTransactions(APIView):
         return self.paginator.get_paginated_response(data)
 
     @staticmethod
-    def validate_sort_by_field(sort_by: str) -> str:
+    def validate_sort_by_field(sort_by: str) -> List[str]:
+        """
+        Returns the ordering for the sort_by field, with the id
+        as a tie-breaker
+        """
         if sort_by == "amount":
-            return sort_by
+            return ["amount", "id"]
         if sort_by == "date":
-            return "-timestamp"
+            return ["-timestamp", "-id"]
         raise InvalidSortField
 
     def get(self, request, user_id: int, sort_by: str = "date") -> Response:
+        try:
+            payload, http_status, etag = self.transactions_payload(request, user_id, sort_by)
+        except NotModified as e:
+            return etags.not_modified(e.etag)
+        return Response(payload, status=http_status, headers=etag and {"ETag": etag})
+
+    def transactions_payload(self, request, user_id: int,
+                             sort_by: str = "date") -> Tuple[dict, int, Optional[str]]:
+        """
+        Builds the page of the user's statement.
+        Raises NotModified if the ETag of the page matches
+        the If-None-Match header of the request
+        :param sort_by: str - `date` or `amount`
+        :return: tuple of the payload, the HTTP-status and the ETag of the response
+        """
+        payload = {}
+        http_status = status.HTTP_200_OK
+        etag = None
+
+        with replica_for(user_id):
+            try:
+                sort_by = self.validate_sort_by_field(sort_by)
+                start = parse_moment(request, "from")
+                end = parse_moment(request, "to")
+                balance = Balance.objects.get(user_id=user_id)
+                # Every transaction of the user changes its last_update
+                version = etags.make_etag("transactions", balance.last_update,
+                                          request.get_full_path())
+                etags.check(request, version)
+                fast = ValuesSerializer(self.serializer)
+                trans_query = AccountStatement(user_id, sort_by).values_list(*fast.sources)
+                # A range of timestamp limits the scans to its partitions
+                if start is not None:
+                    trans_query = trans_query.filter(Q(timestamp__gte=start))
+                if end is not None:
+                    trans_query = trans_query.filter(Q(timestamp__lt=end))
+                page = self.paginate_queryset(trans_query)
+                if page is not None:
+                    payload["data"] = self.get_paginated_response(fast.many(page)).data
+                else:
+                    payload["data"] = fast.many(trans_query)
+                etag = version
+            except InvalidSortField:
+                payload["errors"] = {
+                    "sort_by": ["Can be either 'amount' or 'date'"]
+                }
+                http_status = status.HTTP_400_BAD_REQUEST
+            except InvalidCursor:
+                payload["errors"] = {"cursor": ["Invalid cursor"]}
+                http_status = status.HTTP_400_BAD_REQUEST
+            except InvalidDateTime as e:
+                payload["errors"] = {e.field_name: [e.message]}
+                http_status = status.HTTP_400_BAD_REQUEST
+            except Balance.DoesNotExist:
+                payload["errors"] = {"user_id": ["No user with such ID found"]}
+                http_status = status.HTTP_404_NOT_FOUND
+
+        return payload, http_status, etag
+
+
+class ExportTransactions(APIView):
+    """
+    Streams the whole statement of the user as NDJSON or CSV,
+    oldest rows first
+    """
+    resource_name = "export_transactions"
+
+    def get(self, request, user_id: int, export_format: str = "ndjson"):
+        if export_format not in export.FORMATS:
+            payload = {"errors": {"format": ["Can be either 'ndjson' or 'csv'"]}}
+            return Response(payload, status=status.HTTP_400_BAD_REQUEST)
+        with replica_for(user_id):
+            if not Balance.objects.filter(user_id=user_id).exists():
+                payload = {"errors": {"user_id": ["No user with such ID found"]}}
+                return Response(payload, status=status.HTTP_404_NOT_FOUND)
+
+        _, content_type = export.FORMATS[export_format]
+        response = StreamingHttpResponse(export.export_statement(user_id, export_format),
+                                         content_type=content_type)
+        response["Content-Disposition"] = \
+            f'attachment; filename="transactions-{user_id}.{export_format}"'
+        return response
+
+
+class GetStatement(APIView):
+    """
+    Totals of the user's deposits, withdrawals and transfers
+    per day, week or month in the [from, to) range
+    """
+    resource_name = "get_statement"
+
+    @staticmethod
+    def validate_granularity(granularity: str) -> str:
+        if granularity not in GRANULARITIES:
+            raise InvalidGranularity
+        return granularity
+
+    def get(self, request, user_id: int) -> Response:
         payload = {}
         http_status = status.HTTP_200_OK
 
         try:
-            sort_by = self.validate_sort_by_field(sort_by)
-            Balance.objects.get(user_id=user_id)
-            trans_query = Transaction.objects.filter(source_id=user_id).order_by(sort_by)
-            page = self.paginate_queryset(trans_query)
-            if page is not None:
-                serializer = self.get_paginated_response(
-                    TransactionSerializer(page, many=True).data
-                )
-            else:
-                serializer = TransactionSerializer(trans_query, many=True)
-            payload["data"] = serializer.data
-        except InvalidSortField:
+            granularity = self.validate_granularity(
+                request.query_params.get("granularity", "month")
+            )
+            start = parse_moment(request, "from")
+            end = parse_moment(request, "to") or timezone.now()
+            if start is not None and start >= end:
+                raise InvalidDateTime("to", "Has to be later than from")
+            with replica_for(user_id):
+                Balance.objects.get(user_id=user_id)
+                periods = statement_totals(user_id, granularity, start, end)
+            payload["data"] = {
+                "user_id": user_id,
+                "granularity": granularity,
+                "from": start,
+                "to": end,
+                "periods": periods,
+            }
+        except InvalidGranularity:
             payload["errors"] = {
-                "sort_by": ["Can be either 'amount' or 'date'"]
+                "granularity": ["Can be either 'day', 'week' or 'month'"]
             }
             http_status = status.HTTP_400_BAD_REQUEST
+        except InvalidDateTime as e:
+            payload["errors"] = {e.field_name: [e.message]}
+            http_status = status.HTTP_400_BAD_REQUEST
         except Balance.DoesNotExist:
             payload["errors"] = {"user_id": ["No user with such ID found"]}
             http_status = status.HTTP_404_NOT_FOUND
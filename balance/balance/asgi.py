@@ -2,6 +2,9 @@
 ASGI config for balance project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Run it with an ASGI server, e.g.
+
+    uvicorn balance.asgi:application --host 0.0.0.0 --port 8000
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
@@ -9,8 +12,14 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+
+from balance.handlers import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'balance.settings')
+# Serve get-balance and get-transactions with the async views
+os.environ.setdefault('ASYNC_VIEWS', '1')
 
-application = get_asgi_application()
+# As get_asgi_application, with the handler streaming the responses from a thread
+django.setup(set_prefix=False)
+application = ASGIHandler()
@@ -0,0 +1,15 @@
+"""balance URL Configuration of the ASGI server
+
+The same as balance.urls, with the read views replaced by their async versions
+"""
+from django.urls import re_path
+
+from .api import async_views
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    re_path(r"^api/get-balance/(?P<user_id>\d+)/(?:currency=(?P<currency>\w+)/)?$",
+            async_views.get_balance, name="get-balance"),
+    re_path(r"^api/get-transactions/(?P<user_id>\d+)/(?:sort_by=(?P<sort_by>\w+)/)?$",
+            async_views.get_transactions, name="get-transactions"),
+] + sync_urlpatterns
@@ -0,0 +1,79 @@
+"""
+ASGI handler of the app, served by balance/asgi.py.
+
+Django 3.2 iterates the content of a streaming response on the event loop,
+so a generator reading the DB, like the one of export-transactions, fails
+there with SynchronousOnlyOperation. The handler pulls the chunks in a
+thread of the response's own: a DB transaction held open across the chunks
+is never shared with the other requests, as it would be in the thread of
+sync_to_async.
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers import asgi
+from django.db import connections
+
+
+def close_response(response):
+    """
+    Closes the response, with the generator of its content left unfinished
+    by a disconnected client, and the DB connections of the thread it ran in
+    """
+    try:
+        response.close()
+    finally:
+        connections.close_all()
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    """
+    Sends the streaming responses, iterating them in a thread
+    """
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        await send({
+            "type": "http.response.start",
+            "status": response.status_code,
+            "headers": self.response_headers(response),
+        })
+        loop = asyncio.get_running_loop()
+        # The context of the request: the routing to the replicas and the
+        # metrics of the request follow the iterator, and the context
+        # variables it sets are reset in the same context
+        context = contextvars.copy_context()
+        iterator = iter(response)
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="streaming") as executor:
+            try:
+                while True:
+                    part = await loop.run_in_executor(executor, context.run, next, iterator, None)
+                    if part is None:
+                        break
+                    for chunk, _ in self.chunk_bytes(part):
+                        await send({
+                            "type": "http.response.body",
+                            "body": chunk,
+                            "more_body": True,
+                        })
+                await send({"type": "http.response.body"})
+            finally:
+                await loop.run_in_executor(executor, context.run, close_response, response)
+
+    @staticmethod
+    def response_headers(response) -> list:
+        """
+        Headers and cookies of the response, as asgi.ASGIHandler sends them
+        """
+        headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode("ascii")
+            if isinstance(value, str):
+                value = value.encode("latin1")
+            headers.append((bytes(header), bytes(value)))
+        for cookie in response.cookies.values():
+            headers.append((b"Set-Cookie", cookie.output(header="").encode("ascii").strip()))
+        return headers
@@ -0,0 +1,517 @@
+"""
+Prometheus metrics of the app.
+
+Counters and histograms live in a registry of the worker process and cost
+a lock and a bisect to update. Every worker writes a snapshot of its
+registry to METRICS_DIR every METRICS_FLUSH_INTERVAL seconds from a
+background thread, and GET /metrics sums the snapshots of all the workers
+on the host. Snapshots of the workers gone are merged into one archive,
+so the counters never go back.
+
+MetricsMiddleware times the requests by `resource_name` of the view,
+the execute wrapper installed on every DB connection times the queries
+of the request, and the pool backend times the transactions.
+"""
+import asyncio
+import atexit
+import fcntl
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                 0.1, 0.25, 1, 5)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+# Resource of the requests of views without `resource_name`
+OTHER = "other"
+
+_lock = threading.Lock()
+
+
+class Metric(ABC):
+    """
+    Values of a metric by the tuple of the values of its labels
+    """
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = {}
+
+    @abstractmethod
+    def merge(self, total, value):
+        """
+        Returns the total with the value of another worker added
+        """
+
+    @abstractmethod
+    def samples(self, labels: tuple, value) -> Iterable[Tuple[str, str, float]]:
+        """
+        Yields the name suffix, the labels and the value of every sample
+        """
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, labels: tuple, amount: float = 1):
+        with _lock:
+            self.add(labels, amount)
+
+    def add(self, labels: tuple, amount: float):
+        """
+        Increments the counter, the caller holds the lock
+        """
+        values = self.values
+        values[labels] = values.get(labels, 0) + amount
+
+    def merge(self, total, value):
+        return (total or 0) + value
+
+    def samples(self, labels: tuple, value):
+        yield "", format_labels(self.labels, labels), value
+
+
+class Histogram(Metric):
+    """
+    Keeps the count of every bucket, the count over the last bucket
+    and the sum of the observed values
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...],
+                 buckets: Tuple[float, ...]):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        self.bounds = tuple(float(bound) for bound in buckets)
+
+    def observe(self, labels: tuple, value: float):
+        with _lock:
+            self.add(labels, value)
+
+    def add(self, labels: tuple, value: float):
+        """
+        Observes the value, the caller holds the lock
+        """
+        counts = self.values.get(labels)
+        if counts is None:
+            counts = self.values[labels] = [0] * (len(self.bounds) + 2)
+        counts[bisect_left(self.bounds, value)] += 1
+        counts[-1] += value
+
+    def merge(self, total, value):
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+
+    def samples(self, labels: tuple, value):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), value):
+            cumulative += count
+            yield "_bucket", format_labels(self.labels + ("le",), labels + (bound,)), cumulative
+        yield "_sum", format_labels(self.labels, labels), value[-1]
+        yield "_count", format_labels(self.labels, labels), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def reset(self):
+        with _lock:
+            for metric in self.metrics.values():
+                metric.values = {}
+
+    def snapshot(self) -> dict:
+        """
+        Returns the values of the metrics as
+        {name: [[labels, value], ...]}, fit for JSON
+        """
+        with _lock:
+            return {
+                name: [[list(labels), value if metric.kind == "counter" else list(value)]
+                       for labels, value in metric.values.items()]
+                for name, metric in self.metrics.items() if metric.values
+            }
+
+    def merge(self, snapshots: Iterable[dict]) -> Dict[str, Dict[tuple, object]]:
+        """
+        Sums the snapshots of the workers
+        """
+        merged = {}
+        for snapshot in snapshots:
+            for name, values in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                totals = merged.setdefault(name, {})
+                for labels, value in values:
+                    labels = tuple(labels)
+                    totals[labels] = metric.merge(totals.get(labels), value)
+        return merged
+
+    def render(self, merged: Dict[str, Dict[tuple, object]]) -> str:
+        """
+        Renders the merged values in the Prometheus text format
+        """
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in sorted(merged.get(name, {}).items()):
+                for suffix, label_text, sample in metric.samples(labels, value):
+                    lines.append(f"{name}{suffix}{label_text} {format_value(sample)}")
+        return "\n".join(lines) + "\n"
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def format_value(value: float) -> str:
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "balance_http_requests_total", "HTTP requests by resource, method and status",
+    ("resource", "method", "status")))
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "balance_http_request_duration_seconds", "Time to respond to a request by resource",
+    ("resource",), LATENCY_BUCKETS))
+DB_QUERIES_PER_REQUEST = REGISTRY.register(Histogram(
+    "balance_db_queries_per_request", "DB queries made by a request by resource",
+    ("resource",), COUNT_BUCKETS))
+DB_QUERY_SECONDS = REGISTRY.register(Histogram(
+    "balance_db_query_duration_seconds", "Time of a DB query by resource",
+    ("resource",), QUERY_BUCKETS))
+DB_LOCKING_SECONDS = REGISTRY.register(Histogram(
+    "balance_db_locking_query_duration_seconds",
+    "Time of a DB query taking row or advisory locks by resource, waits for the locks included",
+    ("resource",), QUERY_BUCKETS))
+DB_TRANSACTION_SECONDS = REGISTRY.register(Histogram(
+    "balance_db_transaction_duration_seconds",
+    "Time from the beginning of a DB transaction to its end by resource and outcome",
+    ("resource", "outcome"), LATENCY_BUCKETS))
+RATES_LOOKUPS = REGISTRY.register(Counter(
+    "balance_rates_lookups_total",
+    "Lookups of the exchange rates by result: cache, fetched, stale or unavailable",
+    ("result",)))
+RATES_FETCH_SECONDS = REGISTRY.register(Histogram(
+    "balance_rates_fetch_duration_seconds", "Time of a call to the rate provider by outcome",
+    ("outcome",), LATENCY_BUCKETS))
+
+
+class RequestMetrics:
+    """
+    The resource of the request being served and its DB queries so far
+    """
+    __slots__ = ("resource", "queries")
+
+    def __init__(self):
+        self.resource = OTHER
+        self.queries = 0
+
+
+# Follows the request into the threads of sync_to_async
+_request: ContextVar[Optional[RequestMetrics]] = ContextVar("request_metrics", default=None)
+
+
+def current_resource() -> str:
+    state = _request.get()
+    return OTHER if state is None else state.resource
+
+
+def observe_query(execute, sql, params, many, context):
+    """
+    Execute wrapper timing the queries of the connection
+    """
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        seconds = time.perf_counter() - start
+        state = _request.get()
+        resource = OTHER
+        if state is not None:
+            state.queries += 1
+            resource = state.resource
+        locking = sql.startswith("UPDATE") or "FOR UPDATE" in sql or "pg_advisory" in sql
+        with _lock:
+            DB_QUERY_SECONDS.add((resource,), seconds)
+            if locking:
+                DB_LOCKING_SECONDS.add((resource,), seconds)
+
+
+@receiver(connection_created)
+def install_query_wrapper(sender, connection, **kwargs):
+    wrappers = connection.execute_wrappers
+    if not settings.METRICS:
+        if observe_query in wrappers:
+            wrappers.remove(observe_query)
+    elif observe_query not in wrappers:
+        # First, so that the wrappers pushed and popped around it stay in order
+        wrappers.insert(0, observe_query)
+
+
+def observe_transaction(seconds: float, outcome: str):
+    DB_TRANSACTION_SECONDS.observe((current_resource(), outcome), seconds)
+
+
+class MetricsMiddleware:
+    """
+    Counts and times the requests by the resource of the view.
+    Async under an ASGI server, so that the async views aren't
+    serialized through a thread
+    """
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Django awaits the middleware marked as a coroutine function,
+            # and calls the coroutine process_view on the event loop
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start_flusher()
+        state = RequestMetrics()
+        token = _request.set(state)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request.reset(token)
+        self.record(request, response, state, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        start_flusher()
+        state = RequestMetrics()
+        token = _request.set(state)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request.reset(token)
+        self.record(request, response, state, time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def record(request, response, state: RequestMetrics, seconds: float):
+        resource = (state.resource,)
+        with _lock:
+            HTTP_REQUESTS.add((state.resource, request.method, str(response.status_code)), 1)
+            HTTP_REQUEST_SECONDS.add(resource, seconds)
+            DB_QUERIES_PER_REQUEST.add(resource, state.queries)
+
+    @staticmethod
+    def label(view_func):
+        state = _request.get()
+        if state is not None:
+            view = getattr(view_func, "view_class", view_func)
+            state.resource = getattr(view, "resource_name", OTHER)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self.label(view_func)
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        self.label(view_func)
+
+
+# Snapshots of the workers on the host
+
+# Process the flusher thread runs in
+_flusher_pid = None
+_flush_lock = threading.Lock()
+_exit_flush = False
+_worker_file = None
+
+
+def worker_file() -> str:
+    """
+    Name of the snapshot file of the worker, unique even if the pid is reused
+    """
+    global _worker_file
+    if _worker_file is None:
+        _worker_file = f"{os.getpid()}-{time.time_ns()}.json"
+    return _worker_file
+
+
+def flush():
+    """
+    Writes the snapshot of the registry of the worker. The flusher thread
+    and /metrics flush one at a time, so that an older snapshot never
+    replaces a newer one
+    """
+    with _flush_lock:
+        snapshot = REGISTRY.snapshot()
+        if not snapshot:
+            return
+        directory = os.path.join(settings.METRICS_DIR, "workers")
+        os.makedirs(directory, exist_ok=True)
+        write_snapshot(os.path.join(directory, worker_file()), snapshot)
+
+
+def run_flusher():
+    while True:
+        time.sleep(settings.METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+def start_flusher():
+    """
+    Starts the flusher thread of the process on its first request. uWSGI
+    forks the workers after loading the app in the master, and the threads
+    don't survive fork
+    """
+    global _flusher_pid, _exit_flush
+    if _flusher_pid == os.getpid():
+        return
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        threading.Thread(target=run_flusher, name="metrics-flusher", daemon=True).start()
+        _flusher_pid = os.getpid()
+        # The exit handlers are inherited by the forked workers
+        if not _exit_flush:
+            atexit.register(flush)
+            _exit_flush = True
+
+
+def after_fork():
+    """
+    The child starts with an empty registry and its own snapshot file.
+    The locks are new, as a thread of the parent might have held them
+    """
+    global _lock, _flush_lock, _worker_file
+    _lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    REGISTRY.reset()
+    _worker_file = None
+
+
+os.register_at_fork(after_in_child=after_fork)
+
+
+def is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def read_snapshot(path: str) -> dict:
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_snapshot(path: str, snapshot: dict):
+    """
+    Replaces the file with the snapshot at once, through a temporary
+    file of its own
+    """
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as file:
+            json.dump(snapshot, file)
+        os.replace(temporary, path)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise
+
+
+@contextmanager
+def directory_lock(directory: str):
+    with open(os.path.join(directory, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def as_snapshot(merged: Dict[str, Dict[tuple, object]]) -> dict:
+    return {name: [[list(labels), value] for labels, value in values.items()]
+            for name, values in merged.items()}
+
+
+def collect() -> Dict[str, Dict[tuple, object]]:
+    """
+    Sums the snapshots of all the workers with the archive.
+    The snapshots of the workers gone are merged into the archive
+    """
+    flush()
+    directory = settings.METRICS_DIR
+    os.makedirs(os.path.join(directory, "workers"), exist_ok=True)
+    archive_path = os.path.join(directory, "archive.json")
+    with directory_lock(directory):
+        archive = read_snapshot(archive_path)
+        snapshots: List[dict] = []
+        gone = []
+        for path in glob.glob(os.path.join(directory, "workers", "*.json")):
+            pid = int(os.path.basename(path).split("-", 1)[0])
+            (snapshots if is_alive(pid) else gone).append(path)
+        if gone:
+            archive = as_snapshot(REGISTRY.merge([archive] + [read_snapshot(p) for p in gone]))
+            write_snapshot(archive_path, archive)
+            for path in gone:
+                os.remove(path)
+        return REGISTRY.merge([archive] + [read_snapshot(path) for path in snapshots])
+
+
+def metrics_view(request) -> HttpResponse:
+    """
+    Metrics of all the workers in the Prometheus text format
+    """
+    return HttpResponse(REGISTRY.render(collect()),
+                        content_type="text/plain; version=0.0.4; charset=utf-8")
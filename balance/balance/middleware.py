@@ -0,0 +1,43 @@
+"""
+Middleware of the site, skipped by the API requests.
+
+Sessions, CSRF, authentication, messages and X-Frame-Options serve
+the admin site. The API is a token-less JSON API, so the requests under
+API_PATH_PREFIX go past them straight to the view.
+"""
+from django.conf import settings
+from django.contrib.auth import middleware as auth
+from django.contrib.messages import middleware as messages
+from django.contrib.sessions import middleware as sessions
+from django.middleware import clickjacking, csrf
+
+
+def is_api_request(request) -> bool:
+    return request.path_info.startswith(settings.API_PATH_PREFIX)
+
+
+def site_only(middleware_class):
+    """
+    Returns a subclass of the middleware skipped by the API requests
+    """
+    class SiteOnlyMiddleware(middleware_class):
+        def __call__(self, request):
+            if is_api_request(request):
+                return self.get_response(request)
+            return super().__call__(request)
+
+        if hasattr(middleware_class, "process_view"):
+            def process_view(self, request, *args):
+                if is_api_request(request):
+                    return None
+                return super().process_view(request, *args)
+
+    SiteOnlyMiddleware.__name__ = SiteOnlyMiddleware.__qualname__ = middleware_class.__name__
+    return SiteOnlyMiddleware
+
+
+SessionMiddleware = site_only(sessions.SessionMiddleware)
+CsrfViewMiddleware = site_only(csrf.CsrfViewMiddleware)
+AuthenticationMiddleware = site_only(auth.AuthenticationMiddleware)
+MessageMiddleware = site_only(messages.MessageMiddleware)
+XFrameOptionsMiddleware = site_only(clickjacking.XFrameOptionsMiddleware)
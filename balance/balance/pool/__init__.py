@@ -0,0 +1,6 @@
+"""
+PostgreSQL database backend with a pool of persistent connections.
+
+Set 'ENGINE': 'balance.pool' in settings.DATABASES and tune the pool
+with the 'POOL' key of the database settings, see ConnectionPool.
+"""
@@ -0,0 +1,81 @@
+import time
+
+import psycopg2.extras
+
+from django.db.backends.postgresql import base
+from django.utils.asyncio import async_unsafe
+
+from balance import metrics
+
+from .creation import DatabaseCreation
+from .pool import get_pool, ConnectionPool
+
+
+def connect(conn_params: dict):
+    connection = base.Database.connect(**conn_params)
+    # The same as the postgresql backend does for JSONField
+    psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+    return connection
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL backend taking connections from a process-wide pool.
+    Closing the connection, which Django does at the end of every request,
+    returns it to the pool. Times the transactions for the metrics
+    """
+    creation_class = DatabaseCreation
+    transaction_start = None
+
+    @property
+    def pool(self) -> ConnectionPool:
+        conn_params = self.get_connection_params()
+        return get_pool(
+            (self.alias, tuple(sorted(conn_params.items()))),
+            lambda: connect(conn_params),
+            **self.settings_dict.get("POOL", {})
+        )
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        self._pool = self.pool
+        connection = self._pool.checkout()
+
+        options = self.settings_dict["OPTIONS"]
+        self.isolation_level = options.get("isolation_level", connection.isolation_level)
+        if self.isolation_level != connection.isolation_level:
+            connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        with self.wrap_database_errors:
+            if self.in_atomic_block:
+                # The wrapper keeps the connection until the atomic block exits,
+                # it must not get to another thread meanwhile
+                self._pool.discard(self.connection)
+            else:
+                self._pool.checkin(self.connection)
+
+    def _set_autocommit(self, autocommit):
+        super()._set_autocommit(autocommit)
+        # Turned off by the outermost atomic block, which begins the transaction
+        self.transaction_start = None if autocommit else time.perf_counter()
+
+    def _commit(self):
+        try:
+            super()._commit()
+        finally:
+            self.observe_transaction("commit")
+
+    def _rollback(self):
+        try:
+            super()._rollback()
+        finally:
+            self.observe_transaction("rollback")
+
+    def observe_transaction(self, outcome: str):
+        if self.transaction_start is not None:
+            metrics.observe_transaction(time.perf_counter() - self.transaction_start, outcome)
+            self.transaction_start = None
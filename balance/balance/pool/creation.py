@@ -0,0 +1,12 @@
+from django.db.backends.postgresql import creation
+
+from .pool import all_pools
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Idle pooled connections would prevent DROP DATABASE
+        for (alias, params), pool in all_pools().items():
+            if dict(params).get("database") == test_database_name:
+                pool.close_idle()
+        super()._destroy_test_db(test_database_name, verbosity)
@@ -0,0 +1,242 @@
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """
+    An exception raised when no connection got free within the wait timeout
+    """
+    pass
+
+
+class PooledConnection:
+    """
+    A psycopg2 connection with the timestamps the pool needs
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.returned_at = self.created_at
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of persistent psycopg2 connections.
+
+    Settings:
+        max_size - the most connections open at once
+        timeout - seconds to wait for a free connection when all are in use
+        health_check_after - an idle connection is checked with `SELECT 1`
+            on checkout if it was idle for longer, 0 checks every checkout
+        max_lifetime - seconds after which a connection is closed
+            instead of being returned to the pool, None to keep forever
+    """
+    def __init__(self, connect: Callable, max_size: int = 10, timeout: float = 5,
+                 health_check_after: float = 30, max_lifetime: Optional[float] = 3600):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self.max_lifetime = max_lifetime
+
+        self._condition = threading.Condition()
+        self._idle: List[PooledConnection] = []
+        self._in_use: Dict[int, PooledConnection] = {}
+        self._opening = 0
+        # Taken back from the borrowers, being reset
+        self._returning = 0
+        self.counters = dict.fromkeys(
+            ("checkouts", "created", "closed", "waits", "timeouts",
+             "health_check_failures"), 0
+        )
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    @property
+    def size(self) -> int:
+        return len(self._idle) + len(self._in_use) + self._opening + self._returning
+
+    def checkout(self):
+        """
+        Takes an idle healthy connection or opens a new one if the pool
+        is not full, otherwise waits for a connection to be returned.
+        Raises PoolTimeout if no connection got free within the timeout
+        :return: psycopg2 connection
+        """
+        start = time.monotonic()
+        waited = False
+        with self._condition:
+            while True:
+                while self._idle:
+                    pooled = self._idle.pop()
+                    if self._is_healthy(pooled):
+                        self._in_use[id(pooled.connection)] = pooled
+                        self._count_checkout(start, waited)
+                        return pooled.connection
+                    self.counters["health_check_failures"] += 1
+                    self._close(pooled)
+                if self.size < self.max_size:
+                    self._opening += 1
+                    break
+                remaining = start + self.timeout - time.monotonic()
+                if remaining <= 0:
+                    self.counters["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"No free connection in the pool of {self.max_size} "
+                        f"within {self.timeout} seconds"
+                    )
+                waited = True
+                self._condition.wait(remaining)
+
+        try:
+            connection = self.connect()
+        except Exception:
+            with self._condition:
+                self._opening -= 1
+                self._condition.notify()
+            raise
+        pooled = PooledConnection(connection)
+        with self._condition:
+            self._opening -= 1
+            self._in_use[id(connection)] = pooled
+            self.counters["created"] += 1
+            self._count_checkout(start, waited)
+        return connection
+
+    def checkin(self, connection):
+        """
+        Returns the connection to the pool, rolling back an unfinished
+        transaction. Broken and expired connections are closed.
+        The connection counts to the size of the pool until it's idle
+        or closed, so that the waiters don't open one over max_size
+        """
+        with self._condition:
+            pooled = self._in_use.pop(id(connection), None)
+            if pooled is None:
+                connection.close()
+                return
+            self._returning += 1
+        reset = False
+        try:
+            reset = self._reset(pooled)
+        finally:
+            pooled.returned_at = time.monotonic()
+            with self._condition:
+                self._returning -= 1
+                if reset:
+                    self._idle.append(pooled)
+                else:
+                    self._close(pooled)
+                self._condition.notify()
+
+    def discard(self, connection):
+        """
+        Closes the connection instead of returning it to the pool
+        """
+        with self._condition:
+            pooled = self._in_use.pop(id(connection), None)
+            self._condition.notify()
+            if pooled is None:
+                connection.close()
+            else:
+                self._close(pooled)
+
+    def close_idle(self):
+        """
+        Closes all the idle connections
+        """
+        with self._condition:
+            while self._idle:
+                self._close(self._idle.pop())
+
+    def stats(self) -> dict:
+        with self._condition:
+            checkouts = self.counters["checkouts"]
+            return {
+                "max_size": self.max_size,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "wait_time_total": round(self.wait_time, 6),
+                "wait_time_avg": round(self.wait_time / checkouts, 6) if checkouts else 0.0,
+                "wait_time_max": round(self.max_wait_time, 6),
+                **self.counters,
+            }
+
+    def _count_checkout(self, start: float, waited: bool):
+        wait_time = time.monotonic() - start
+        self.counters["checkouts"] += 1
+        self.counters["waits"] += waited
+        self.wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def _expired(self, pooled: PooledConnection) -> bool:
+        return self.max_lifetime is not None \
+            and time.monotonic() - pooled.created_at > self.max_lifetime
+
+    def _is_healthy(self, pooled: PooledConnection) -> bool:
+        connection = pooled.connection
+        if connection.closed or self._expired(pooled):
+            return False
+        if time.monotonic() - pooled.returned_at < self.health_check_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            if not connection.autocommit:
+                connection.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def _reset(self, pooled: PooledConnection) -> bool:
+        connection = pooled.connection
+        if connection.closed or self._expired(pooled):
+            return False
+        status = connection.info.transaction_status
+        if status == extensions.TRANSACTION_STATUS_IDLE:
+            return True
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        try:
+            connection.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def _close(self, pooled: PooledConnection):
+        self.counters["closed"] += 1
+        try:
+            pooled.connection.close()
+        except psycopg2.Error:
+            pass
+
+
+_pools: Dict[Tuple, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+
+def get_pool(key: Tuple, connect: Callable, **options) -> ConnectionPool:
+    """
+    Returns the pool of the process for the connection parameters,
+    creating it on first use
+    """
+    global _pools, _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # Connections of the parent process can't be shared after fork
+            _pools, _pools_pid = {}, os.getpid()
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(connect, **options)
+        return pool
+
+
+def all_pools() -> Dict[Tuple, ConnectionPool]:
+    with _pools_lock:
+        return dict(_pools)
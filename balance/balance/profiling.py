@@ -0,0 +1,387 @@
+"""
+On-demand profiling of single API requests.
+
+A request under API_PATH_PREFIX is profiled if it carries the
+PROFILING_TOKEN in the X-Profile header, or is drawn with the probability
+of PROFILING_SAMPLE_RATE. Its cProfile stats and every SQL statement with
+its time and EXPLAIN plan are written as a bundle to PROFILING_DIR, the
+oldest bundles are removed to keep the directory under PROFILING_MAX_BYTES.
+
+cProfile sees only the thread it's enabled in, so a request is profiled
+in every thread that runs its code: under the ASGI server, its coroutine
+on the event loop between the steps of the other requests, the sync view
+in the thread of sync_to_async, and the functions the async views pass
+to sync_to_async wrapped with profiled(). The stats are merged.
+
+Without the token and the sample rate the middleware isn't used at all.
+With them, a request not profiled costs a header lookup and a random
+number, and a DB query a context variable lookup. A worker profiles one
+request at a time, the requests meanwhile go unprofiled.
+"""
+import asyncio
+import cProfile
+import functools
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import shutil
+import threading
+import time
+import types
+import uuid
+from contextvars import ContextVar
+from typing import List, Optional
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connections, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .middleware import is_api_request
+
+PROFILE_HEADER = "HTTP_X_PROFILE"
+
+# Statements of a request explained at most, the rest only timed
+MAX_EXPLAINS = 50
+
+# Statements of a request kept in the bundle at most
+MAX_QUERIES = 1000
+
+# Lines of the cProfile stats in the text report
+STATS_LINES = 60
+
+EXPLAINED = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+class Profile:
+    """
+    cProfile stats and SQL statements of one request
+    """
+    def __init__(self):
+        # A profiler for every run in a thread
+        self.profilers: List[cProfile.Profile] = []
+        # Threads with a profiler enabled
+        self.threads = set()
+        self.queries: List[dict] = []
+        self.dropped_queries = 0
+
+    def run(self, func, *args, **kwargs):
+        """
+        Calls the function with a profiler enabled in the current thread
+        """
+        thread = threading.get_ident()
+        if thread in self.threads:
+            return func(*args, **kwargs)
+        install_capture_wrappers()
+        profiler = cProfile.Profile()
+        self.profilers.append(profiler)
+        self.threads.add(thread)
+        profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            self.threads.discard(thread)
+
+    @types.coroutine
+    def step(self, coroutine):
+        """
+        Awaits the coroutine with a profiler enabled only while it runs,
+        not while the event loop runs the other tasks
+        """
+        profiler = cProfile.Profile()
+        self.profilers.append(profiler)
+        thread = threading.get_ident()
+        send, value = coroutine.send, None
+        while True:
+            self.threads.add(thread)
+            profiler.enable()
+            try:
+                future = send(value)
+            except StopIteration as e:
+                return e.value
+            finally:
+                profiler.disable()
+                self.threads.discard(thread)
+            try:
+                send, value = coroutine.send, (yield future)
+            except BaseException as e:
+                send, value = coroutine.throw, e
+
+    def stats(self, stream=None) -> pstats.Stats:
+        return pstats.Stats(*self.profilers, stream=stream)
+
+
+# Follows the request into the threads of sync_to_async
+_profile: ContextVar[Optional[Profile]] = ContextVar("profile", default=None)
+
+# A worker profiles one request at a time
+_busy = threading.Lock()
+
+
+def enabled() -> bool:
+    return bool(settings.PROFILING_TOKEN) or settings.PROFILING_SAMPLE_RATE > 0
+
+
+def profiled(func):
+    """
+    Wraps the function to profile it in the thread it runs in, when called
+    in a profiled request. For the functions passed to sync_to_async
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = _profile.get()
+        if profile is None:
+            return func(*args, **kwargs)
+        return profile.run(func, *args, **kwargs)
+    return wrapper
+
+
+def call_view(view_func, request, view_args, view_kwargs):
+    """
+    Calls the view as the handler does, rendering the response
+    in the same thread
+    """
+    response = view_func(request, *view_args, **view_kwargs)
+    if hasattr(response, "render") and callable(response.render):
+        response.render()
+    return response
+
+
+def capture_query(execute, sql, params, many, context):
+    """
+    Execute wrapper recording the statements of the profiled request
+    """
+    profile = _profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if len(profile.queries) < MAX_QUERIES:
+            profile.queries.append({
+                "alias": context["connection"].alias,
+                "sql": sql,
+                "params": params,
+                "many": many,
+                "seconds": time.perf_counter() - start,
+            })
+        else:
+            profile.dropped_queries += 1
+
+
+@receiver(connection_created)
+def install_capture_wrapper(sender, connection, **kwargs):
+    wrappers = connection.execute_wrappers
+    if not enabled():
+        if capture_query in wrappers:
+            wrappers.remove(capture_query)
+    elif capture_query not in wrappers:
+        # First, so that the wrappers pushed and popped around it stay in order
+        wrappers.insert(0, capture_query)
+
+
+def install_capture_wrappers():
+    """
+    Installs the wrapper on the connections of the thread
+    opened before the profiling was turned on
+    """
+    for connection in connections.all():
+        install_capture_wrapper(None, connection)
+
+
+def explain(query: dict) -> str:
+    """
+    Returns the plan of the statement, or the error of EXPLAIN.
+    Runs in a savepoint, so that an error leaves the transaction usable
+    """
+    try:
+        with transaction.atomic(using=query["alias"]), \
+                connections[query["alias"]].cursor() as cursor:
+            cursor.execute(f"EXPLAIN {query['sql']}", query["params"])
+            return "\n".join(row[0] for row in cursor.fetchall())
+    except DatabaseError as e:
+        return f"EXPLAIN failed: {e}".strip()
+
+
+def explain_queries(queries: List[dict]):
+    """
+    Adds the plans to the statements, the same statement explained once
+    """
+    plans = {}
+    for query in queries:
+        key = (query["alias"], query["sql"])
+        if query["many"] or not query["sql"].lstrip().upper().startswith(EXPLAINED):
+            continue
+        if key not in plans and len(plans) < MAX_EXPLAINS:
+            plans[key] = explain(query)
+        query["plan"] = plans.get(key)
+
+
+def profile_stats(profile: Profile) -> str:
+    stream = io.StringIO()
+    profile.stats(stream).sort_stats("cumulative").print_stats(STATS_LINES)
+    return stream.getvalue()
+
+
+def bundle_size(path: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def enforce_size_cap(directory: str, keep: str):
+    """
+    Removes the oldest bundles until the directory fits PROFILING_MAX_BYTES.
+    The bundle `keep` stays anyway
+    """
+    bundles = []
+    for entry in os.scandir(directory):
+        if entry.is_dir():
+            try:
+                bundles.append((entry.stat().st_mtime, entry.path, bundle_size(entry.path)))
+            except FileNotFoundError:
+                # Removed by another worker
+                continue
+    total = sum(size for _, _, size in bundles)
+    for _, path, size in sorted(bundles):
+        if total <= settings.PROFILING_MAX_BYTES:
+            break
+        if os.path.basename(path) != keep:
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+def write_bundle(request, response, profile: Profile, seconds: float, trigger: str) -> str:
+    """
+    Writes the profile of the request to a new directory in PROFILING_DIR
+    :return: str - name of the bundle
+    """
+    match = request.resolver_match
+    view = getattr(match.func, "view_class", match.func) if match else None
+    resource = getattr(view, "resource_name", "other")
+    name = f"{time.strftime('%Y%m%dT%H%M%S')}-{resource}-{uuid.uuid4().hex[:8]}"
+    path = os.path.join(settings.PROFILING_DIR, name)
+    os.makedirs(path)
+
+    profile.stats().dump_stats(os.path.join(path, "profile.prof"))
+    with open(os.path.join(path, "profile.txt"), "w") as file:
+        file.write(profile_stats(profile))
+    with open(os.path.join(path, "sql.json"), "w") as file:
+        json.dump({
+            "queries": [{**query, "params": None if query["many"] else query["params"]}
+                        for query in profile.queries],
+            "dropped_queries": profile.dropped_queries,
+            "seconds": sum(query["seconds"] for query in profile.queries),
+        }, file, indent=2, default=str)
+    with open(os.path.join(path, "request.json"), "w") as file:
+        json.dump({
+            "method": request.method,
+            "path": request.get_full_path(),
+            "resource": resource,
+            "status": response.status_code,
+            "seconds": seconds,
+            "trigger": trigger,
+            "pid": os.getpid(),
+        }, file, indent=2)
+
+    enforce_size_cap(settings.PROFILING_DIR, name)
+    return name
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the API requests asked for with the X-Profile header
+    or drawn by the sample rate. Async under an ASGI server, so that
+    the async views aren't serialized through a thread
+    """
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        if not enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.token = settings.PROFILING_TOKEN.encode()
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Django awaits the middleware marked as a coroutine function,
+            # and calls the coroutine process_view on the event loop
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+            self.process_view = self.aprocess_view
+
+    def trigger(self, request) -> Optional[str]:
+        """
+        Returns what asks to profile the request, None if nothing
+        """
+        header = request.META.get(PROFILE_HEADER)
+        if header is not None and self.token and hmac.compare_digest(header.encode(), self.token):
+            return "header"
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sample"
+        return None
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        trigger = self.trigger(request)
+        if trigger is None or not is_api_request(request) or not _busy.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            return self.profile(request, trigger)
+        finally:
+            _busy.release()
+
+    async def __acall__(self, request):
+        trigger = self.trigger(request)
+        if trigger is None or not is_api_request(request) or not _busy.acquire(blocking=False):
+            return await self.get_response(request)
+        try:
+            return await self.aprofile(request, trigger)
+        finally:
+            _busy.release()
+
+    def profile(self, request, trigger: str):
+        profile = Profile()
+        token = _profile.set(profile)
+        start = time.perf_counter()
+        try:
+            response = profile.run(self.get_response, request)
+        finally:
+            _profile.reset(token)
+        return self.finish(request, response, profile, time.perf_counter() - start, trigger)
+
+    async def aprofile(self, request, trigger: str):
+        profile = Profile()
+        token = _profile.set(profile)
+        start = time.perf_counter()
+        try:
+            response = await profile.step(self.get_response(request))
+        finally:
+            _profile.reset(token)
+        seconds = time.perf_counter() - start
+        return await sync_to_async(self.finish)(request, response, profile, seconds, trigger)
+
+    @staticmethod
+    def finish(request, response, profile: Profile, seconds: float, trigger: str):
+        explain_queries(profile.queries)
+        name = write_bundle(request, response, profile, seconds, trigger)
+        if trigger == "header":
+            response["X-Profile-Id"] = name
+        return response
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        """
+        Calls the sync view of the profiled request in the thread the handler
+        would call it in, with a profiler enabled there. The middleware after
+        this one do nothing in the API views
+        """
+        if _profile.get() is None or asyncio.iscoroutinefunction(view_func):
+            return None
+        return await sync_to_async(profiled(call_view))(view_func, request,
+                                                         view_args, view_kwargs)
@@ -0,0 +1,83 @@
+"""
+Routing of the read queries to the read replicas.
+
+Writes, reads inside transaction.atomic blocks on the primary and any reads
+not asked for explicitly stay on the primary. The read views route the reads
+of a user with `replica_for(user_id)` to one replica picked for the block,
+unless the user is pinned to the primary: the write views pin the users they
+changed for REPLICA_PIN_SECONDS after the commit, longer than the replicas
+lag behind, so a client never reads a balance older than its own write.
+The pins are kept in a cache shared by the workers.
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+from typing import Iterable, Iterator
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+# Alias for the reads of the current block, None routes them to the primary
+_read_alias = contextvars.ContextVar("read_alias", default=None)
+
+
+def pin_key(user_id: int) -> str:
+    return f"pin:{user_id}"
+
+
+def pin_to_primary(user_ids: Iterable[int]):
+    """
+    Pins the users to the primary once the current transaction commits
+    """
+    keys = {pin_key(user_id): True for user_id in set(user_ids)}
+    if settings.DATABASE_REPLICAS and keys:
+        transaction.on_commit(lambda: caches[settings.REPLICA_PIN_CACHE].set_many(
+            keys, settings.REPLICA_PIN_SECONDS
+        ))
+
+
+def is_pinned(user_id: int) -> bool:
+    return caches[settings.REPLICA_PIN_CACHE].get(pin_key(user_id), False)
+
+
+@contextmanager
+def replica_for(user_id: int) -> Iterator[str]:
+    """
+    Routes the reads of the block to one of the replicas, or to the primary
+    if the user is pinned to it, inside an atomic block on the primary
+    or if there are no replicas
+    :return: alias of the database the reads go to
+    """
+    replicas = settings.DATABASE_REPLICAS
+    alias = DEFAULT_DB_ALIAS
+    if replicas and not connections[DEFAULT_DB_ALIAS].in_atomic_block \
+            and not is_pinned(user_id):
+        alias = random.choice(replicas)
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Sends the reads asked for with `replica_for` to the replica,
+    everything else to the primary
+    """
+    def db_for_read(self, model, **hints) -> str:
+        alias = _read_alias.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints) -> str:
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints) -> bool:
+        # The replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints) -> bool:
+        return db == DEFAULT_DB_ALIAS
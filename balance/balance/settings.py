@@ -31,17 +31,45 @@ INSTALLED_APPS = [
     'balance.api'
 ]
 
+# The middleware of the site are skipped by the requests under API_PATH_PREFIX
 MIDDLEWARE = [
+    'balance.metrics.MetricsMiddleware',
+    'balance.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'balance.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'balance.middleware.CsrfViewMiddleware',
+    'balance.middleware.AuthenticationMiddleware',
+    'balance.middleware.MessageMiddleware',
+    'balance.middleware.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'balance.urls'
+API_PATH_PREFIX = '/api/'
+
+# Prometheus metrics on /metrics. Every worker writes its metrics
+# to METRICS_DIR every METRICS_FLUSH_INTERVAL seconds, the endpoint
+# sums those of all the workers on the host
+METRICS = os.environ.get("METRICS", "1") == "1"
+
+METRICS_DIR = os.environ.get("METRICS_DIR", "/tmp/balance-metrics")
+
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 1))
+
+# Profiling of the API requests sent with the header "X-Profile: PROFILING_TOKEN"
+# or drawn with the probability PROFILING_SAMPLE_RATE. The profiles are written
+# to PROFILING_DIR, the oldest removed above PROFILING_MAX_BYTES
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN", "")
+
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", 0))
+
+PROFILING_DIR = os.environ.get("PROFILING_DIR", "/tmp/balance-profiles")
+
+PROFILING_MAX_BYTES = int(os.environ.get("PROFILING_MAX_BYTES", 100 * 1024 * 1024))
+
+# The ASGI server routes the read views to their async versions
+ASYNC_VIEWS = os.environ.get("ASYNC_VIEWS", "0") == "1"
+
+ROOT_URLCONF = 'balance.asgi_urls' if ASYNC_VIEWS else 'balance.urls'
 
 TEMPLATES = [
     {
@@ -68,16 +96,119 @@ WSGI_APPLICATION = 'balance.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        # Connections are kept in a pool of the worker process,
+        # DB_POOL=0 opens a new connection for every request instead
+        'ENGINE': 'balance.pool' if os.environ.get("DB_POOL", "1") == "1"
+        else 'django.db.backends.postgresql_psycopg2',
         'NAME': os.environ["APP_DB"],
         'USER': os.environ["APP_DB_USER"],
         'PASSWORD': os.environ["APP_DB_PASS"],
         'HOST': os.environ["POSTGRES_HOST"],
-        'PORT': '5432'
+        'PORT': '5432',
+        'POOL': {
+            'max_size': int(os.environ.get("DB_POOL_MAX_SIZE", 10)),
+            'timeout': float(os.environ.get("DB_POOL_TIMEOUT", 5)),
+            'health_check_after': 30,
+            'max_lifetime': 3600,
+        }
+    }
+}
+
+# Read replicas of the primary, comma-separated hosts. The tests
+# (balance/settings_test.py) mirror one replica to the test database
+REPLICA_HOSTS = [host for host in os.environ.get("POSTGRES_REPLICA_HOSTS", "").split(",") if host]
+
+DATABASE_REPLICAS = []
+for number, host in enumerate(REPLICA_HOSTS, 1):
+    DATABASE_REPLICAS.append(f"replica{number}")
+    DATABASES[f"replica{number}"] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'TEST': {'MIRROR': 'default'},
     }
+
+DATABASE_ROUTERS = ['balance.routers.ReplicaRouter']
+
+# Seconds to read the balances of a user from the primary after a write,
+# longer than the replicas lag behind
+REPLICA_PIN_SECONDS = int(os.environ.get("REPLICA_PIN_SECONDS", 5))
+
+REPLICA_PIN_CACHE = 'replica_pins'
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Shared by all the workers on the host
+    'rates': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get("RATES_CACHE_DIR", "/tmp/balance-rates"),
+    },
+    'replica_pins': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get("REPLICA_PINS_CACHE_DIR", "/tmp/balance-replica-pins"),
+    },
+    # Has to be shared by all the workers: a write invalidates the balances
+    # only in the cache it can reach
+    'balances': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get("BALANCE_CACHE_DIR", "/tmp/balance-balances"),
+        'OPTIONS': {'MAX_ENTRIES': int(os.environ.get("BALANCE_CACHE_MAX_ENTRIES", 10000))},
+    },
+}
+
+# Serialized balances of get-balance, invalidated after the committed writes
+BALANCE_CACHE = 'balances'
+
+# Seconds to keep a serialized balance in the cache
+BALANCE_CACHE_TTL = int(os.environ.get("BALANCE_CACHE_TTL", 300))
+
+
+# Exchange rates for GetBalance currency conversion
+
+RATE_PROVIDER = 'balance.api.rates.ExchangeRateHostProvider'
+
+RATE_PROVIDER_OPTIONS = {"url": os.environ["RATES_URL"]} if "RATES_URL" in os.environ else {}
+
+RATES_CACHE = 'rates'
+
+# Seconds to keep the table of rates in the cache
+RATES_CACHE_TTL = int(os.environ.get("RATES_CACHE_TTL", 600))
+
+# Circuit breaker around the rate provider: a request waits for the rates
+# no longer than `budget` seconds, after `failure_threshold` failed calls
+# the provider is probed in the background every `reset_timeout` seconds
+RATES_BREAKER = {
+    'budget': float(os.environ.get("RATES_LATENCY_BUDGET", 0.5)),
+    'failure_threshold': 5,
+    'reset_timeout': 30,
 }
 
 
+# Balance snapshots built by the compact_balances command.
+# Transactions younger than the lag are left for the next run, so that
+# rows still being committed are never skipped
+BALANCE_SNAPSHOT_LAG = int(os.environ.get("BALANCE_SNAPSHOT_LAG", 300))
+
+# Longest period of transactions between two snapshots of a user, in seconds
+BALANCE_SNAPSHOT_STEP = int(os.environ.get("BALANCE_SNAPSHOT_STEP", 24 * 60 * 60))
+
+# Take the totals of whole days in get-statement from the daily rollups
+# built by the rollup_statements command
+STATEMENT_ROLLUP = os.environ.get("STATEMENT_ROLLUP", "1") == "1"
+
+# Seconds after the end of a day before the rollup_statements command rolls it up
+STATEMENT_ROLLUP_LAG = int(os.environ.get("STATEMENT_ROLLUP_LAG", 300))
+
+
+# Seconds to keep the responses to POST-requests with the Idempotency-Key header
+IDEMPOTENCY_KEY_TTL = int(os.environ.get("IDEMPOTENCY_KEY_TTL", 24 * 60 * 60))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -121,8 +252,14 @@ STATIC_URL = '/static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# The API is a token-less JSON API
 REST_FRAMEWORK = {
-    'COERCE_DECIMAL_TO_STRING': False
+    'COERCE_DECIMAL_TO_STRING': False,
+    'DEFAULT_RENDERER_CLASSES': ['balance.api.renderers.FastJSONRenderer'],
+    'DEFAULT_PARSER_CLASSES': ['balance.api.parsers.FastJSONParser'],
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'DEFAULT_PERMISSION_CLASSES': [],
+    'UNAUTHENTICATED_USER': None,
 }
 #     'EXCEPTION_HANDLER': 'rest_framework_json_api.exceptions.exception_handler',
 #     'DEFAULT_PAGINATION_CLASS':
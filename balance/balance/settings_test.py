@@ -0,0 +1,17 @@
+"""
+Settings of the tests:
+
+    python manage.py test --settings=balance.settings_test
+
+Without configured replicas one replica is mirrored to the test database,
+so that the routing is exercised
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES, DATABASE_REPLICAS
+
+if not DATABASE_REPLICAS:
+    DATABASE_REPLICAS = ["replica1"]
+    DATABASES["replica1"] = {
+        **DATABASES['default'],
+        'TEST': {'MIRROR': 'default'},
+    }
@@ -17,13 +17,23 @@ from django.contrib import admin
 from django.urls import path, re_path
 
 from .api import views
+from .metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path("metrics", metrics_view, name="metrics"),
     path("api/change-balance/", views.ChangeBalance.as_view(), name="change-balance"),
+    path("api/change-balances/", views.ChangeBalances.as_view(), name="change-balances"),
     re_path(r"^api/get-balance/(?P<user_id>\d+)/(?:currency=(?P<currency>\w+)/)?$",
             views.GetBalance.as_view(), name="get-balance"),
+    path("api/rates-status/", views.GetRatesStatus.as_view(), name="rates-status"),
+    path("api/pool-status/", views.GetPoolStatus.as_view(), name="pool-status"),
+    path("api/cache-status/", views.GetCacheStatus.as_view(), name="cache-status"),
     path("api/make-transfer/", views.MakeTransfer.as_view(), name="make-transfer"),
+    path("api/make-transfers/", views.MakeTransfers.as_view(), name="make-transfers"),
     re_path(r"^api/get-transactions/(?P<user_id>\d+)/(?:sort_by=(?P<sort_by>\w+)/)?$",
-            views.GetTransactions.as_view(), name="get-transactions")
+            views.GetTransactions.as_view(), name="get-transactions"),
+    path("api/get-statement/<int:user_id>/", views.GetStatement.as_view(), name="get-statement"),
+    re_path(r"^api/export-transactions/(?P<user_id>\d+)/(?:format=(?P<export_format>\w+)/)?$",
+            views.ExportTransactions.as_view(), name="export-transactions"),
 ]
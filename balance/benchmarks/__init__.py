@@ -0,0 +1,9 @@
+"""
+Benchmarks of the balance service.
+
+Every module is a script, run from the directory with manage.py:
+    python -m benchmarks.<module> --help
+
+The benchmarks create a throwaway test database, the same way
+`manage.py test` does, so they never touch the service's data.
+"""
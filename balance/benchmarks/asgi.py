@@ -0,0 +1,118 @@
+"""
+Concurrent reads of a single ASGI process against a slow rate provider.
+
+Serves the app with one uvicorn process, with the sync views and with
+their async versions, and sends get-balance requests with currency
+conversion at growing numbers of requests in flight. The rates are never
+cached and the local fake rate provider answers after `--delay` seconds,
+so every request waits for it. Reports throughput and latency percentiles
+per concurrency, stopping when the median latency exceeds ten delays,
+and the largest concurrency served with p99 latency within twice the delay.
+
+    python -m benchmarks.asgi --delay 0.2 --concurrency 1 10 50 200
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+
+import httpx
+
+from .common import free_port, start_uvicorn, test_database, report
+from .pool import latency_report
+
+from django.db import connections
+
+from balance.api.models import Balance
+from balance.api.tests.fake_rates import FakeRateServer
+
+USERS = 100
+
+
+def start_server(port: int, async_views: bool, rates_url: str, cache_dir: str):
+    return start_uvicorn(port, {
+        "ASYNC_VIEWS": "1" if async_views else "0",
+        "RATES_URL": rates_url,
+        "RATES_CACHE_DIR": cache_dir,
+        "RATES_CACHE_TTL": "0",
+        "RATES_LATENCY_BUDGET": "60",
+    })
+
+
+async def load(port: int, concurrency: int, requests: int) -> dict:
+    """
+    Sends the requests keeping `concurrency` of them in flight
+    """
+    latencies = []
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits,
+                                 timeout=300) as client:
+        async def run_client(count: int):
+            for i in range(count):
+                start = time.perf_counter()
+                res = await client.get(f"/api/get-balance/{i % USERS + 1}/currency=USD/")
+                latencies.append(time.perf_counter() - start)
+                assert res.status_code == 200, res.status_code
+                assert res.json()["data"]["currency"] == "USD", res.json()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(run_client(requests // concurrency)
+                               for _ in range(concurrency)))
+        seconds = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "requests_per_second": round(len(latencies) / seconds, 1),
+        **latency_report(latencies),
+    }
+
+
+def run(async_views: bool, rates_url: str, delay: float, concurrency: list,
+        rounds: int) -> dict:
+    port = free_port()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        process = start_server(port, async_views, rates_url, cache_dir)
+        try:
+            results = []
+            for clients in concurrency:
+                results.append(asyncio.run(load(port, clients, clients * rounds)))
+                # Higher concurrency would only queue up longer
+                if results[-1]["p50_ms"] > 10 * delay * 1000:
+                    break
+        finally:
+            process.terminate()
+            process.wait()
+    within_budget = [result["concurrency"] for result in results
+                     if result["p99_ms"] <= 2 * delay * 1000]
+    return {
+        "views": "async" if async_views else "sync",
+        "max_in_flight_within_2x_delay": max(within_budget, default=0),
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--delay", type=float, default=0.2,
+                        help="Seconds the fake rate provider takes to answer")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--rounds", type=int, default=5,
+                        help="Requests sent by every concurrent client")
+    args = parser.parse_args()
+
+    with test_database():
+        Balance.objects.bulk_create(
+            Balance(user_id=user_id, balance=1000) for user_id in range(1, USERS + 1)
+        )
+        connections.close_all()
+        with FakeRateServer() as rates_server:
+            rates_server.delay = args.delay
+            report([
+                run(async_views, rates_server.url, args.delay, args.concurrency, args.rounds)
+                for async_views in (False, True)
+            ])
+        connections.close_all()
+
+
+if __name__ == "__main__":
+    main()
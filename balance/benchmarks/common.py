@@ -0,0 +1,87 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "balance.settings")
+django.setup()
+
+from django.db import connections  # noqa: E402
+from django.test.utils import setup_databases, teardown_databases, \
+    setup_test_environment, teardown_test_environment  # noqa: E402
+
+
+@contextmanager
+def test_database():
+    """
+    Creates the test database with all migrations applied
+    and destroys it on exit
+    """
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        yield
+    finally:
+        connections.close_all()
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+
+class Timer:
+    """
+    Context manager measuring wall-clock time in seconds
+    """
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
+
+
+def report(results) -> None:
+    """
+    Writes benchmark results to stdout as JSON
+    """
+    json.dump(results, sys.stdout, indent=2, default=str)
+    sys.stdout.write("\n")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_uvicorn(port: int, env: dict, workers: int = 1) -> subprocess.Popen:
+    """
+    Starts uvicorn serving the app with the test database and the variables
+    of `env`, and waits until it answers
+    """
+    import httpx
+
+    env = {
+        **os.environ,
+        "APP_DB": connections["default"].settings_dict["NAME"],
+        **env,
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "balance.asgi:application",
+         "--port", str(port), "--log-level", "warning", "--workers", str(workers),
+         # Connections of the queued clients must not be closed as idle
+         "--timeout-keep-alive", "60"],
+        env=env
+    )
+    for _ in range(100):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/api/cache-status/", timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("uvicorn didn't start")
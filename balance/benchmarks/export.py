@@ -0,0 +1,80 @@
+"""
+Memory and speed of api/export-transactions/ for a heavy account.
+
+Seeds one user with the given number of rows, half sent and half received,
+streams the export in every format and reports rows per second and
+the resident memory of the process while streaming. The memory has to stay
+flat whatever the number of rows.
+
+    python -m benchmarks.export --rows 5000000
+"""
+import argparse
+import resource
+
+from .common import test_database, Timer, report
+from .statement import OTHER_USERS, seed
+
+from django.db import connection
+from django.test import Client
+
+from balance.api.models import Balance, Transaction
+
+USER_ID = OTHER_USERS + 1
+# Bytes of the streamed content between two samples of the memory
+SAMPLE_EVERY = 16 * 1024 * 1024
+
+
+def rss_mb() -> float:
+    """
+    Current resident memory of the process
+    """
+    with open("/proc/self/statm") as statm:
+        pages = int(statm.read().split()[1])
+    return pages * resource.getpagesize() / 2 ** 20
+
+
+def run(export_format: str, rows: int) -> dict:
+    client = Client()
+    before = rss_mb()
+    samples = []
+    size = next_sample = 0
+    with Timer() as timer:
+        res = client.get(f"/api/export-transactions/{USER_ID}/format={export_format}/")
+        assert res.status_code == 200, res.status_code
+        for chunk in res.streaming_content:
+            size += len(chunk)
+            if size >= next_sample:
+                samples.append(rss_mb())
+                next_sample += SAMPLE_EVERY
+    samples.append(rss_mb())
+    return {
+        "format": export_format,
+        "rows": rows,
+        "megabytes": round(size / 2 ** 20, 1),
+        "seconds": round(timer.seconds, 3),
+        "rows_per_second": round(rows / timer.seconds, 1),
+        "rss_before_mb": round(before, 1),
+        "rss_max_mb": round(max(samples), 1),
+        "rss_growth_mb": round(max(samples) - before, 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000000)
+    parser.add_argument("--formats", nargs="+", choices=["ndjson", "csv"],
+                        default=["ndjson", "csv"])
+    args = parser.parse_args()
+
+    with test_database():
+        Balance.objects.create(user_id=USER_ID, balance=0)
+        seed(USER_ID, args.rows)
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {Transaction._meta.db_table}")
+        report([run(export_format, args.rows) for export_format in args.formats])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""
+End-to-end load test of the API over HTTP.
+
+Clients send a weighted mix of change-balance, get-balance (in RUB and
+converted to USD), make-transfer and get-transactions requests for
+`--duration` seconds at every concurrency. A share of `hot` of the users
+picked is the first one, so the hot-account scenario piles the writes on
+a single balance row. Reports, per scenario and concurrency, throughput,
+error rate and latency percentiles overall and per endpoint as JSON, with
+the commit measured, so that runs of two commits can be compared:
+
+    python -m benchmarks.load --scenario read-heavy hot-account --concurrency 1 8 32 --output before.json
+    python -m benchmarks.load --compare before.json after.json
+
+By default serves the app with uvicorn (`--workers`, `--async-views`)
+against its own test database and a local fake rate provider. With `--url`
+loads a running server instead, e.g. `--url http://127.0.0.1:8000` of
+docker-compose; its users from `--first-user` get their balances topped
+up through change-balances and the rates come from its own provider.
+Every response but 200 and every transport error counts as an error.
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+from datetime import datetime, timezone
+
+import httpx
+
+from .pool import latency_report
+
+SCENARIOS = {
+    "read-heavy": {
+        "mix": {"get-balance": 50, "get-balance-usd": 10, "get-transactions": 20,
+                "change-balance": 10, "make-transfer": 10},
+        "hot": 0,
+    },
+    "write-heavy": {
+        "mix": {"change-balance": 40, "make-transfer": 40, "get-balance": 20},
+        "hot": 0,
+    },
+    "hot-account": {
+        "mix": {"make-transfer": 50, "change-balance": 30, "get-balance": 20},
+        "hot": 0.8,
+    },
+}
+
+SEED_BALANCE = 100000
+
+
+class Load:
+    """
+    Requests of the endpoints for the users from `first_user`,
+    the first one picked with the probability of `hot`
+    """
+    def __init__(self, first_user: int, users: int, hot: float, rng: random.Random):
+        self.first_user = first_user
+        self.users = users
+        self.hot = hot
+        self.rng = rng
+
+    def user(self) -> int:
+        if self.rng.random() < self.hot:
+            return self.first_user
+        return self.first_user + self.rng.randrange(self.users)
+
+    def other_user(self, user_id: int) -> int:
+        other = self.first_user + self.rng.randrange(self.users - 1)
+        return other + 1 if other >= user_id else other
+
+    def amount(self) -> float:
+        return self.rng.randint(1, 1000) / 100
+
+    def request(self, endpoint: str) -> tuple:
+        """
+        Returns the method, the path and the JSON body of a request to the endpoint
+        """
+        if endpoint == "get-balance":
+            return "GET", f"/api/get-balance/{self.user()}/", None
+        if endpoint == "get-balance-usd":
+            return "GET", f"/api/get-balance/{self.user()}/currency=USD/", None
+        if endpoint == "get-transactions":
+            return "GET", f"/api/get-transactions/{self.user()}/?limit=20", None
+        if endpoint == "change-balance":
+            amount = self.amount() * self.rng.choice((1, -1))
+            return "POST", "/api/change-balance/", {"user_id": self.user(), "amount": amount}
+        if endpoint == "make-transfer":
+            source_id = self.user()
+            target_id = self.other_user(source_id)
+            # Half of the transfers of the hot account are to it
+            if self.rng.random() < 0.5:
+                source_id, target_id = target_id, source_id
+            return "POST", "/api/make-transfer/", {
+                "source_id": source_id, "target_id": target_id, "amount": self.amount()
+            }
+        raise ValueError(f"Unknown endpoint {endpoint}")
+
+
+async def run_client(client: httpx.AsyncClient, load: Load, mix: dict,
+                     deadline: float, samples: list) -> None:
+    endpoints, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline:
+        endpoint = load.rng.choices(endpoints, weights)[0]
+        method, path, data = load.request(endpoint)
+        start = time.perf_counter()
+        try:
+            res = await client.request(method, path,
+                                       json=None if data is None else {"data": data})
+            outcome = res.status_code
+        except httpx.TransportError as e:
+            outcome = type(e).__name__
+        samples.append((endpoint, outcome, time.perf_counter() - start))
+
+
+def summary(samples: list, seconds: float) -> dict:
+    errors = sum(1 for _, outcome, _ in samples if outcome != 200)
+    return {
+        "throughput_rps": round(len(samples) / seconds, 1),
+        "error_rate": round(errors / len(samples), 4) if samples else 0,
+        **(latency_report([latency for _, _, latency in samples]) if samples
+           else {"requests": 0}),
+        "statuses": dict(Counter(str(outcome) for _, outcome, _ in samples)),
+    }
+
+
+async def measure(url: str, scenario: str, mix: dict, hot: float, concurrency: int,
+                  duration: float, first_user: int, users: int, seed: int) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        samples = []
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            run_client(client, Load(first_user, users, hot, random.Random(seed + i)),
+                       mix, start + duration, samples)
+            for i in range(concurrency)
+        ))
+        seconds = time.perf_counter() - start
+
+    by_endpoint = defaultdict(list)
+    for sample in samples:
+        by_endpoint[sample[0]].append(sample)
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "seconds": round(seconds, 3),
+        **summary(samples, seconds),
+        "endpoints": {endpoint: summary(by_endpoint[endpoint], seconds)
+                      for endpoint in mix},
+    }
+
+
+def seed_users(url: str, first_user: int, users: int) -> None:
+    """
+    Creates the users or tops up their balances, so that the
+    withdrawals and transfers of the run don't run out of money
+    """
+    rows = "".join(f"{user_id},{SEED_BALANCE}\n"
+                   for user_id in range(first_user, first_user + users))
+    res = httpx.post(f"{url}/api/change-balances/", content=f"user_id,amount\n{rows}",
+                     headers={"Content-Type": "text/csv"}, timeout=60)
+    res.raise_for_status()
+
+
+def parse_mix(value: str) -> dict:
+    """
+    Parses `endpoint=weight,...`
+    """
+    mix = {}
+    for item in value.split(","):
+        endpoint, _, weight = item.partition("=")
+        mix[endpoint.strip()] = float(weight or 1)
+    return mix
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def change(old: float, new: float) -> float:
+    return round((new - old) / old * 100, 1) if old else None
+
+
+def compare(old_path: str, new_path: str) -> dict:
+    """
+    Changes in percent of throughput and latency between two runs,
+    matched by scenario and concurrency
+    """
+    with open(old_path) as old_file, open(new_path) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+    old_results = {(r["scenario"], r["concurrency"]): r for r in old["results"]}
+    results = []
+    for result in new["results"]:
+        before = old_results.get((result["scenario"], result["concurrency"]))
+        if before is None:
+            continue
+        results.append({
+            "scenario": result["scenario"],
+            "concurrency": result["concurrency"],
+            "throughput_change_percent": change(before["throughput_rps"],
+                                                result["throughput_rps"]),
+            **{f"{key}_change_percent": change(before.get(key), result.get(key))
+               for key in ("p50_ms", "p95_ms", "p99_ms")},
+            "error_rate": [before["error_rate"], result["error_rate"]],
+        })
+    return {"old": old["meta"], "new": new["meta"], "results": results}
+
+
+def write(results: dict, output: str = None) -> None:
+    if output:
+        with open(output, "w") as file:
+            json.dump(results, file, indent=2)
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", nargs="+", choices=SCENARIOS,
+                        default=list(SCENARIOS))
+    parser.add_argument("--mix", help="Custom scenario, e.g. get-balance=3,make-transfer=1")
+    parser.add_argument("--hot", type=float, default=0,
+                        help="Share of the requests of the custom scenario to the first user")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=10,
+                        help="Seconds per scenario and concurrency")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--first-user", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", help="Server to load instead of a local one")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--async-views", action="store_true")
+    parser.add_argument("--output", help="File to save the results to")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="Compare two saved runs instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        write(compare(*args.compare), args.output)
+        return
+
+    scenarios = {name: SCENARIOS[name] for name in args.scenario}
+    if args.mix:
+        scenarios = {"custom": {"mix": parse_mix(args.mix), "hot": args.hot}}
+    for scenario in scenarios.values():
+        for endpoint in scenario["mix"]:
+            Load(1, 2, 0, random.Random()).request(endpoint)
+
+    with ExitStack() as stack:
+        url = args.url
+        if url is None:
+            # Sets up Django only for a local server
+            from .common import free_port, start_uvicorn, test_database
+            from balance.api.tests.fake_rates import FakeRateServer
+
+            stack.enter_context(test_database())
+            rates = stack.enter_context(FakeRateServer())
+            cache_dir = stack.enter_context(tempfile.TemporaryDirectory())
+            port = free_port()
+            server = start_uvicorn(port, {
+                "ASYNC_VIEWS": "1" if args.async_views else "0",
+                "RATES_URL": rates.url,
+                "RATES_CACHE_DIR": f"{cache_dir}/rates",
+                "BALANCE_CACHE_DIR": f"{cache_dir}/balances",
+                "REPLICA_PINS_CACHE_DIR": f"{cache_dir}/replica_pins",
+            }, workers=args.workers)
+            stack.callback(server.wait)
+            stack.callback(server.terminate)
+            url = f"http://127.0.0.1:{port}"
+
+        seed_users(url, args.first_user, args.users)
+        results = [
+            asyncio.run(measure(url, name, scenario["mix"], scenario["hot"], concurrency,
+                                args.duration, args.first_user, args.users, args.seed))
+            for name, scenario in scenarios.items()
+            for concurrency in args.concurrency
+        ]
+
+    write({
+        "meta": {
+            "commit": git_commit(),
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "url": args.url or "local",
+            "workers": None if args.url else args.workers,
+            "async_views": None if args.url else args.async_views,
+            "duration_s": args.duration,
+            "users": args.users,
+            "seed": args.seed,
+        },
+        "results": results,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Per-request overhead of the metrics.
+
+Calls the WSGI handler in process for every endpoint with the metrics
+off and on, like benchmarks.pipeline, in `--repeat` alternating runs,
+and reports the fastest mean time of a request of both. The difference
+is within the noise of a request, so the bookkeeping of a request and
+of a DB query is also timed alone: what the middleware does around
+a request and the execute wrapper around a query that does nothing.
+
+    python -m benchmarks.metrics --requests 2000 --repeat 5
+"""
+import argparse
+import time
+
+from .common import test_database, report
+from .pipeline import ENDPOINTS, measure
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connections
+from django.test import override_settings
+from django.test.client import RequestFactory
+
+from balance import metrics
+from balance.api.models import Balance
+
+USERS = 100
+
+
+def bookkeeping(calls: int) -> dict:
+    """
+    Mean time in microseconds of the bookkeeping of a request without
+    the view and of a query that does nothing
+    """
+    request = RequestFactory().get("/api/get-balance/1/")
+    response = object.__new__(type("Response", (), {"status_code": 200}))
+    middleware = metrics.MetricsMiddleware(lambda request: response)
+    view = type("View", (), {"resource_name": "get_balance"})
+
+    def serve():
+        middleware.process_view(request, view, (), {})
+        return response
+
+    middleware.get_response = lambda request: serve()
+    start = time.perf_counter()
+    for _ in range(calls):
+        middleware(request)
+    request_us = (time.perf_counter() - start) / calls * 1e6
+
+    start = time.perf_counter()
+    for _ in range(calls):
+        serve()
+    view_us = (time.perf_counter() - start) / calls * 1e6
+
+    def execute(sql, params, many, context):
+        return None
+
+    sql = "SELECT 1"
+    start = time.perf_counter()
+    for _ in range(calls):
+        metrics.observe_query(execute, sql, None, False, None)
+    query_us = (time.perf_counter() - start) / calls * 1e6
+
+    start = time.perf_counter()
+    for _ in range(calls):
+        execute(sql, None, False, None)
+    execute_us = (time.perf_counter() - start) / calls * 1e6
+
+    return {
+        "request_bookkeeping_us": round(request_us - view_us, 2),
+        "query_bookkeeping_us": round(query_us - execute_us, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000,
+                        help="Requests per endpoint, setting and run")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with test_database(), \
+            override_settings(RATE_PROVIDER="balance.api.tests.fake_rates.FakeRateProvider"):
+        Balance.objects.bulk_create(
+            Balance(user_id=user_id, balance=10 ** 6) for user_id in range(1, USERS + 1)
+        )
+        results = [bookkeeping(args.requests * 100)]
+        for name, method, path, data in ENDPOINTS:
+            timings = {}
+            # Alternating, so that the growing history doesn't favour one
+            for enabled in (False, True) * args.repeat:
+                with override_settings(METRICS=enabled):
+                    timings.setdefault(enabled, []).append(
+                        measure(WSGIHandler(), method, path, data, args.requests)
+                    )
+            off, on = (min(timings[enabled]) for enabled in (False, True))
+            results.append({
+                "endpoint": name,
+                "off_us": round(off, 1),
+                "on_us": round(on, 1),
+                "overhead_us": round(on - off, 1),
+            })
+        report(results)
+        connections.close_all()
+
+
+if __name__ == "__main__":
+    main()
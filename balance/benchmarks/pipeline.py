@@ -0,0 +1,152 @@
+"""
+Per-request overhead of the API request pipeline.
+
+Calls the WSGI handler in process, without a server, for every endpoint
+with the pipeline before the lean API pipeline (all the middleware of the
+site, DRF renderers, parsers, authentication and permissions by default)
+and with the current one, and reports the mean time of a request of both.
+The difference is the overhead saved, the rest is the work of the view.
+`cache-status` does no DB work, so it shows the overhead alone.
+
+    python -m benchmarks.pipeline --requests 2000
+"""
+import argparse
+import io
+import json
+import time
+from contextlib import ExitStack, contextmanager
+from unittest import mock
+
+from .common import test_database, report
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connections
+from django.test import override_settings
+
+from rest_framework.authentication import BasicAuthentication, SessionAuthentication
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.permissions import AllowAny
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.views import APIView
+
+from balance.api import views
+from balance.api.models import Balance
+
+USERS = 100
+
+SITE_MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+ENDPOINTS = [
+    ("cache-status", "GET", "/api/cache-status/", None),
+    ("get-balance", "GET", "/api/get-balance/1/", None),
+    ("get-balance USD", "GET", "/api/get-balance/1/currency=USD/", None),
+    ("get-transactions", "GET", "/api/get-transactions/1/", None),
+    ("get-statement", "GET", "/api/get-statement/1/", None),
+    ("change-balance", "POST", "/api/change-balance/", {"user_id": 1, "amount": 1}),
+    ("make-transfer", "POST", "/api/make-transfer/",
+     {"source_id": 1, "target_id": 2, "amount": 0.01}),
+    ("make-transfers", "POST", "/api/make-transfers/", {"transfers": [
+        {"source_id": 1, "target_id": user_id, "amount": 0.01} for user_id in range(2, 12)
+    ]}),
+]
+
+
+@contextmanager
+def pipeline(lean: bool):
+    """
+    Sets up the current pipeline or the one before the lean API pipeline
+    """
+    with ExitStack() as stack:
+        if not lean:
+            stack.enter_context(override_settings(MIDDLEWARE=SITE_MIDDLEWARE, REST_FRAMEWORK={
+                "COERCE_DECIMAL_TO_STRING": False,
+            }))
+            # The classes of the views are taken from the settings on import
+            for name, value in (
+                ("renderer_classes", [JSONRenderer, BrowsableAPIRenderer]),
+                ("parser_classes", [JSONParser, FormParser, MultiPartParser]),
+                ("authentication_classes", [SessionAuthentication, BasicAuthentication]),
+                ("permission_classes", [AllowAny]),
+            ):
+                stack.enter_context(mock.patch.object(APIView, name, value))
+            stack.enter_context(mock.patch.object(views.BaseView, "parser_classes", [JSONParser]))
+        yield WSGIHandler()
+
+
+def call(handler: WSGIHandler, method: str, path: str, data) -> int:
+    path, _, query = path.partition("?")
+    body = b"" if data is None else json.dumps({"data": data}).encode()
+    environ = {
+        "REQUEST_METHOD": method,
+        "PATH_INFO": path,
+        "QUERY_STRING": query,
+        "SERVER_NAME": "127.0.0.1",
+        "SERVER_PORT": "80",
+        "HTTP_HOST": "127.0.0.1",
+        "CONTENT_TYPE": "application/json",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.url_scheme": "http",
+    }
+    statuses = []
+    response = handler(environ, lambda status, headers: statuses.append(status))
+    b"".join(response)
+    response.close()
+    return int(statuses[0].split()[0])
+
+
+def measure(handler: WSGIHandler, method: str, path: str, data, requests: int) -> float:
+    """
+    Mean time of a request in microseconds
+    """
+    for _ in range(requests // 10):
+        assert call(handler, method, path, data) == 200
+    start = time.perf_counter()
+    for _ in range(requests):
+        call(handler, method, path, data)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000,
+                        help="Requests per endpoint and pipeline")
+    args = parser.parse_args()
+
+    with test_database(), \
+            override_settings(RATE_PROVIDER="balance.api.tests.fake_rates.FakeRateProvider"):
+        Balance.objects.bulk_create(
+            Balance(user_id=user_id, balance=10 ** 6) for user_id in range(1, USERS + 1)
+        )
+        results = []
+        for name, method, path, data in ENDPOINTS:
+            timings = {}
+            # Alternating, so that the growing history doesn't favour one
+            for lean in (False, True, False, True):
+                with pipeline(lean) as handler:
+                    timings.setdefault(lean, []).append(
+                        measure(handler, method, path, data, args.requests // 2)
+                    )
+            before, after = (sum(timings[lean]) / 2 for lean in (False, True))
+            results.append({
+                "endpoint": name,
+                "before_us": round(before, 1),
+                "after_us": round(after, 1),
+                "saved_us": round(before - after, 1),
+                "saved_percent": round((before - after) / before * 100, 1),
+            })
+        report(results)
+        connections.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Latency of api/get-balance/ with and without the connection pool.
+
+Runs the same requests in two child processes, one with DB_POOL=1
+and one with DB_POOL=0, and reports latency percentiles of both.
+
+    python -m benchmarks.pool --requests 2000 --clients 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def latency_report(latencies: list) -> dict:
+    """
+    Summary of latencies in seconds, reported in milliseconds
+    """
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+    }
+
+
+def run_child(requests: int, clients: int) -> dict:
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    from .common import test_database, Timer
+
+    from django.db import connections, close_old_connections
+    from django.test import Client
+
+    from balance.api.models import Balance
+
+    def run_client(count: int) -> list:
+        client = Client()
+        latencies = []
+        try:
+            for i in range(count):
+                start = time.perf_counter()
+                res = client.get(f"/api/get-balance/{i % 100 + 1}/")
+                # The test client keeps the connection open,
+                # a server closes it at the end of the request
+                close_old_connections()
+                latencies.append(time.perf_counter() - start)
+                assert res.status_code == 200, res.status_code
+        finally:
+            connections.close_all()
+        return latencies
+
+    with test_database():
+        Balance.objects.bulk_create(
+            Balance(user_id=user_id, balance=1000) for user_id in range(1, 101)
+        )
+        connections.close_all()
+        with Timer() as timer:
+            with ThreadPoolExecutor(max_workers=clients) as pool:
+                results = list(pool.map(run_client, [requests // clients] * clients))
+    latencies = [latency for result in results for latency in result]
+    return {
+        "engine": connections["default"].settings_dict["ENGINE"],
+        "clients": clients,
+        "requests_per_second": round(len(latencies) / timer.seconds, 1),
+        **latency_report(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        json.dump(run_child(args.requests, args.clients), sys.stdout)
+        return
+
+    results = {}
+    for name, flag in (("pooled", "1"), ("unpooled", "0")):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.pool", "--child",
+             "--requests", str(args.requests), "--clients", str(args.clients)],
+            env={**os.environ, "DB_POOL": flag},
+            check=True, capture_output=True, text=True
+        ).stdout
+        results[name] = json.loads(output)
+    results["p50_speedup"] = round(results["unpooled"]["p50_ms"] / results["pooled"]["p50_ms"], 2)
+
+    from .common import report
+    report(results)
+
+
+if __name__ == "__main__":
+    main()
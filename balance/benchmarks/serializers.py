@@ -0,0 +1,90 @@
+"""
+Rows per second of the DRF serializers against their values_list fast path.
+
+Reads pages of the account statement of a user as model instances
+serialized by StatementTransactionSerializer and as values_list tuples
+converted by ValuesSerializer, the way get-transactions does, and reports
+rows per second of the serialization alone and of the read with it.
+Checks that both paths render the same JSON.
+
+    python -m benchmarks.serializers --rows 100000 --page 10 100 1000
+"""
+import argparse
+import time
+from datetime import timedelta
+
+from .common import test_database, report
+
+from django.db import connections
+from django.utils import timezone
+
+from balance.api.models import Balance, Transaction
+from balance.api.renderers import FastJSONRenderer
+from balance.api.serializers import StatementTransactionSerializer, ValuesSerializer
+from balance.api.statement import AccountStatement
+
+USER_ID = 1
+
+
+def rows_per_second(func, rows: int, seconds: float = 1.0) -> float:
+    """
+    Runs the function for about `seconds`, returns the rows it handled per second
+    """
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        func()
+        calls += 1
+    return round(calls * rows / (time.perf_counter() - start))
+
+
+def run(page: int) -> dict:
+    statement = AccountStatement(USER_ID, ["-timestamp", "-id"])
+    fast = ValuesSerializer(StatementTransactionSerializer)
+    values = statement.values_list(*fast.sources)
+
+    instances = statement[:page]
+    rows = values[:page]
+    drf_json = FastJSONRenderer().render(StatementTransactionSerializer(instances, many=True).data)
+    assert FastJSONRenderer().render(fast.many(rows)) == drf_json, "outputs differ"
+
+    return {
+        "page": page,
+        "drf_serialize_rows_per_s": rows_per_second(
+            lambda: StatementTransactionSerializer(instances, many=True).data, page),
+        "fast_serialize_rows_per_s": rows_per_second(
+            lambda: ValuesSerializer(StatementTransactionSerializer).many(rows), page),
+        "drf_read_serialize_rows_per_s": rows_per_second(
+            lambda: StatementTransactionSerializer(statement[:page], many=True).data, page),
+        "fast_read_serialize_rows_per_s": rows_per_second(
+            lambda: ValuesSerializer(StatementTransactionSerializer).many(values[:page]), page),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000,
+                        help="Transactions of the user")
+    parser.add_argument("--page", type=int, nargs="+", default=[10, 100, 1000])
+    args = parser.parse_args()
+
+    with test_database():
+        Balance.objects.bulk_create([Balance(user_id=USER_ID, balance=1000),
+                                     Balance(user_id=USER_ID + 1, balance=1000)])
+        start = timezone.now() - timedelta(days=365)
+        Transaction.objects.bulk_create(
+            (Transaction(amount=i % 1000 + 0.01,
+                         source_id=USER_ID if i % 2 else USER_ID + 1,
+                         target_id=USER_ID + 1 if i % 2 else USER_ID,
+                         comment="Transfer",
+                         timestamp=start + timedelta(seconds=i))
+             for i in range(args.rows)),
+            batch_size=10000
+        )
+        report([run(page) for page in args.page])
+        connections.close_all()
+
+
+if __name__ == "__main__":
+    main()
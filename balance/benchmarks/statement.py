@@ -0,0 +1,105 @@
+"""
+Latency of api/get-transactions/ for users with large statements.
+
+Seeds one user per size with that many rows, half sent and half received,
+and reports the latency of the first page and of a page from the middle
+of the statement, for both orderings. With the statement served by index
+range scans, the latency doesn't grow with the number of rows.
+`--naive` also times the `source_id = X OR target_id = X` query for comparison.
+
+    python -m benchmarks.statement --rows 1000 100000 1000000 --repeat 20
+"""
+import argparse
+import time
+
+from .common import test_database, report
+from .pool import latency_report
+
+from django.db import connection
+from django.db.models import Q
+from django.test import Client
+
+from balance.api.models import Balance, Transaction
+from balance.api.pagination import KeysetPagination
+from balance.api.statement import AccountStatement
+
+# Counterparties of the benchmarked users
+OTHER_USERS = 10000
+ORDERINGS = {"date": ["-timestamp", "-id"], "amount": ["amount", "id"]}
+
+
+def seed(user_id: int, rows: int):
+    """
+    Inserts rows of the user, every second one received from another user
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {Transaction._meta.db_table} "
+            f"(amount, source_id, target_id, comment, timestamp) "
+            f"SELECT (i %% 10000) / 100.0 + 1, "
+            f"CASE WHEN i %% 2 = 0 THEN %s ELSE 1 + i %% %s END, "
+            f"CASE WHEN i %% 2 = 0 THEN 1 + i %% %s ELSE %s END, "
+            f"'Transfer', now() - make_interval(secs => i) "
+            f"FROM generate_series(1, %s) i",
+            [user_id, OTHER_USERS, OTHER_USERS, user_id, rows]
+        )
+
+
+def measure(client: Client, url: str, repeat: int) -> dict:
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = client.get(url)
+        latencies.append(time.perf_counter() - start)
+        assert res.status_code == 200, res.status_code
+    return latency_report(latencies)
+
+
+def measure_naive(user_id: int, ordering: list, repeat: int) -> dict:
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        list(Transaction.objects.filter(Q(source_id=user_id) | Q(target_id=user_id))
+             .order_by(*ordering)[:11])
+        latencies.append(time.perf_counter() - start)
+    return latency_report(latencies)
+
+
+def run(user_id: int, rows: int, repeat: int, naive: bool) -> dict:
+    client = Client()
+    result = {"rows": rows}
+    for sort_by, ordering in ORDERINGS.items():
+        url = f"/api/get-transactions/{user_id}/sort_by={sort_by}/?pagination=cursor"
+        middle = AccountStatement(user_id, ordering)[rows // 2:rows // 2 + 1][0]
+        key = ordering[0].lstrip("-")
+        cursor = KeysetPagination.encode_cursor(key, getattr(middle, key), middle.id, False)
+        result[sort_by] = {
+            "first_page": measure(client, url, repeat),
+            "middle_page": measure(client, f"{url}&cursor={cursor}", repeat),
+        }
+        if naive:
+            result[sort_by]["naive_or_first_page"] = measure_naive(user_id, ordering, repeat)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--naive", action="store_true")
+    args = parser.parse_args()
+
+    with test_database():
+        user_ids = [OTHER_USERS + i for i in range(1, len(args.rows) + 1)]
+        Balance.objects.bulk_create(Balance(user_id=user_id, balance=0) for user_id in user_ids)
+        for user_id, rows in zip(user_ids, args.rows):
+            seed(user_id, rows)
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {Transaction._meta.db_table}")
+        report([run(user_id, rows, args.repeat, args.naive)
+                for user_id, rows in zip(user_ids, args.rows)])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Stress benchmark of api/make-transfer/.
+
+Runs random transfers between a small set of accounts, so that
+the clients contend on the same rows, and reports transfers per second
+and the rate of retried transactions for every number of clients.
+
+    python -m benchmarks.transfers --clients 1 8 32 --transfers 2000
+"""
+import argparse
+import json
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from .common import test_database, Timer, report
+
+from django.db import connections
+from django.test import Client
+
+from balance.api.models import Balance
+from balance.api.retry import retry_stats
+
+INITIAL_BALANCE = 1000000
+
+
+def run_client(transfers: list) -> dict:
+    client = Client()
+    statuses = {}
+    try:
+        for source_id, target_id, amount in transfers:
+            payload = json.dumps({
+                "data": {
+                    "source_id": source_id,
+                    "target_id": target_id,
+                    "amount": amount
+                }
+            })
+            res = client.post("/api/make-transfer/", data=payload,
+                              content_type="application/json")
+            statuses[res.status_code] = statuses.get(res.status_code, 0) + 1
+    finally:
+        connections.close_all()
+    return statuses
+
+
+def run(clients: int, transfers: int, accounts: int) -> dict:
+    Balance.objects.all().update(balance=INITIAL_BALANCE)
+    retry_stats.reset()
+
+    pairs = []
+    for _ in range(transfers):
+        source_id, target_id = random.sample(range(1, accounts + 1), 2)
+        pairs.append((source_id, target_id, random.randint(1, 100)))
+    chunks = [pairs[i::clients] for i in range(clients)]
+
+    with Timer() as timer:
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            results = list(pool.map(run_client, chunks))
+
+    statuses = {}
+    for result in results:
+        for code, count in result.items():
+            statuses[code] = statuses.get(code, 0) + count
+    stats = retry_stats.as_dict()
+    return {
+        "clients": clients,
+        "transfers": transfers,
+        "seconds": round(timer.seconds, 3),
+        "transfers_per_second": round(transfers / timer.seconds, 1),
+        "retries": stats["retries"],
+        "retry_rate": round(stats["retries"] / max(stats["attempts"], 1), 4),
+        "failures": stats["failures"],
+        "statuses": statuses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--transfers", type=int, default=2000)
+    parser.add_argument("--accounts", type=int, default=10)
+    args = parser.parse_args()
+
+    with test_database():
+        Balance.objects.bulk_create(
+            Balance(user_id=user_id, balance=INITIAL_BALANCE)
+            for user_id in range(1, args.accounts + 1)
+        )
+        report([run(clients, args.transfers, args.accounts) for clients in args.clients])
+
+
+if __name__ == "__main__":
+    main()